@@ -11,6 +11,8 @@ _MQTT_user = ''                         # Mqtt User name
 _MQTT_pass = ''                         # Mqtt password
 _MQTT_TOPIC_SUB = 'SUBmcz'              # Topic général de souscription
 _MQTT_TOPIC_PUB = 'PUBmcz'              # Topic général de publication
+_MQTT_MAX_INFLIGHT = 100                # Messages QoS 1 en vol avant mise en attente par paho
+_MQTT_FULL_REFRESH_INTERVAL = 300       # Secondes entre deux publications completes (sinon seulement sur changement)
 _MCZip = ''                             # Adresse IP du poêle
 _MCZport = '81'                         # Port du serveur embarqué du poele
 _MCZ_device_serial = "xxxxxxxxxxxxx"    # n° de série du pôele
@@ -0,0 +1,114 @@
+# coding: utf-8
+
+'''
+Decodage des trames RecuperoInfo du cloud MCZ
+Les tables de correspondances (translations/data_*.py) sont indexees une seule fois
+par position dans la trame, chaque trame est ensuite decodee en un seul passage.
+Ces libelles ne servent qu'au topic JSON historique, l'etat du poele est decode par maestro_protocol.
+'''
+
+
+def secTOdhms(nb_sec):
+    qm, s = divmod(nb_sec, 60)
+    qh, m = divmod(qm, 60)
+    d, h = divmod(qh, 24)
+    return "%d:%d:%d:%d" % (d, h, m, s)
+
+
+def _hex_to_int(token):
+    return int(token, 16)
+
+
+def _hex_to_temperature(token):
+    return float(int(token, 16)) / 2
+
+
+def _hex_to_dhms(token):
+    return secTOdhms(int(token, 16))
+
+
+def _code_converter(codes):
+    """Return a converter from a frame code to its label, the first label of a code wins"""
+    labels = {}
+    for code, label in codes:
+        labels.setdefault(code, label)
+
+    def convert(token):
+        code = int(token, 16)
+        label = labels.get(code)
+        if label is None:
+            return ('Code inconnu :', str(code))
+        return label
+    return convert
+
+
+def _value_converter(position):
+    if position == 6 or position == 26 or position == 28:
+        return _hex_to_temperature
+    if 37 <= position <= 42:
+        return _hex_to_dhms
+    return _hex_to_int
+
+
+def build_translator(recupero_info):
+    """Index a RecuperoInfo table: tuple of (label, converter) or None by frame position"""
+    size = max(row[0] for row in recupero_info) + 1
+    translator = [None] * size
+    for row in recupero_info:
+        position = row[0]
+        if translator[position] is not None:
+            raise ValueError("Position " + str(position) + " en double dans la table RecuperoInfo")
+        if len(row) > 2:
+            translator[position] = (row[1], _code_converter(row[2]))
+        else:
+            translator[position] = (row[1], _value_converter(position))
+    return tuple(translator)
+
+
+def decode_frame(datas, translator, res):
+    """Decode the split frame into res (label -> value) in one pass"""
+    for field, token in zip(translator, datas):
+        if field is not None:
+            label, convert = field
+            res[label] = convert(token)
+    return res
+
+
+def power_level(value):
+    """Power level 1..5 of the discovery entities, the frames report it on top of 10"""
+    return min(5, max(1, value - 10))
+
+
+def individual_topics(state):
+    """Individual topic values of the discovery entities for decoded stove fields:
+    Power_Level as 1..5, also published on the Power_Level_Control number"""
+    topics = dict(state)
+    if "Power_Level" in topics:
+        topics["Power_Level"] = topics["Power_Level_Control"] = power_level(topics["Power_Level"])
+    return topics
+
+
+class FrameLabels(object):
+    """Localized labels of the legacy JSON topic, rendered only for the frame positions
+    whose raw token changed since the previous rendering"""
+    def __init__(self, translator):
+        self.translator = translator
+        self.last_tokens = ()
+
+    def reset(self):
+        """Forget the last frame, the next one is rendered completely"""
+        self.last_tokens = ()
+
+    def render(self, datas, res):
+        """Update res (label -> value) from the split frame, return the number of rendered fields"""
+        previous = self.last_tokens
+        known = len(previous)
+        rendered = 0
+        for position, (field, token) in enumerate(zip(self.translator, datas)):
+            if field is None or (position < known and previous[position] == token):
+                continue
+            label, convert = field
+            res[label] = convert(token)
+            rendered += 1
+        self.last_tokens = datas
+        return rendered
@@ -0,0 +1,115 @@
+# coding: utf-8
+
+'''
+Envoi des commandes vers le cloud MCZ
+Un seul thread depile les commandes dans l'ordre d'arrivee et limite le debit vers le poele.
+'''
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class CommandDispatcher(object):
+    """Single long-lived worker emitting queued commands in FIFO order, at most one every interval seconds"""
+
+    def __init__(self, emit, interval=1, is_connected=None, disconnected_wait=30):
+        """
+        Args:
+            emit: function called with the websocket command string
+            interval: minimum delay in seconds between two emits
+            is_connected: function telling if the cloud websocket is connected
+            disconnected_wait: delay in seconds before retrying while disconnected
+        """
+        self.emit = emit
+        self.interval = interval
+        self.is_connected = is_connected or (lambda: True)
+        self.disconnected_wait = disconnected_wait
+        self.emitted_count = 0
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._last_emit = None
+        self._emitting = False
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="CommandDispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+
+    def put(self, command):
+        """Queue a websocket command string, returns immediately"""
+        with self._condition:
+            self._pending.append(command)
+            self._condition.notify_all()
+
+    def pending(self):
+        with self._condition:
+            return list(self._pending)
+
+    def join(self, timeout=None):
+        """Wait until every queued command has been emitted, returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._emitting:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _wait(self, delay):
+        """Sleep up to delay seconds, returns False when the dispatcher is stopped"""
+        deadline = time.monotonic() + delay
+        while not self._stopped:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            self._condition.wait(remaining)
+        return False
+
+    def _run(self):
+        with self._condition:
+            while True:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                if self._last_emit is not None:
+                    if not self._wait(self._last_emit + self.interval - time.monotonic()):
+                        return
+                if not self.is_connected():
+                    logger.warning(f"Websocket disconnected ! waiting {self.disconnected_wait} seconds")
+                    self._last_emit = None
+                    if not self._wait(self.disconnected_wait):
+                        return
+                    continue
+                command = self._pending.popleft()
+                self._last_emit = time.monotonic()
+                self._emitting = True
+                self._condition.release()
+                try:
+                    self.emit(command)
+                    self.emitted_count += 1
+                except Exception as e:
+                    logger.error(f"Failed to send command {command}: {e}")
+                finally:
+                    self._condition.acquire()
+                    self._emitting = False
+                self._condition.notify_all()
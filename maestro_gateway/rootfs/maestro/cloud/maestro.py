@@ -3,11 +3,25 @@
 
 import json
 import logging
+import os
+import sys
 import time
 from logging.handlers import TimedRotatingFileHandler
 import paho.mqtt.client as mqtt
 import socketio
 
+from _data_ import RecuperoInfo
+from decoding import build_translator, individual_topics, FrameLabels
+from dispatcher import CommandDispatcher
+
+# The shared protocol package and the discovery module are in the parent directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
+from maestro_protocol.commands import MaestroCommandValue, maestrocommandvalue_to_websocket_string
+from maestro_protocol.messages import MaestroInfoDelta
+from maestro_protocol.registry import REGISTRY
+from maestro_protocol.publisher import PublishBatcher
+from maestro_protocol.recorder import FrameRecorder
+
 from _config_ import _MCZ_App_URL
 from _config_ import _MCZ_device_MAC
 from _config_ import _MCZ_device_serial
@@ -21,6 +35,23 @@ from _config_ import _MQTT_pass
 from _config_ import _MQTT_port
 from _config_ import _MQTT_user
 
+try:
+    from _config_ import _MQTT_MAX_INFLIGHT
+except ImportError:
+    _MQTT_MAX_INFLIGHT = 100
+
+try:
+    from _config_ import _MQTT_FULL_REFRESH_INTERVAL
+except ImportError:
+    _MQTT_FULL_REFRESH_INTERVAL = 300
+
+# Optional recording of the raw frames and commands (see maestro_protocol/recorder.py)
+try:
+    from _config_ import _RECORD_FRAMES, _RECORD_FILE
+except ImportError:
+    _RECORD_FRAMES = False
+    _RECORD_FILE = '/data/frames.log'
+
 try:
     import thread
 except ImportError:
@@ -54,17 +85,9 @@ except ImportError:
 
 if discovery_available:
     try:
-        import sys
-        import os
-        # Add parent dir for discovery and local commands
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        sys.path.append(base_dir + '/../')
-        sys.path.append(base_dir + '/../local')
         from discovery import DiscoveryManager
-        # Import command helpers from local implementation to map names to IDs
-        from commands import get_maestro_command, MaestroCommandValue, maestrocommandvalue_to_websocket_string
     except ImportError:
-        logger.warning("Discovery/commands module not available")
+        logger.warning("Discovery module not available")
         discovery_available = False
 
 sio = socketio.Client(logger=True, engineio_logger=True)
@@ -122,11 +145,17 @@ def on_connect_mqtt(client, userdata, flags, rc):
         sub = _MQTT_TOPIC_SUB
     logger.info(f"Subscribing to MQTT topic: {sub}")
     client.subscribe(sub, qos=1)
+
+    # Publish everything on the next frame
+    global last_full_refresh
+    last_full_refresh = None
     
     # Initialize and publish discovery configs only if connection successful
     global discovery_manager
     if discovery_available and discovery_manager:
-        discovery_manager.publish_discovery_configs()
+        discovery_manager.new_session()
+        # Only the configs that differ from the ones retained on the broker are published
+        discovery_manager.start_discovery_sync()
 
 def on_disconnect_mqtt(client, userdata, rc):
     if rc != 0:
@@ -141,149 +170,76 @@ def on_message_mqtt(client, userdata, message):
         if _MQTT_PAYLOAD_TYPE == 'TOPIC':
             # Extract command name from topic suffix
             command_name = topic[topic.rindex('/')+1:]
-            if 'get_maestro_command' in globals():
-                # Check debouncing for this command
-                current_time = time.time()
-                
-                # For temperature setpoints, debounce by command name only (so rapid changes get consolidated)
-                # For switches, debounce by command+value (so on/off can alternate)
-                if command_name in ['Temperature_Setpoint', 'Boiler_Setpoint', 'Power_Level']:
-                    command_key = command_name  # Allow consolidation of rapid value changes
-                    logger.info(f"DEBOUNCE: Using command key '{command_key}' for temperature/power command")
-                else:
-                    command_key = f"{command_name}_{payload}"  # Separate debouncing per value
-                    logger.info(f"DEBOUNCE: Using command key '{command_key}' for switch command")
-                
-                logger.info(f"DEBOUNCE: Current command_key='{command_key}', last_times keys: {list(last_command_time.keys())}")
-                
-                if command_key in last_command_time:
-                    time_since_last = current_time - last_command_time[command_key]
-                    logger.info(f"DEBOUNCE: Time since last {command_key}: {time_since_last:.1f}s (threshold: {COMMAND_DEBOUNCE_SECONDS}s)")
-                    if time_since_last < COMMAND_DEBOUNCE_SECONDS:
-                        logger.info(f"DEBOUNCE: BLOCKING command {command_name}: {time_since_last:.1f}s < {COMMAND_DEBOUNCE_SECONDS}s")
-                        return
-                    else:
-                        logger.info(f"DEBOUNCE: ALLOWING command {command_name}: {time_since_last:.1f}s >= {COMMAND_DEBOUNCE_SECONDS}s")
-                else:
-                    logger.info(f"DEBOUNCE: First time seeing command key '{command_key}' - allowing")
-                
-                # Update last command time
-                last_command_time[command_key] = current_time
-                logger.info(f"DEBOUNCE: Updated last_command_time['{command_key}'] = {current_time}")
-                
-                maestrocommand = get_maestro_command(command_name)
-                # Build websocket command string using local helper
-                mc = MaestroCommandValue(maestrocommand, payload)
-                ws_cmd = maestrocommandvalue_to_websocket_string(mc)
-                if ws_cmd:
-                    Message_MQTT.empile(ws_cmd)
-                    logger.info(f"Enqueue command from topic: {ws_cmd}")
-                    send()
+            if recorder is not None:
+                recorder.command(_DEVICE_ID, command_name, payload)
+            # Check debouncing for this command
+            current_time = time.time()
+            
+            # For temperature setpoints, debounce by command name only (so rapid changes get consolidated)
+            # For switches, debounce by command+value (so on/off can alternate)
+            if command_name in ['Temperature_Setpoint', 'Boiler_Setpoint', 'Power_Level']:
+                command_key = command_name  # Allow consolidation of rapid value changes
+                logger.info(f"DEBOUNCE: Using command key '{command_key}' for temperature/power command")
+            else:
+                command_key = f"{command_name}_{payload}"  # Separate debouncing per value
+                logger.info(f"DEBOUNCE: Using command key '{command_key}' for switch command")
+            
+            logger.info(f"DEBOUNCE: Current command_key='{command_key}', last_times keys: {list(last_command_time.keys())}")
+            
+            if command_key in last_command_time:
+                time_since_last = current_time - last_command_time[command_key]
+                logger.info(f"DEBOUNCE: Time since last {command_key}: {time_since_last:.1f}s (threshold: {COMMAND_DEBOUNCE_SECONDS}s)")
+                if time_since_last < COMMAND_DEBOUNCE_SECONDS:
+                    logger.info(f"DEBOUNCE: BLOCKING command {command_name}: {time_since_last:.1f}s < {COMMAND_DEBOUNCE_SECONDS}s")
+                    return
                 else:
-                    logger.warning(f"Invalid command payload for {command_name}: {payload}")
+                    logger.info(f"DEBOUNCE: ALLOWING command {command_name}: {time_since_last:.1f}s >= {COMMAND_DEBOUNCE_SECONDS}s")
+            else:
+                logger.info(f"DEBOUNCE: First time seeing command key '{command_key}' - allowing")
+            
+            # Update last command time
+            last_command_time[command_key] = current_time
+            logger.info(f"DEBOUNCE: Updated last_command_time['{command_key}'] = {current_time}")
+            
+            maestrocommand = REGISTRY.command(command_name)
+            # Build websocket command string using local helper
+            mc = MaestroCommandValue(maestrocommand, payload)
+            ws_cmd = maestrocommandvalue_to_websocket_string(mc)
+            if ws_cmd:
+                command_dispatcher.put(ws_cmd)
+                logger.info(f"Enqueue command from topic: {ws_cmd}")
             else:
-                logger.warning("Command helpers not available; cannot process TOPIC payloads")
+                logger.warning(f"Invalid command payload for {command_name}: {payload}")
         else:
             # Expect legacy "id,value" format
             parts = payload.split(",")
+            if recorder is not None:
+                recorder.command(_DEVICE_ID, parts[0], ",".join(parts[1:]))
             if len(parts) >= 2:
                 if parts[0] == "42":
                     parts[1] = int(float(parts[1]) * 2)
-                Message_MQTT.empile("C|WriteParametri|" + parts[0] + "|" + str(parts[1]))
-                logger.info('Contenu Pile Message_MQTT : ' + str(Message_MQTT.copiepile()))
-                send()
+                command_dispatcher.put("C|WriteParametri|" + parts[0] + "|" + str(parts[1]))
+                logger.info('Commandes en attente : ' + str(command_dispatcher.pending()))
             else:
                 logger.warning(f"Invalid legacy payload: {payload}")
     except Exception as e:
         logger.error(f"Exception in on_message_mqtt: {e}")
 
 
-def secTOdhms(nb_sec):
-    qm, s = divmod(nb_sec, 60)
-    qh, m = divmod(qm, 60)
-    d, h = divmod(qh, 24)
-    return "%d:%d:%d:%d" % (d, h, m, s)
-
-
-def publish_individual_discovery_topics(mqtt_data):
-    """Map French cloud data to English discovery topic names and publish individually"""
+def publish_individual_discovery_topics(state):
+    """Publish the decoded stove values on individual topics for the discovery entities"""
     if not discovery_available or not discovery_manager or not discovery_manager.discovery_enabled:
         return
     
-    # Mapping from French cloud names to English discovery entity keys
-    french_to_english_mapping = {
-        "Temperature ambiante": "Ambient_Temperature",
-        "Temperature des fumees": "Fume_Temperature", 
-        "Puffer Temperature": "Puffer_Temperature",
-        "Temperature chaudiere": "Boiler_Temperature",
-        "Temperature NTC3": "NTC3_Temperature",
-        "TEMP - Carte mere": "Temperature_Motherboard",
-        "Temperature retour": "Return_Temperature",
-        "Etat du poele": "Stove_State", 
-        "Etat du ventilateur ambiance": "Fan_State",
-        "Etat du ventilateur canalise 1": "DuctedFan1",
-        "Etat du ventilateur canalise 2": "DuctedFan2",
-        "RPM - Ventilateur fummees": "RPM_Fam_Fume",
-        "RPM - Vis sans fin - SET": "RPM_WormWheel_Set",
-        "RPM - Vis sans fin - LIVE": "RPM_WormWheel_Live",
-        "Etat de la bougie": "Candle_Condition",
-        "Brazero": "Brazier",
-        "3WayValve": "3WayValve",  # This might not exist in cloud data
-        "Pump_PWM": "Pump_PWM",    # This might not exist in cloud data
-        "Heures de fonctionnement total (s)": "Total_Operating_Hours",
-        "Heures avant entretien": "Hours_To_Service",
-        "Nombre d'allumages": "Number_Of_Ignitions",
-        "Sonde Pellets": "Pellet_Sensor",
-        # Power/mode states - need to convert to 1/0
-        "Etat du mode Active": "Power",  # On/Off -> 1/0
-        "Mode ECO": "Eco_Mode",          # On/Off -> 1/0 
-        "Silence": "Silent_Mode",        # On/Off -> 1/0
-        "Mode Chronotermostato": "Chronostat", # On/Off -> 1/0
-        "Etat effets sonores": "Sound_Effects", # On/Off -> 1/0
-        "Antigel": "AntiFreeze",         # On/Off -> 1/0
-        "TEMP - Consigne": "Temperature_Setpoint",
-        "TEMP - Boiler": "Boiler_Setpoint",
-    }
-    
-    base_topic = _MQTT_TOPIC_PUB.rstrip('/')
-    
-    for french_name, english_key in french_to_english_mapping.items():
-        if french_name in mqtt_data:
-            value = mqtt_data[french_name]
-            
-            # Convert boolean-like values to 1/0
-            if english_key in ["Power", "Eco_Mode", "Silent_Mode", "Chronostat", "Sound_Effects", "AntiFreeze"]:
-                if isinstance(value, str):
-                    value = 1 if value.lower() in ['on', 'oui', 'yes', 'true'] else 0
-            
-            # Handle special formatting
-            elif english_key == "Stove_State" and isinstance(value, str):
-                # Keep as string but could map to numbers later
-                pass
-            
-            # Publish to individual topic
-            topic = f"{base_topic}/{english_key}"
-            try:
-                client.publish(topic, str(value), 1)
-                logger.debug(f"Published {english_key}: {value} to {topic}")
-            except Exception as e:
-                logger.error(f"Failed to publish {english_key}: {e}")
-    
-    # Handle special case for Power_Level from "Puissance Active"
-    if "Puissance Active" in mqtt_data:
-        value = mqtt_data["Puissance Active"]
-        if isinstance(value, str) and "Puissance" in value:
-            import re
-            match = re.search(r'Puissance (\d+)', value)
-            if match:
-                power_level = int(match.group(1))
-                # Publish to both sensor and control topics
-                try:
-                    client.publish(f"{base_topic}/Power_Level", str(power_level), 1)
-                    client.publish(f"{base_topic}/Power_Level_Control", str(power_level), 1)
-                    logger.debug(f"Published Power_Level: {power_level}")
-                except Exception as e:
-                    logger.error(f"Failed to publish Power_Level: {e}")
+    base_topic = _MQTT_TOPIC_PUB.rstrip('/') + '/'
+    publisher.add_all(individual_topics(state), base_topic)
+
+    # One burst for all the topics, the unchanged ones are skipped
+    try:
+        count = publisher.flush()
+        logger.debug(f"Published {count} discovery topics")
+    except Exception as e:
+        logger.error(f"Failed to publish discovery topics: {e}")
 
 
 @sio.event
@@ -338,38 +294,50 @@ def disconnect():
 @sio.event
 def rispondo(response):
     logger.info("Received 'rispondo' message")
-    datas = response["stringaRicevuta"].split("|")
-    from _data_ import RecuperoInfo
-    for i in range(0, len(datas)):
-        for j in range(0, len(RecuperoInfo)):
-            if i == RecuperoInfo[j][0]:
-                if len(RecuperoInfo[j]) > 2:
-                    for k in range(0, len(RecuperoInfo[j][2])):
-                        if int(datas[i], 16) == RecuperoInfo[j][2][k][0]:
-                            MQTT_MAESTRO[RecuperoInfo[j][1]] = RecuperoInfo[j][2][k][1]
-                            break
-                        else:
-                            MQTT_MAESTRO[RecuperoInfo[j][1]] = ('Code inconnu :', str(int(datas[i], 16)))
-                else:
-                    if i == 6 or i == 26 or i == 28:
-                        MQTT_MAESTRO[RecuperoInfo[j][1]] = float(int(datas[i], 16)) / 2
+    global last_full_refresh
+    stringa = response["stringaRicevuta"]
+    if recorder is not None:
+        recorder.frame(_DEVICE_ID, stringa)
+    # Canonical state (numeric values, English keys), only the fields whose raw value changed are decoded
+    changes = update_stove_state(frame_delta.process(stringa))
+
+    # Publish only when a field changed, and everything every _MQTT_FULL_REFRESH_INTERVAL seconds
+    now = time.monotonic()
+    full_refresh = last_full_refresh is None or now - last_full_refresh >= _MQTT_FULL_REFRESH_INTERVAL
+    if full_refresh:
+        last_full_refresh = now
+        if publisher is not None:
+            publisher.forget()
+    elif not changes:
+        logger.info('Aucun changement, rien a publier')
+        return
+    else:
+        logger.info('Changements : ' + str(json.dumps(changes)))
 
-                    elif i >= 37 and i <= 42:
-                        MQTT_MAESTRO[RecuperoInfo[j][1]] = secTOdhms(int(datas[i], 16))
-                    else:
-                        MQTT_MAESTRO[RecuperoInfo[j][1]] = int(datas[i], 16)
+    # The localized labels are only rendered for the JSON topic, for the positions that changed
+    frame_labels.render(stringa.split("|"), MQTT_MAESTRO)
     logger.info('Publication sur le topic MQTT ' + str(_MQTT_TOPIC_PUB) + ' le message suivant : ' + str(
         json.dumps(MQTT_MAESTRO)))
     client.publish(_MQTT_TOPIC_PUB, json.dumps(MQTT_MAESTRO), 1)
     
-    # Also publish individual topics for discovery entities  
-    publish_individual_discovery_topics(MQTT_MAESTRO)
+    # Also publish individual topics for discovery entities (same keys and values as the local script)
+    publish_individual_discovery_topics(STOVE_STATE if full_refresh else changes)
     
-    # Ensure availability is online when publishing data
-    if discovery_available and discovery_manager:
+    # Ensure availability is online when publishing everything
+    if full_refresh and discovery_available and discovery_manager:
         discovery_manager.publish_availability_online()
 
 
+def update_stove_state(fields):
+    """Copy decoded fields into STOVE_STATE, return the ones whose value changed"""
+    changes = {}
+    for name, value in fields.items():
+        if name not in STOVE_STATE or STOVE_STATE[name] != value:
+            STOVE_STATE[name] = value
+            changes[name] = value
+    return changes
+
+
 def receive(*args):
     while True:
         time.sleep(30)
@@ -391,39 +359,38 @@ def receive(*args):
             time.sleep(30)
 
 
-def send():
-    def run(*args):
-        time.sleep(_INTERVALLE)
-        logger.info("Websocket still connected ? " + str(sio.connected))
-        if sio.connected:
-            if Message_MQTT.pilevide():
-                Message_MQTT.empile("C|RecuperoInfo")
-            cmd = Message_MQTT.depile()
-            logger.info("Envoi de la commande : " + str(cmd))
-            sio.emit(
-              "chiedo",
-               {
-                   "serialNumber": _MCZ_device_serial,
-                   "macAddress": _MCZ_device_MAC,
-                   "tipoChiamata": 1,
-                   "richiesta": cmd,
-               },
-            )
-        else:
-            logger.warning("Websocket disconnected ! waiting 30 seconds")
-            time.sleep(30)
-
-    thread.start_new_thread(run, ())
+def send(cmd):
+    logger.info("Envoi de la commande : " + str(cmd))
+    sio.emit(
+      "chiedo",
+       {
+           "serialNumber": _MCZ_device_serial,
+           "macAddress": _MCZ_device_MAC,
+           "tipoChiamata": 1,
+           "richiesta": cmd,
+       },
+    )
 
 
-Message_MQTT = PileFifo()
 Message_WS = PileFifo()
 
 _INTERVALLE = 1
 _TEMPS_SESSION = 60
 
+# Commands from MQTT are sent by a single worker, one every _INTERVALLE seconds
+command_dispatcher = CommandDispatcher(send, _INTERVALLE, lambda: sio.connected)
+
+# Stove state decoded by maestro_protocol, the localized labels of the JSON topic are in MQTT_MAESTRO
+STOVE_STATE = {}
 MQTT_MAESTRO = {}
+last_full_refresh = None
+frame_delta = MaestroInfoDelta()
+frame_labels = FrameLabels(build_translator(RecuperoInfo))
 discovery_manager = None
+recorder = None
+if _RECORD_FRAMES:
+    logger.info('Enregistrement des trames dans ' + _RECORD_FILE)
+    recorder = FrameRecorder(_RECORD_FILE)
 
 # Command debouncing to prevent rapid-fire commands
 last_command_time = {}
@@ -447,8 +414,7 @@ else:
 client.on_connect = on_connect_mqtt
 client.on_message = on_message_mqtt
 client.on_disconnect = on_disconnect_mqtt
-client.connect(_MQTT_ip, _MQTT_port)
-client.loop_start()
+publisher = PublishBatcher(client, 1, max_inflight=_MQTT_MAX_INFLIGHT, log=logger) if discovery_available else None
 
 # Initialize discovery manager
 if discovery_available:
@@ -463,4 +429,9 @@ if discovery_available:
     }
     discovery_manager = DiscoveryManager(client, discovery_config)
 
+# Connect once the discovery manager exists, on_connect_mqtt needs it
+client.connect(_MQTT_ip, _MQTT_port)
+client.loop_start()
+
+command_dispatcher.start()
 thread.start_new_thread(receive, ())
@@ -8,12 +8,30 @@ This module provides functionality to automatically discover and configure
 the MCZ Maestro stove in Home Assistant using MQTT Discovery.
 """
 
+import asyncio
+import hashlib
 import json
 import logging
+import threading
+import time
 from typing import Dict, List, Any, Optional
 
+from maestro_protocol.registry import REGISTRY
+
 logger = logging.getLogger(__name__)
 
+# Longest wait for the retained discovery configs when (re)connecting, in seconds
+RETAINED_READ_TIMEOUT = 2.0
+# The retained configs are all sent right after the subscription: stop after this much silence
+RETAINED_READ_QUIET = 0.3
+
+
+def payload_fingerprint(payload) -> str:
+    """Fingerprint of a discovery payload, a str or the bytes received from the broker"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    return hashlib.sha1(payload).hexdigest()
+
 
 class EntityDescriptor:
     """Describes a Home Assistant entity for MQTT Discovery"""
@@ -23,7 +41,8 @@ class EntityDescriptor:
                  value_template: Optional[str] = None, command_topic: Optional[str] = None,
                  min_value: Optional[float] = None, max_value: Optional[float] = None,
                  step: Optional[float] = None, mode: Optional[str] = None,
-                 payload_on: Optional[str] = None, payload_off: Optional[str] = None):
+                 payload_on: Optional[str] = None, payload_off: Optional[str] = None,
+                 entity_category: Optional[str] = None, optimistic: bool = False):
         self.key = key
         self.component_type = component_type
         self.friendly_name = friendly_name
@@ -39,10 +58,12 @@ class EntityDescriptor:
         self.mode = mode
         self.payload_on = payload_on
         self.payload_off = payload_off
+        self.entity_category = entity_category
+        self.optimistic = optimistic
 
 
-# Entity mapping for all stove sensors and controls
-ENTITY_DESCRIPTORS = [
+# Hand written entities, they replace the generated ones with the same key
+ENTITY_OVERRIDES = [
     # Temperature sensors
     EntityDescriptor("Ambient_Temperature", "sensor", "Ambient Temperature", 
                     unit="°C", icon="mdi:thermometer", device_class="temperature", 
@@ -140,6 +161,115 @@ ENTITY_DESCRIPTORS = [
                     min_value=1, max_value=5, step=1, mode="box"),
 ]
 
+# Metadata merged into the generated entities
+ENTITY_METADATA = {
+    "Hours_Of_Operation_In_Power1": {"icon": "mdi:clock"},
+    "Hours_Of_Operation_In_Power2": {"icon": "mdi:clock"},
+    "Hours_Of_Operation_In_Power3": {"icon": "mdi:clock"},
+    "Hours_Of_Operation_In_Power4": {"icon": "mdi:clock"},
+    "Hours_Of_Operation_In_Power5": {"icon": "mdi:clock"},
+    "Minutes_To_Switch_Off": {"unit": "min", "icon": "mdi:timer-outline"},
+    "Profile": {"min_value": 0, "max_value": 11},
+    "Sleep": {"min_value": 0, "max_value": 1},    # Reported as on/off in the frames
+    "Chronostat_T1": {"min_value": 5, "max_value": 30},
+    "Chronostat_T2": {"min_value": 5, "max_value": 30},
+    "Chronostat_T3": {"min_value": 5, "max_value": 30},
+    "Refresh": {"icon": "mdi:refresh"},
+    "Reset_Alarm": {"icon": "mdi:alarm-off"},
+}
+
+# Informations and commands deliberately not exposed
+EXCLUDED_ENTITIES = frozenset([
+    "Messagetype", "Unknown",   # Not stove values
+    "GetInfo",                  # Sent by the daemon itself
+    "Set_DateTime",             # Takes a date string
+    "Feeding_Screw",            # Runs the auger, not a remote control feature
+    "Reset_Active",
+    "Celsius_Fahrenheit",       # Display setting
+    "Adaptive_Mode",            # Writes the Profile parameter (id 149)
+])
+
+# Command categories whose commands are exposed (Diagnostics commands need the stove in diagnostics mode)
+EXPOSED_COMMAND_CATEGORIES = ("Basic", "Daemon")
+
+# Home Assistant component for a writable value by command type
+_WRITABLE_COMPONENTS = {
+    "onoff": "switch",
+    "onoff40": "switch",
+    "temperature": "number",
+    "int": "number",
+    "percentage": "number",
+}
+
+
+def _generated_descriptor(key: str, info, command) -> Optional[EntityDescriptor]:
+    """Entity for an information and/or a command of the registries, None when it cannot be exposed"""
+    attributes = {"friendly_name": key.replace("_", " ")}
+    writable = command is not None and command.commandcategory in EXPOSED_COMMAND_CATEGORIES
+    if writable and command.commandtype in _WRITABLE_COMPONENTS:
+        component = _WRITABLE_COMPONENTS[command.commandtype]
+        attributes.update(command_topic=True, entity_category="config", optimistic=info is None)
+        if command.commandtype == "temperature":
+            attributes.update(unit="°C", icon="mdi:thermometer", min_value=5, max_value=35, step=0.5, mode="box")
+        elif command.commandtype == "percentage":
+            attributes.update(unit="%", min_value=0, max_value=100, step=1, mode="box")
+        elif component == "number":
+            attributes.update(min_value=0, max_value=255, step=1, mode="box")
+    elif writable and info is None:
+        # Command with a fixed value (reset, refresh): a button sending it
+        component = "button"
+        attributes.update(command_topic=True, payload_on=command.commandtype if command.commandtype.isdigit() else "1")
+    elif info is not None:
+        attributes["entity_category"] = "diagnostic"
+        if info.messagetype == "onoff":
+            component = "binary_sensor"
+        else:
+            component = "sensor"
+            if info.messagetype == "temperature":
+                attributes.update(unit="°C", icon="mdi:thermometer", device_class="temperature",
+                                  state_class="measurement")
+            elif info.messagetype == "timespan":
+                attributes["icon"] = "mdi:clock"
+    else:
+        return None
+    attributes.update(ENTITY_METADATA.get(key, {}))
+    return EntityDescriptor(key, component, **attributes)
+
+
+def generate_entity_descriptors(informations=None, commands=None, overrides=None, excluded=EXCLUDED_ENTITIES):
+    """
+    Derive the discovery entities from the information and command registries
+    
+    Args:
+        informations / commands: registry entries, all of them by default
+        overrides: hand written EntityDescriptors replacing the generated ones with the same key
+        excluded: names not exposed
+        
+    Returns:
+        Tuple of EntityDescriptors: the overrides first, then the generated entities in frame order
+    """
+    informations = REGISTRY.informations() if informations is None else informations
+    commands = REGISTRY.commands() if commands is None else commands
+    overrides = ENTITY_OVERRIDES if overrides is None else overrides
+    
+    descriptors = list(overrides)
+    keys = set(entity.key for entity in overrides)
+    candidates = [(info.name, info) for info in informations]
+    candidates += [(command.name, None) for command in commands if command.commandcategory in EXPOSED_COMMAND_CATEGORIES]
+    for key, info in candidates:
+        if key in keys or key in excluded:
+            continue
+        command = REGISTRY.command(key)
+        descriptor = _generated_descriptor(key, info, command if command.name != "Unknown" else None)
+        if descriptor is not None:
+            descriptors.append(descriptor)
+            keys.add(key)
+    return tuple(descriptors)
+
+
+# Entity mapping for all stove sensors and controls, computed once
+ENTITY_DESCRIPTORS = generate_entity_descriptors()
+
 
 class DiscoveryManager:
     """Manages Home Assistant MQTT Discovery for the MCZ Maestro stove"""
@@ -162,6 +292,22 @@ class DiscoveryManager:
         self.command_topic = config.get('_MQTT_TOPIC_SUB', 'Maestro/Command').rstrip('/')
         self.availability_topic = f"{self.base_topic}/availability"
         
+        # Last availability published and the MQTT session it was published in
+        self.mqtt_session = 0
+        self.availability_state = None
+        self.availability_session = None
+        self.availability_published = 0
+        self.availability_suppressed = 0
+        
+        # Serialized discovery payloads by (entity key, config fingerprint)
+        self.config_fingerprint = payload_fingerprint(json.dumps(config, sort_keys=True, default=str))
+        self.payload_cache = {}
+        self.discovery_published = 0
+        self.discovery_skipped = 0
+        self.discovery_removed = 0
+        # Discovery sync of the asyncio runtime
+        self.sync_task = None
+        
         logger.info(f"Discovery Manager initialized. Enabled: {self.discovery_enabled}")
     
     def get_device_info(self) -> Dict[str, Any]:
@@ -217,6 +363,21 @@ class DiscoveryManager:
             else:
                 config["command_topic"] = f"{self.command_topic}/{entity.key}"
         
+        if entity.entity_category:
+            config["entity_category"] = entity.entity_category
+        if entity.optimistic:
+            config["optimistic"] = True
+        
+        # Binary sensor payloads
+        if entity.component_type == "binary_sensor":
+            config["payload_on"] = entity.payload_on or "1"
+            config["payload_off"] = entity.payload_off or "0"
+        
+        # Buttons send a fixed payload and have no state
+        if entity.component_type == "button":
+            del config["state_topic"]
+            config["payload_press"] = entity.payload_on or "1"
+        
         # Switch-specific payloads
         if entity.component_type == "switch":
             config["payload_on"] = entity.payload_on or "1"
@@ -237,50 +398,227 @@ class DiscoveryManager:
         
         return config
     
-    def publish_discovery_configs(self):
-        """Publish discovery configurations for all entities"""
+    def discovery_topic(self, entity: EntityDescriptor) -> str:
+        """Discovery topic format: <discovery_prefix>/<component>/<node_id>/<object_id>/config"""
+        object_id = f"{self.device_id}_{entity.key.lower()}"
+        return f"{self.discovery_prefix}/{entity.component_type}/{self.device_id}/{object_id}/config"
+    
+    def discovery_payload(self, entity: EntityDescriptor):
+        """Return (topic, payload, fingerprint) for an entity, serialized once per config"""
+        key = (entity.key, self.config_fingerprint)
+        cached = self.payload_cache.get(key)
+        if cached is None:
+            payload = json.dumps(self.build_entity_config(entity))
+            cached = (self.discovery_topic(entity), payload, payload_fingerprint(payload))
+            self.payload_cache[key] = cached
+        return cached
+    
+    def publish_discovery_configs(self, retained: Optional[Dict[str, str]] = None):
+        """
+        Publish discovery configurations for all entities
+        
+        Args:
+            retained: fingerprints by topic of the configs already retained on the broker,
+                      the identical ones are not published again. None publishes everything.
+        """
         if not self.discovery_enabled:
             logger.debug("MQTT Discovery disabled, skipping config publication")
             return
             
         logger.info("Publishing MQTT Discovery configurations...")
         
+        published = 0
         for entity in ENTITY_DESCRIPTORS:
             try:
-                config = self.build_entity_config(entity)
-                object_id = f"{self.device_id}_{entity.key.lower()}"
-                
-                # Discovery topic format: <discovery_prefix>/<component>/<node_id>/<object_id>/config
-                discovery_topic = f"{self.discovery_prefix}/{entity.component_type}/{self.device_id}/{object_id}/config"
+                discovery_topic, payload, fingerprint = self.discovery_payload(entity)
+                if retained is not None and retained.get(discovery_topic) == fingerprint:
+                    self.discovery_skipped += 1
+                    continue
                 
                 # Publish with retain=True so discovery persists
-                self.mqtt_client.publish(discovery_topic, json.dumps(config), retain=True)
+                self.mqtt_client.publish(discovery_topic, payload, retain=True)
+                published += 1
                 logger.debug(f"Published discovery config for {entity.friendly_name}")
                 
             except Exception as e:
                 logger.error(f"Failed to publish discovery config for {entity.friendly_name}: {e}")
+        self.discovery_published += published
+        logger.info(f"Published {published} of {len(ENTITY_DESCRIPTORS)} discovery configurations")
     
-    def publish_availability_online(self):
-        """Publish availability status as online"""
+    def read_retained_configs(self, timeout: float = RETAINED_READ_TIMEOUT,
+                              quiet: float = RETAINED_READ_QUIET) -> Optional[Dict[str, str]]:
+        """
+        Read back the discovery configs of this device retained on the broker through a short subscription.
+        Blocks up to timeout seconds, must not be called from the MQTT network thread.
+        
+        Returns:
+            Fingerprints by topic, None when the subscription failed
+        """
+        subscription = self.retained_subscription()
+        retained = {}
+        received = threading.Event()
+        on_config = self._retained_config_handler(retained, received)
+        
+        self.mqtt_client.message_callback_add(subscription, on_config)
+        try:
+            result, mid = self.mqtt_client.subscribe(subscription, qos=0)
+            if result != 0:
+                logger.warning(f"Could not subscribe to {subscription} ({result})")
+                return None
+            # Wait for the first config up to the timeout, then until the broker goes quiet
+            deadline = time.monotonic() + timeout
+            wait = timeout
+            while wait > 0 and received.wait(wait):
+                received.clear()
+                wait = min(quiet, deadline - time.monotonic())
+            self.mqtt_client.unsubscribe(subscription)
+        finally:
+            self.mqtt_client.message_callback_remove(subscription)
+        logger.info(f"Found {len(retained)} retained discovery configurations")
+        return retained
+    
+    async def read_retained_configs_async(self, timeout: float = RETAINED_READ_TIMEOUT,
+                                          quiet: float = RETAINED_READ_QUIET) -> Optional[Dict[str, str]]:
+        """
+        Same as read_retained_configs from a coroutine of the event loop driving the MQTT client
+        (asyncio runtime): the loop keeps reading the broker while it waits.
+        
+        Returns:
+            Fingerprints by topic, None when the subscription failed
+        """
+        subscription = self.retained_subscription()
+        retained = {}
+        received = asyncio.Event()
+        on_config = self._retained_config_handler(retained, received)
+        
+        self.mqtt_client.message_callback_add(subscription, on_config)
+        try:
+            result, mid = self.mqtt_client.subscribe(subscription, qos=0)
+            if result != 0:
+                logger.warning(f"Could not subscribe to {subscription} ({result})")
+                return None
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            wait = timeout
+            while wait > 0:
+                try:
+                    await asyncio.wait_for(received.wait(), wait)
+                except asyncio.TimeoutError:
+                    break
+                received.clear()
+                wait = min(quiet, deadline - loop.time())
+            self.mqtt_client.unsubscribe(subscription)
+        finally:
+            self.mqtt_client.message_callback_remove(subscription)
+        logger.info(f"Found {len(retained)} retained discovery configurations")
+        return retained
+    
+    def retained_subscription(self) -> str:
+        """Subscription matching the discovery configs of this device"""
+        return f"{self.discovery_prefix}/+/{self.device_id}/+/config"
+    
+    @staticmethod
+    def _retained_config_handler(retained: Dict[str, str], received):
+        """MQTT callback storing the fingerprints of the retained configs and setting the received event"""
+        def on_config(client, userdata, message):
+            if message.retain and message.payload:
+                retained[message.topic] = payload_fingerprint(message.payload)
+            received.set()
+        return on_config
+    
+    def remove_stale_configs(self, retained: Dict[str, str]):
+        """Remove the retained configs of entities that no longer exist, e.g. renamed in a new release"""
+        current = set(self.discovery_topic(entity) for entity in ENTITY_DESCRIPTORS)
+        for discovery_topic in sorted(set(retained) - current):
+            try:
+                self.mqtt_client.publish(discovery_topic, "", retain=True)
+                self.discovery_removed += 1
+                logger.info(f"Removed stale discovery config {discovery_topic}")
+            except Exception as e:
+                logger.error(f"Failed to remove stale discovery config {discovery_topic}: {e}")
+    
+    def sync_discovery_configs(self, timeout: float = RETAINED_READ_TIMEOUT):
+        """Reconcile the broker with the current entities: publish the configs that are missing or
+        differ from the retained ones and remove the retained configs of unknown entities"""
         if not self.discovery_enabled:
             return
-            
         try:
-            self.mqtt_client.publish(self.availability_topic, "online", retain=True)
-            logger.debug("Published availability: online")
+            retained = self.read_retained_configs(timeout)
         except Exception as e:
-            logger.error(f"Failed to publish availability online: {e}")
+            logger.error(f"Failed to read the retained discovery configs: {e}")
+            retained = None
+        self.apply_retained_configs(retained)
     
-    def publish_availability_offline(self):
-        """Publish availability status as offline"""
+    async def sync_discovery_configs_async(self, timeout: float = RETAINED_READ_TIMEOUT):
+        """sync_discovery_configs as a coroutine of the event loop driving the MQTT client"""
+        if not self.discovery_enabled:
+            return
+        try:
+            retained = await self.read_retained_configs_async(timeout)
+        except Exception as e:
+            logger.error(f"Failed to read the retained discovery configs: {e}")
+            retained = None
+        self.apply_retained_configs(retained)
+    
+    def apply_retained_configs(self, retained: Optional[Dict[str, str]]):
+        """Publish the configs that differ from the retained ones and remove the stale ones"""
+        self.publish_discovery_configs(retained)
+        if retained:
+            self.remove_stale_configs(retained)
+    
+    def start_discovery_sync(self):
+        """Run sync_discovery_configs in the background, e.g. from the MQTT on_connect callback:
+        as a task when called from a running event loop (asyncio runtime), else in a thread"""
+        if not self.discovery_enabled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            threading.Thread(target=self.sync_discovery_configs, name="DiscoverySync", daemon=True).start()
+            return
+        # The loop only keeps a weak reference to its tasks
+        self.sync_task = loop.create_task(self.sync_discovery_configs_async())
+    
+    def new_session(self):
+        """Call on every MQTT (re)connection: the next availability is published even if unchanged"""
+        self.mqtt_session += 1
+    
+    def publish_availability(self, state: str):
+        """Publish the availability state, only on transitions or after a reconnection"""
         if not self.discovery_enabled:
             return
+        
+        if state == self.availability_state and self.availability_session == self.mqtt_session:
+            self.availability_suppressed += 1
+            return
             
         try:
-            self.mqtt_client.publish(self.availability_topic, "offline", retain=True)
-            logger.debug("Published availability: offline")
+            self.mqtt_client.publish(self.availability_topic, state, retain=True)
+            self.availability_state = state
+            self.availability_session = self.mqtt_session
+            self.availability_published += 1
+            logger.debug(f"Published availability: {state}")
         except Exception as e:
-            logger.error(f"Failed to publish availability offline: {e}")
+            logger.error(f"Failed to publish availability {state}: {e}")
+    
+    def publish_availability_online(self):
+        """Publish availability status as online"""
+        self.publish_availability("online")
+    
+    def publish_availability_offline(self):
+        """Publish availability status as offline"""
+        self.publish_availability("offline")
+    
+    def metrics(self) -> Dict[str, int]:
+        """Return counters: availability messages published and suppressed because unchanged,
+        discovery configs published, skipped because already retained on the broker and removed as stale"""
+        return {
+            'availability_published': self.availability_published,
+            'availability_suppressed': self.availability_suppressed,
+            'discovery_published': self.discovery_published,
+            'discovery_skipped': self.discovery_skipped,
+            'discovery_removed': self.discovery_removed,
+        }
     
     def cleanup_discovery_configs(self):
         """Remove discovery configurations (publish empty payload)"""
@@ -291,8 +629,7 @@ class DiscoveryManager:
         
         for entity in ENTITY_DESCRIPTORS:
             try:
-                object_id = f"{self.device_id}_{entity.key.lower()}"
-                discovery_topic = f"{self.discovery_prefix}/{entity.component_type}/{self.device_id}/{object_id}/config"
+                discovery_topic = self.discovery_topic(entity)
                 
                 # Publish empty payload with retain=True to remove the config
                 self.mqtt_client.publish(discovery_topic, "", retain=True)
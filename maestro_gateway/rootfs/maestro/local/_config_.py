@@ -10,8 +10,15 @@ _MQTT_pass = ''			                # Mqtt password
 _MQTT_TOPIC_SUB = 'Maestro/Command/'	# Publish command messages here (mandatory trailing slash)
 _MQTT_TOPIC_PUB = 'Maestro/'	        # Information messages by daemon are published here (mandatory trailing slash)
 _MQTT_PAYLOAD_TYPE = 'TOPIC'            # Payload as seperate subtopic (_MQTT_PAYLOAD_TYPE='TOPIC') or as JSON (_MQTT_PAYLOAD_TYPE='JSON'), recommended is TOPIC.
+_MQTT_MAX_INFLIGHT = 100                # QoS 1 messages in flight before paho queues the next ones
 _WS_RECONNECTS_BEFORE_ALERT = 5         # Attempts to reconnect to webserver before publishing a alert on topic Maestro/Status
 _REFRESH_INTERVAL = 15.0                # Refresh interval for stove information in seconds
+_POLL_INTERVAL_FAST = 5.0               # Refresh interval during ignition and state transitions or while the fume temperature moves fast
+_POLL_INTERVAL_SLOW = 60.0              # Refresh interval when the stove is off or in standby
+_POLL_BURST_INTERVAL = 3.0              # Refresh interval right after a command
+_POLL_BURST_DURATION = 60.0             # Duration of the burst polling after a command in seconds
+_POLL_FUME_RATE_THRESHOLD = 5.0         # Fume temperature change (degrees per minute) above which the refresh interval is fast
+_ASYNC_RUNTIME = False                  # Run websocket, MQTT, polling and sender on a single asyncio event loop
 _MCZip ='192.168.120.1'				    # Stove IP Address. This probably is always this address.
 _MCZport = '81'						    # Websocket Port
 _VERSION = '1.03'					    # Version
@@ -0,0 +1,249 @@
+#coding: utf-8
+'''
+MCZ Maestro asyncio runtime
+Optional runtime driving the websocket, the MQTT client, the stove polling and the
+command sender of every stove from a single event loop (one thread) instead of one thread per task.
+The frame and MQTT message handlers of the stove sessions are reused unchanged.
+'''
+
+import asyncio
+import logging
+
+import paho.mqtt.client as mqtt
+import websockets
+
+from maestro_protocol.commands import maestrocommandvalue_to_websocket_string
+from sender import SESSION_DURATION, SESSION_END_COMMAND
+
+logger = logging.getLogger(__name__)
+
+class AsyncMqttAdapter(object):
+    """Drives a paho client from the event loop through its socket callbacks instead of loop_start()"""
+    def __init__(self, loop, client, log=logger):
+        self.loop = loop
+        self.client = client
+        self.log = log
+        self.misc = None
+        self.disconnected = asyncio.Event()
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def _call_in_loop(self, callback, *args):
+        """The socket callbacks also come from the executor thread connecting to the broker
+        and from the threads publishing with the client"""
+        if self._in_loop():
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _in_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    # Socket numbers are read in the callback, paho closes the socket right after on_socket_close
+    def on_socket_open(self, client, userdata, sock):
+        self._call_in_loop(self._socket_opened, sock.fileno())
+
+    def _socket_opened(self, fd):
+        self.disconnected.clear()
+        self.loop.add_reader(fd, self.client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self._call_in_loop(self._socket_closed, sock.fileno())
+
+    def _socket_closed(self, fd):
+        self.loop.remove_reader(fd)
+        self.loop.remove_writer(fd)
+        if self.misc is not None:
+            self.misc.cancel()
+            self.misc = None
+        self.disconnected.set()
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.add_writer, sock.fileno(), client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.remove_writer, sock.fileno())
+
+    async def misc_loop(self):
+        """Keepalive and retries, what loop_start() does every second"""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+        self.disconnected.set()
+
+    async def run(self, host, port, retry_delay=5):
+        """Connect and reconnect to the broker forever"""
+        self.client.connect_async(host, port)
+        while True:
+            self.disconnected.clear()
+            try:
+                # Name resolution and TCP connect block: keep them off the event loop
+                await self.loop.run_in_executor(None, self.client.reconnect)
+            except OSError as e:
+                self.log.info(f"MQTT: Connection failed ({e}), retrying in {retry_delay}s")
+                await asyncio.sleep(retry_delay)
+                continue
+            await self.disconnected.wait()
+            await asyncio.sleep(1)
+
+class AsyncGateway(object):
+    """Websocket session, poll scheduler and command sender running as coroutines of one event loop"""
+    def __init__(self, url, command_queue, on_frame, on_open, on_close, on_reconnect, scheduler,
+                 on_sent=None, on_rotate=None, log=logger):
+        """
+        Args:
+            url: websocket url of the stove
+            command_queue: CoalescingQueue with the commands to write
+            on_frame: called with every text message received from the stove
+            on_open / on_close: called when a websocket session starts / ends
+            on_reconnect: called after a session ended, before reconnecting
+            scheduler: PollScheduler queueing the stove info requests, its ticks run on the event loop
+            on_sent: optional, called with each command written on the websocket
+            on_rotate: optional, called when a session is closed after SESSION_DURATION
+        """
+        self.url = url
+        self.command_queue = command_queue
+        self.on_frame = on_frame
+        self.on_open = on_open
+        self.on_close = on_close
+        self.on_reconnect = on_reconnect
+        self.scheduler = scheduler
+        self.on_sent = on_sent
+        self.on_rotate = on_rotate
+        self.log = log
+        self.loop = None
+        self.wakeup = None
+        self.poll_wakeup = None
+
+    def _queue_listener(self):
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def _poll_listener(self):
+        self.loop.call_soon_threadsafe(self.poll_wakeup.set)
+
+    async def poll(self):
+        """Run the scheduler ticks, loop.time() is the same monotonic clock the scheduler thread uses"""
+        while True:
+            delay = self.scheduler.next_delay(self.loop.time())
+            self.poll_wakeup.clear()
+            try:
+                await asyncio.wait_for(self.poll_wakeup.wait(), delay)
+                self.scheduler.restart(self.loop.time())
+            except asyncio.TimeoutError:
+                pass
+            self.scheduler.run_once()
+
+    async def send_commands(self, ws):
+        """Write queued commands as soon as they are queued until the session expires"""
+        deadline = self.loop.time() + SESSION_DURATION
+        while True:
+            while not self.command_queue.empty():
+                command = self.command_queue.get_nowait()
+                if command.command is SESSION_END_COMMAND:
+                    continue
+                try:
+                    cmd = maestrocommandvalue_to_websocket_string(command)
+                except ValueError:
+                    self.log.warning(f"Invalid value for {command.command.name}, command skipped: {command.value}")
+                    continue
+                if cmd != "":
+                    self.log.info("Websocket: Send " + str(cmd))
+                    await ws.send(cmd)
+                    if self.on_sent is not None:
+                        self.on_sent(command)
+                else:
+                    self.log.error(f"Invalid command: {command.command.name} Value: {command.value}")
+            self.wakeup.clear()
+            if not self.command_queue.empty():
+                continue
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        self.log.info('Closing Websocket Connection')
+        if self.on_rotate is not None:
+            self.on_rotate()
+
+    async def receive(self, ws):
+        async for message in ws:
+            try:
+                self.on_frame(message)
+            except Exception as e:
+                self.log.error('Exception in on_message: ' + str(e))
+
+    async def session(self):
+        async with websockets.connect(self.url, ping_interval=5, ping_timeout=2) as ws:
+            self.on_open()
+            tasks = [asyncio.create_task(self.send_commands(ws)), asyncio.create_task(self.receive(ws))]
+            try:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        self.log.info(task.exception())
+            finally:
+                for task in tasks:
+                    task.cancel()
+                self.on_close()
+
+    async def websocket(self):
+        while True:
+            self.log.info("Websocket: Establishing connection to server (" + self.url + ")")
+            try:
+                await self.session()
+            except (OSError, websockets.WebSocketException) as e:
+                self.log.info(e)
+            await asyncio.sleep(1)
+            self.on_reconnect()
+
+    async def run(self):
+        await asyncio.gather(self.poll(), self.websocket())
+
+    def attach(self, loop):
+        """Bind the gateway to the event loop, queued commands and scheduler wake ups are forwarded to it"""
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+        self.poll_wakeup = asyncio.Event()
+        self.command_queue.listener = self._queue_listener
+        self.scheduler.listener = self._poll_listener
+
+    def detach(self):
+        self.command_queue.listener = None
+        self.scheduler.listener = None
+
+def session_gateway(session):
+    """AsyncGateway driving the websocket, polling and command sender of a StoveSession"""
+    return AsyncGateway(session.url, session.command_queue,
+                        on_frame=lambda message: session.on_message(None, message),
+                        on_open=session.websocket_opened,
+                        on_close=session.websocket_closed,
+                        on_reconnect=session.websocket_reconnect,
+                        scheduler=session.poller,
+                        on_sent=session.command_sent,
+                        on_rotate=session.websocket_rotated,
+                        log=session.log)
+
+def run_gateway(clients, mqtt_host, mqtt_port, gateways):
+    """Run the MQTT clients and the coroutines of every stove gateway until the process is stopped"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for gateway in gateways:
+        gateway.attach(loop)
+    adapters = [AsyncMqttAdapter(loop, client, gateways[0].log) for client in clients]
+
+    async def run_all():
+        await asyncio.gather(*[adapter.run(mqtt_host, int(mqtt_port)) for adapter in adapters],
+                             *[gateway.run() for gateway in gateways])
+    try:
+        loop.run_until_complete(run_all())
+    finally:
+        for gateway in gateways:
+            gateway.detach()
+        loop.close()
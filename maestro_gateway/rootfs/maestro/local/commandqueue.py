@@ -0,0 +1,52 @@
+#coding: utf-8
+'''
+MCZ Maestro command queue
+Pending commands waiting to be written on the websocket, keyed by command name
+'''
+
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from maestro_protocol.commands import MaestroCommand
+
+# Queued to wake up the sender of a session when its websocket is closed, left out of the counters
+SESSION_END_COMMAND = MaestroCommand('SessionEnd', -1, 'SessionEnd', 'Daemon')
+
+class CoalescingQueue(queue.Queue):
+    """ De-Duplicate message queue to prevent flipping values (Debounce).
+    A command put while another one with the same name is pending replaces it
+    and keeps its place in line. Every operation runs under the queue mutex. """
+    def _init(self, maxsize):
+        self.queue = OrderedDict()
+        self.put_count = 0
+        self.coalesced_count = 0
+        # Optional function called after each put, e.g. to wake up an event loop
+        self.listener = None
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, item):
+        if item.command is not SESSION_END_COMMAND:
+            self.put_count += 1
+            if item.command.name in self.queue:
+                self.coalesced_count += 1
+        self.queue[item.command.name] = item
+        if self.listener is not None:
+            self.listener()
+
+    def _get(self):
+        return self.queue.popitem(last=False)[1]
+
+    def metrics(self):
+        """Return queue counters: commands put, commands replaced before being sent and current depth"""
+        with self.mutex:
+            return {
+                'put': self.put_count,
+                'coalesced': self.coalesced_count,
+                'depth': len(self.queue) - (SESSION_END_COMMAND.name in self.queue),
+            }
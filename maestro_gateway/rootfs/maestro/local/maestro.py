@@ -2,7 +2,6 @@
 # coding: utf-8
 print("Starting Maestrogateway.")
 
-import time
 import sys
 import os
 
@@ -18,12 +17,11 @@ except:
 
 import json
 import logging
-import threading
-import paho.mqtt.client as mqtt
-import websocket
 
 from logging.handlers import RotatingFileHandler
-from messages import MaestroMessageType, process_infostring, get_maestro_info, get_maestro_infoname, MAESTRO_INFORMATION, MaestroInformation
+
+# The shared protocol package and the discovery module are in the parent directory
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
 
 from _config_ import _MCZport
 from _config_ import _MCZip
@@ -37,6 +35,50 @@ from _config_ import _MQTT_ip
 from _config_ import _VERSION
 from _config_ import _REFRESH_INTERVAL
 
+try:
+    from _config_ import _ASYNC_RUNTIME
+except ImportError:
+    _ASYNC_RUNTIME = False
+
+try:
+    from _config_ import _MQTT_MAX_INFLIGHT
+except ImportError:
+    _MQTT_MAX_INFLIGHT = 100
+
+try:
+    from _config_ import _MQTT_CONNECTIONS
+except ImportError:
+    _MQTT_CONNECTIONS = 1
+
+# Adaptive polling
+try:
+    from _config_ import _POLL_INTERVAL_FAST, _POLL_INTERVAL_SLOW, _POLL_BURST_INTERVAL, _POLL_BURST_DURATION, _POLL_FUME_RATE_THRESHOLD
+except ImportError:
+    _POLL_INTERVAL_FAST = 5.0
+    _POLL_INTERVAL_SLOW = 60.0
+    _POLL_BURST_INTERVAL = 3.0
+    _POLL_BURST_DURATION = 60.0
+    _POLL_FUME_RATE_THRESHOLD = 5.0
+
+# Opt-in recording of the raw frames and commands, see maestro_protocol/recorder.py
+try:
+    from _config_ import _RECORD_FRAMES, _RECORD_FILE
+except ImportError:
+    _RECORD_FRAMES = False
+    _RECORD_FILE = '/data/frames.log'
+
+# OpenMetrics endpoint (GET /metrics), 0 disables it
+try:
+    from _config_ import _METRICS_PORT
+except ImportError:
+    _METRICS_PORT = 0
+
+# Additional stoves driven by this process (JSON list, see session.STOVE_OPTIONS)
+try:
+    from _config_ import _STOVES
+except ImportError:
+    _STOVES = '[]'
+
 # Discovery imports
 try:
     from _config_ import _MQTT_DISCOVERY_ENABLED, _MQTT_DISCOVERY_PREFIX, _DEVICE_NAME, _DEVICE_ID
@@ -51,53 +93,19 @@ except ImportError:
 
 if discovery_available:
     try:
-        import sys
-        import os
-        sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/../')
         from discovery import DiscoveryManager
     except ImportError:
         print("Discovery module not available")  # Use print instead of logger which may not be set up yet
         discovery_available = False
 
-from commands import MaestroCommand, get_maestro_command, maestrocommandvalue_to_websocket_string, MaestroCommandValue, MAESTRO_COMMANDS
+from maestro_protocol.registry import REGISTRY
+from maestro_protocol.recorder import FrameRecorder
+from session import StoveSession, stove_configs
+from mqttpool import MqttConnectionPool
+from metrics import MetricsServer, render_metrics
 
-try:
-    import thread
-except ImportError:
-    import _thread as thread
-
-try:
-    import queue
-except ImportError:
-    import Queue as queue
-
-class SetQueue(queue.Queue):
-    """ De-Duplicate message queue to prevent flipping values (Debounce) """
-    def _init(self, maxsize):
-        queue.Queue._init(self, maxsize)
-        self.all_items = set()
-
-    def _put(self, item):
-        found = False
-        for val in self.all_items:
-            if val.command.name == item.command.name:
-                found = True
-                val.value = item.value
-        if not found:
-            queue.Queue._put(self, item)
-            self.all_items.add(item)
-
-    def _get(self):
-        item = queue.Queue._get(self)
-        self.all_items.remove(item)
-        return item
-
-get_stove_info_interval = _REFRESH_INTERVAL
-websocket_connected = False
-socket_reconnect_count = 0
-client = None
-old_connection_status = None
-discovery_manager = None
+pool = None
+sessions = []
 
 # Logging
 logger = logging.getLogger(__name__)
@@ -117,189 +125,89 @@ stream_handler.setFormatter(formatter)
 stream_handler.setLevel(logging.INFO)
 logger.addHandler(stream_handler)
 
-CommandQueue = SetQueue()
-MaestroInfoMessageCache = {}
-
 # Start
 logger.info('Starting Maestro Daemon')
 
-def on_connect_mqtt(client, userdata, flags, rc):
-    logger.info("MQTT: Connected to broker. " + str(rc))
+def on_connect_mqtt(connection_sessions):
     if _MQTT_PAYLOAD_TYPE == 'TOPIC':
-        logger.info('MQTT: Subscribed to topic "' + str(_MQTT_TOPIC_SUB) + '#"')
-        client.subscribe(_MQTT_TOPIC_SUB+'#', qos=1)
-        publish_availabletopics()
-    else:
-        logger.info('MQTT: Subscribed to topic "' + str(_MQTT_TOPIC_SUB) + '"')
-        client.subscribe(_MQTT_TOPIC_SUB, qos=1)
-    
-    # Initialize and publish discovery configs
-    global discovery_manager
-    if discovery_available and discovery_manager:
-        discovery_manager.publish_discovery_configs()
-
-def on_disconnect_mqtt(client, userdata, rc):
-    if rc != 0:
-        logger.info("MQTT: Unexpected disconnection -> try to reconnect...")
-
-def on_message_mqtt(client, userdata, message):
-    try:
-        maestrocommand = None
-        cmd_value = None
-        payload = str(message.payload.decode())
-        if _MQTT_PAYLOAD_TYPE == 'TOPIC':
-            topic = str(message.topic)
-            command = topic[str(topic).rindex('/')+1:]
-            logger.debug(f"Command topic received: {topic}")
-            maestrocommand = get_maestro_command(command)
-            cmd_value = payload
-        else:
-            logger.debug(f"MQTT: Message received: {payload}")
-            res = json.loads(payload)
-            maestrocommand = get_maestro_command(res["Command"])
-            cmd_value = res["Value"]
-        if maestrocommand.name == "Unknown":
-            logger.debug(f"Unknown Maestro Command Received. Ignoring. {payload}")
-        elif maestrocommand.name == "Refresh":
-            logger.debug('Clearing the message cache')
-            MaestroInfoMessageCache.clear()
-        else:
-            logger.debug('Queueing Command ' + maestrocommand.name + ' ' + str(payload))
-            CommandQueue.put(MaestroCommandValue(maestrocommand, cmd_value))
-    except Exception as e: # work on python 3.x
-            logger.error('Exception in on_message_mqtt: '+ str(e))
-
-def recuperoinfo_enqueue():
-    """Get Stove information every x seconds as long as there is a websocket connection"""
-    threading.Timer(get_stove_info_interval, recuperoinfo_enqueue).start()
-    if websocket_connected:
-        CommandQueue.put(MaestroCommandValue(MaestroCommand('GetInfo', 0, 'GetInfo', 'GetInfo'), 0))
-        client.publish(_MQTT_TOPIC_PUB + 'state',  'ON',  1)    
-
-def send_connection_status_message(message):
-    global old_connection_status
-    if old_connection_status != message:
-        if _MQTT_PAYLOAD_TYPE == 'TOPIC':
-            json_dictionary = json.loads(str(json.dumps(message)))
-            for key in json_dictionary:
-                logger.info('MQTT: publish to Topic "' + str(_MQTT_TOPIC_PUB + key) +
-                        '", Message : ' + str(json_dictionary[key]))
-                client.publish(_MQTT_TOPIC_PUB+key, json_dictionary[key], 1)
-        else:
-            client.publish(_MQTT_TOPIC_PUB, json.dumps(message), 1)
-        old_connection_status = message
-
-def process_info_message(message):
-    """Process websocket array string that has the stove Info message"""
-    res = process_infostring(message)
-    maestro_info_message_publish = {}
-        
-    for item in res:
-        if item not in MaestroInfoMessageCache:
-            MaestroInfoMessageCache[item] = res[item]
-            maestro_info_message_publish[item] = res[item]
-        elif MaestroInfoMessageCache[item] != res[item]:
-            MaestroInfoMessageCache[item] = res[item]
-            maestro_info_message_publish[item] = res[item]
-
-    if len(maestro_info_message_publish) > 0:
-        if _MQTT_PAYLOAD_TYPE == 'TOPIC':
-            logger.info(str(json.dumps(maestro_info_message_publish)))
-            for key in maestro_info_message_publish:
-                logger.info('MQTT: publish to Topic "' + str(_MQTT_TOPIC_PUB + key) +'", Message : ' + str(maestro_info_message_publish[key]))
-                client.publish(_MQTT_TOPIC_PUB + key, maestro_info_message_publish[key], 1)
-        else:
-            client.publish(_MQTT_TOPIC_PUB, json.dumps(maestro_info_message_publish), 1)
-
-
-def on_message(ws, message):
-    message_array = message.split("|")
-    if message_array[0] == MaestroMessageType.Info.value:
-        process_info_message(message)
-    elif message_array[0] == MaestroMessageType.StringData.value:
-        logger.info('Date Time Set ' + str(message_array[1]))
-    else:
-        logger.info('Unsupported message type received !')
-
-def on_error(ws, error):
-    logger.info(error)
-
-def on_close(ws, close_status_code, close_msg):
-    logger.info('Websocket: Disconnected')
-    global websocket_connected, discovery_manager
-    websocket_connected = False
-    
-    # Publish availability offline for discovery
-    if discovery_available and discovery_manager:
-        discovery_manager.publish_availability_offline()
-
-def on_open(ws):
-    logger.info('Websocket: Connected')
-    send_connection_status_message({"Status":"connected"})
-    global websocket_connected, discovery_manager
-    websocket_connected = True
-    socket_reconnect_count = 0
-    
-    # Publish availability online for discovery
-    if discovery_available and discovery_manager:
-        discovery_manager.publish_availability_online()
-    def run(*args):
-        for i in range(360*4):
-            time.sleep(0.25)
-            while not CommandQueue.empty():
-                command = CommandQueue.get()
-                cmd = maestrocommandvalue_to_websocket_string(command)
-                if cmd != "":
-                    logger.info("Websocket: Send " + str(cmd))
-                    ws.send(cmd)
-                else:
-                    logger.error(f"Invalid command: {command.name} Value: {command.value}")
-        logger.info('Closing Websocket Connection')
-        ws.close()
-    thread.start_new_thread(run, ())
-
-def start_mqtt():
-    global client, discovery_manager
+        publish_availabletopics(connection_sessions)
+
+def gateway_config():
+    """Main configuration, after the environment overrides of init_config"""
+    return {
+        '_MCZip': _MCZip,
+        '_MCZport': _MCZport,
+        '_MQTT_TOPIC_PUB': _MQTT_TOPIC_PUB,
+        '_MQTT_TOPIC_SUB': _MQTT_TOPIC_SUB,
+        '_MQTT_PAYLOAD_TYPE': _MQTT_PAYLOAD_TYPE,
+        '_MQTT_MAX_INFLIGHT': _MQTT_MAX_INFLIGHT,
+        '_WS_RECONNECTS_BEFORE_ALERT': _WS_RECONNECTS_BEFORE_ALERT,
+        '_REFRESH_INTERVAL': _REFRESH_INTERVAL,
+        '_POLL_INTERVAL_FAST': _POLL_INTERVAL_FAST,
+        '_POLL_INTERVAL_SLOW': _POLL_INTERVAL_SLOW,
+        '_POLL_BURST_INTERVAL': _POLL_BURST_INTERVAL,
+        '_POLL_BURST_DURATION': _POLL_BURST_DURATION,
+        '_POLL_FUME_RATE_THRESHOLD': _POLL_FUME_RATE_THRESHOLD,
+        '_MQTT_DISCOVERY_ENABLED': _MQTT_DISCOVERY_ENABLED,
+        '_MQTT_DISCOVERY_PREFIX': _MQTT_DISCOVERY_PREFIX,
+        '_DEVICE_NAME': _DEVICE_NAME,
+        '_DEVICE_ID': _DEVICE_ID,
+        '_VERSION': _VERSION
+    }
+
+def start_mqtt(threaded=True):
+    """Create the MQTT connections shared by the stove sessions. In threaded mode they are connected and run their own network threads"""
+    global pool
     logger.info('Connection in progress to the MQTT broker (IP:' +
                 _MQTT_ip + ' PORT:'+str(_MQTT_port)+')')
-    client = mqtt.Client(client_id="MCZ_PelletStove")
     if _MQTT_authentication:
         print('mqtt authentication enabled')
-        client.username_pw_set(username=_MQTT_user, password=_MQTT_pass)
-    client.on_connect = on_connect_mqtt
-    client.on_disconnect = on_disconnect_mqtt
-    client.on_message = on_message_mqtt
-    client.connect(_MQTT_ip, _MQTT_port)
-    client.loop_start()
-    
-    # Initialize discovery manager
-    if discovery_available:
-        discovery_config = {
-            '_MQTT_DISCOVERY_ENABLED': _MQTT_DISCOVERY_ENABLED,
-            '_MQTT_DISCOVERY_PREFIX': _MQTT_DISCOVERY_PREFIX,
-            '_DEVICE_NAME': _DEVICE_NAME,
-            '_DEVICE_ID': _DEVICE_ID,
-            '_MQTT_TOPIC_PUB': _MQTT_TOPIC_PUB,
-            '_MQTT_TOPIC_SUB': _MQTT_TOPIC_SUB,
-            '_VERSION': _VERSION
-        }
-        discovery_manager = DiscoveryManager(client, discovery_config)
-
-def publish_availabletopics():  
-    logger.info(_MQTT_TOPIC_PUB + 'state')  
-    # Publish topics that have stat and command
-    for item in MAESTRO_INFORMATION:
-        logger.info(_MQTT_TOPIC_PUB + item.name)        
-        maestrocommand = get_maestro_command(item.name)        
-        if maestrocommand.name != "Unknown":
-            logger.info(_MQTT_TOPIC_SUB + item.name)  
-
-    # publish topics that have command only
-    for item in MAESTRO_COMMANDS:
-        homeassistanttype = 'sensor'   
-        maestroinfo = get_maestro_infoname(item.name)
-        if maestroinfo.name == "Unknown":
-            logger.info(_MQTT_TOPIC_SUB + item.name) 
+    pool = MqttConnectionPool(_MQTT_ip, _MQTT_port, size=_MQTT_CONNECTIONS,
+                              username=_MQTT_user if _MQTT_authentication else None, password=_MQTT_pass,
+                              log=logger)
+    pool.on_connect = on_connect_mqtt
+
+    recorder = None
+    if _RECORD_FRAMES:
+        logger.info('Recording the frames and commands in ' + _RECORD_FILE)
+        recorder = FrameRecorder(_RECORD_FILE)
+
+    # One session per stove, the first one is the main configuration
+    configs = stove_configs(gateway_config(), json.loads(_STOVES))
+    for config in configs:
+        # Extra stoves log through a child logger named after their device id
+        log = logger if config is configs[0] else logger.getChild(config['_DEVICE_ID'])
+        sessions.append(pool.add_session(
+            lambda client, config=config, log=log: StoveSession(client, config, DiscoveryManager if discovery_available else None,
+                                                                recorder=recorder, log=log)))
+    if len(sessions) > 1:
+        logger.info(f'Driving {len(sessions)} stoves over {len(pool.clients)} MQTT connection(s): ' +
+                    ', '.join(session.name for session in sessions))
+
+    if threaded:
+        pool.connect()
+
+def start_metrics():
+    """Serve the OpenMetrics endpoint when METRICS_PORT is set"""
+    if _METRICS_PORT:
+        MetricsServer(lambda: render_metrics(sessions, pool), port=_METRICS_PORT, log=logger).start()
+
+def publish_availabletopics(connection_sessions):  
+    for session in connection_sessions:
+        logger.info(session.topic_pub + 'state')  
+        # Publish topics that have stat and command
+        for item in REGISTRY.informations():
+            logger.info(session.topic_pub + item.name)        
+            maestrocommand = REGISTRY.command(item.name)        
+            if maestrocommand.name != "Unknown":
+                logger.info(session.topic_sub + item.name)  
+
+        # publish topics that have command only
+        for item in REGISTRY.commands():
+            homeassistanttype = 'sensor'   
+            maestroinfo = REGISTRY.info(item.name)
+            if maestroinfo.name == "Unknown":
+                logger.info(session.topic_sub + item.name) 
 
 def init_config():
     print('Reading config from envionment variables')
@@ -336,7 +244,43 @@ def init_config():
     if (os.getenv('MCZport') != None):
         global _MCZport
         _MCZport = os.getenv('MCZport')
-    
+    if (os.getenv('ASYNC_RUNTIME') != None):
+        global _ASYNC_RUNTIME
+        _ASYNC_RUNTIME = os.getenv('ASYNC_RUNTIME') == "True"
+    if (os.getenv('MQTT_MAX_INFLIGHT') != None):
+        global _MQTT_MAX_INFLIGHT
+        _MQTT_MAX_INFLIGHT = int(os.getenv('MQTT_MAX_INFLIGHT'))
+    if (os.getenv('MQTT_CONNECTIONS') != None):
+        global _MQTT_CONNECTIONS
+        _MQTT_CONNECTIONS = int(os.getenv('MQTT_CONNECTIONS'))
+    if (os.getenv('POLL_INTERVAL_FAST') != None):
+        global _POLL_INTERVAL_FAST
+        _POLL_INTERVAL_FAST = float(os.getenv('POLL_INTERVAL_FAST'))
+    if (os.getenv('POLL_INTERVAL_SLOW') != None):
+        global _POLL_INTERVAL_SLOW
+        _POLL_INTERVAL_SLOW = float(os.getenv('POLL_INTERVAL_SLOW'))
+    if (os.getenv('POLL_BURST_INTERVAL') != None):
+        global _POLL_BURST_INTERVAL
+        _POLL_BURST_INTERVAL = float(os.getenv('POLL_BURST_INTERVAL'))
+    if (os.getenv('POLL_BURST_DURATION') != None):
+        global _POLL_BURST_DURATION
+        _POLL_BURST_DURATION = float(os.getenv('POLL_BURST_DURATION'))
+    if (os.getenv('POLL_FUME_RATE_THRESHOLD') != None):
+        global _POLL_FUME_RATE_THRESHOLD
+        _POLL_FUME_RATE_THRESHOLD = float(os.getenv('POLL_FUME_RATE_THRESHOLD'))
+    if (os.getenv('RECORD_FRAMES') != None):
+        global _RECORD_FRAMES
+        _RECORD_FRAMES = os.getenv('RECORD_FRAMES') == "True"
+    if (os.getenv('RECORD_FILE') != None):
+        global _RECORD_FILE
+        _RECORD_FILE = os.getenv('RECORD_FILE')
+    if (os.getenv('METRICS_PORT') != None):
+        global _METRICS_PORT
+        _METRICS_PORT = int(os.getenv('METRICS_PORT'))
+    if (os.getenv('STOVES') != None):
+        global _STOVES
+        _STOVES = os.getenv('STOVES')
+
     # Discovery config
     if discovery_available:
         global _MQTT_DISCOVERY_ENABLED, _MQTT_DISCOVERY_PREFIX, _DEVICE_NAME, _DEVICE_ID
@@ -349,25 +293,31 @@ def init_config():
         if (os.getenv('DEVICE_ID') != None):
             _DEVICE_ID = os.getenv('DEVICE_ID')
     
-if __name__ == "__main__":
-    init_config()        
-    recuperoinfo_enqueue()
-    socket_reconnect_count = 0
+def run_async():
+    """Run the gateway on a single asyncio event loop, one set of coroutines per stove"""
+    from aioruntime import session_gateway, run_gateway
+    start_mqtt(threaded=False)
+    start_metrics()
+    if systemd_available:
+        systemd.daemon.notify('READY=1')
+    run_gateway(pool.clients, _MQTT_ip, _MQTT_port, [session_gateway(session) for session in sessions])
+
+def run_threaded():
+    """Run the gateway with websocket-client and paho network threads, the first stove runs in the main thread"""
     start_mqtt()
+    start_metrics()
+    for session in sessions:
+        session.poller.start()
     if systemd_available:
         systemd.daemon.notify('READY=1')
-    while True:
-        logger.info("Websocket: Establishing connection to server (IP:"+_MCZip+" PORT:"+_MCZport+")")
-        ws = websocket.WebSocketApp("ws://" + _MCZip + ":" + _MCZport,
-                                    on_message=on_message,
-                                    on_error=on_error,
-                                    on_close=on_close)
-        ws.on_open = on_open
-
-        ws.run_forever(ping_interval=5, ping_timeout=2, suppress_origin=True)
-        time.sleep(1)
-        socket_reconnect_count = socket_reconnect_count + 1
-        logger.info("Socket Reconnection Count: " + str(socket_reconnect_count))
-        if socket_reconnect_count>_WS_RECONNECTS_BEFORE_ALERT:
-            send_connection_status_message({"Status":"disconnected"})
-            socket_reconnect_count = 0
\ No newline at end of file
+    for session in sessions[1:]:
+        session.start_websocket()
+    sessions[0].run_websocket()
+
+if __name__ == "__main__":
+    init_config()        
+    if _ASYNC_RUNTIME:
+        logger.info('Using the asyncio runtime')
+        run_async()
+    else:
+        run_threaded()
@@ -0,0 +1,229 @@
+#coding: utf-8
+'''
+MCZ Maestro gateway metrics
+OpenMetrics text endpoint (GET /metrics) built from the counters kept by the stove sessions,
+the command queues, the publish batchers and the MQTT connection pool
+'''
+
+import logging
+import os
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Histogram buckets (upper bounds)
+DECODE_SECONDS_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+FIELDS_CHANGED_BUCKETS = (0, 1, 2, 5, 10, 20, 40, 70)
+COMMAND_SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+CONFIRM_SECONDS_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0, 120.0)
+
+logger = logging.getLogger(__name__)
+
+class Histogram(object):
+    """Histogram without locks: written by a single thread (the websocket or sender of a session),
+    read by the metrics endpoint which may see an observation half way through"""
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self):
+        """Return ([(upper bound, cumulative count)], count, sum), the last bound is +Inf"""
+        counts, total = list(self.counts), self.sum
+        cumulative, running = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            running += count
+            cumulative.append((bound, running))
+        return cumulative, running, total
+
+def resident_memory():
+    """Resident set size of the process in bytes, None when /proc is not available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+def _number(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class OpenMetricsWriter(object):
+    """Text exposition: every sample of a family follows its TYPE and HELP lines"""
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help):
+        self.lines.append(f'# TYPE {name} {kind}')
+        self.lines.append(f'# HELP {name} {help}')
+
+    def sample(self, name, labels, value):
+        self.lines.append(f'{name}{_labels(labels)} {_number(value)}')
+
+    def histogram(self, name, labels, histogram):
+        buckets, count, total = histogram.snapshot()
+        for bound, cumulative in buckets:
+            self.sample(name + '_bucket', dict(labels, le='+Inf' if bound == float('inf') else repr(float(bound))),
+                        cumulative)
+        self.sample(name + '_count', labels, count)
+        self.sample(name + '_sum', labels, total)
+
+    def text(self):
+        return '\n'.join(self.lines + ['# EOF']) + '\n'
+
+def render_metrics(sessions, pool=None):
+    """OpenMetrics text of the stove sessions, the MQTT connection pool and the process"""
+    out = OpenMetricsWriter()
+    stoves = [(session, {'stove': session.name}, session.metrics()) for session in sessions]
+
+    def per_stove(name, kind, help, value):
+        out.family(name, kind, help)
+        suffix = '_total' if kind == 'counter' else ''
+        for session, labels, metrics in stoves:
+            out.sample(name + suffix, labels, value(session, metrics))
+
+    def per_stove_histogram(name, help, histogram):
+        out.family(name, 'histogram', help)
+        for session, labels, _ in stoves:
+            out.histogram(name, labels, histogram(session))
+
+    per_stove('maestro_frames_received', 'counter', 'Messages received from the stove websocket',
+              lambda session, metrics: metrics['frames']['received'])
+    per_stove('maestro_frames_decoded', 'counter', 'RecuperoInfo frames decoded',
+              lambda session, metrics: metrics['frames']['decoded'])
+    per_stove_histogram('maestro_frame_decode_seconds', 'Time spent decoding the changed fields of a frame',
+                        lambda session: session.decode_seconds)
+    per_stove_histogram('maestro_frame_fields_changed', 'Decoded fields that changed, per frame',
+                        lambda session: session.fields_changed)
+
+    out.family('maestro_mqtt_publishes', 'counter', 'MQTT messages published by the publish batcher, per topic')
+    for session, labels, _ in stoves:
+        for topic, count in session.publisher.published_topics().items():
+            out.sample('maestro_mqtt_publishes_total', dict(labels, topic=topic), count)
+
+    per_stove('maestro_command_queue_depth', 'gauge', 'Commands waiting to be written on the websocket',
+              lambda session, metrics: metrics['queue']['depth'])
+    per_stove('maestro_commands_queued', 'counter', 'Commands put in the command queue',
+              lambda session, metrics: metrics['queue']['put'])
+    per_stove('maestro_commands_coalesced', 'counter', 'Commands replaced by a newer one before being sent',
+              lambda session, metrics: metrics['queue']['coalesced'])
+    per_stove_histogram('maestro_command_seconds', 'Time from the MQTT command receipt to its websocket send',
+                        lambda session: session.command_seconds)
+
+    per_stove('maestro_command_traces_pending', 'gauge', 'Commands sent or queued, waiting for a confirming frame',
+              lambda session, metrics: metrics['traces']['pending'])
+    # Command traces, per stove and command name
+    traced = [(dict(labels, command=name), stats)
+              for session, labels, _ in stoves for name, stats in session.tracer.command_stats()]
+    for name, kind, help, value in (
+            ('maestro_command_traces', 'counter', 'Commands traced from their MQTT receipt', lambda stats: stats.traces),
+            ('maestro_command_confirmed', 'counter', 'Commands confirmed by a stove frame', lambda stats: stats.confirmed),
+            ('maestro_command_timeouts', 'counter', 'Commands not confirmed by a stove frame in time',
+             lambda stats: stats.timeouts),
+            ('maestro_command_superseded', 'counter', 'Commands replaced by a newer one before their confirmation',
+             lambda stats: stats.superseded)):
+        out.family(name, kind, help)
+        for labels, stats in traced:
+            out.sample(name + '_total', labels, value(stats))
+    for name, help, histogram in (
+            ('maestro_command_send_seconds', 'Time from the MQTT command receipt to its websocket send, per command',
+             lambda stats: stats.send_seconds),
+            ('maestro_command_confirm_seconds', 'Time from the websocket send to the frame confirming the command',
+             lambda stats: stats.confirm_seconds),
+            ('maestro_command_round_trip_seconds', 'Time from the MQTT command receipt to the frame confirming it',
+             lambda stats: stats.round_trip_seconds)):
+        out.family(name, 'histogram', help)
+        for labels, stats in traced:
+            out.histogram(name, labels, histogram(stats))
+
+    per_stove('maestro_websocket_connected', 'gauge', '1 while the stove websocket is connected',
+              lambda session, metrics: metrics['websocket_connected'])
+    per_stove('maestro_websocket_reconnects', 'counter', 'Websocket reconnections',
+              lambda session, metrics: metrics['websocket']['reconnects'])
+    per_stove('maestro_websocket_sessions', 'counter', 'Websocket sessions opened',
+              lambda session, metrics: metrics['websocket']['sessions'])
+    per_stove('maestro_websocket_rotations', 'counter', 'Websocket sessions closed by the gateway after SESSION_DURATION',
+              lambda session, metrics: metrics['websocket']['rotations'])
+    per_stove('maestro_poll_interval_seconds', 'gauge', 'Current stove information poll interval',
+              lambda session, metrics: metrics['poll_interval'])
+
+    if pool is not None:
+        connections = pool.metrics()['connections']
+        for name, kind, key, help in (
+                ('maestro_mqtt_connected', 'gauge', 'connected', '1 while the MQTT connection is up'),
+                ('maestro_mqtt_inflight', 'gauge', 'inflight', 'QoS 1 messages waiting for their acknowledgement'),
+                ('maestro_mqtt_queued', 'gauge', 'queued', 'Outgoing messages held by the MQTT client')):
+            out.family(name, kind, help)
+            for connection in connections:
+                out.sample(name, {'client_id': connection['client_id']}, connection[key])
+
+    out.family('maestro_threads', 'gauge', 'Threads of the gateway process')
+    out.sample('maestro_threads', {}, threading.active_count())
+    rss = resident_memory()
+    if rss is not None:
+        out.family('maestro_resident_memory_bytes', 'gauge', 'Resident memory of the gateway process')
+        out.sample('maestro_resident_memory_bytes', {}, rss)
+    return out.text()
+
+class MetricsServer(object):
+    """HTTP server answering GET /metrics from its own threads"""
+    def __init__(self, render, host='0.0.0.0', port=9101, log=logger):
+        """
+        Args:
+            render: function returning the OpenMetrics text, called for each request
+        """
+        self.render = render
+        self.host = host
+        self.port = port
+        self.log = log
+        self.server = None
+
+    def start(self):
+        render, log = self.render, self.log
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                try:
+                    body = render().encode('utf-8')
+                except Exception as e:
+                    log.error('Metrics: ' + str(e))
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug('Metrics: ' + format % args)
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="Metrics", daemon=True).start()
+        self.log.info(f'Metrics: serving http://{self.host}:{self.port}/metrics')
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
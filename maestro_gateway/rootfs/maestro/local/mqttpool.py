@@ -0,0 +1,188 @@
+#coding: utf-8
+'''
+MCZ Maestro MQTT connection pool
+The stove sessions of a process share one (or a few) MQTT connections. Each session is pinned
+to one connection, which subscribes to the command topics of its sessions and routes the
+messages to them by topic prefix. Client ids are unique so gateways do not kick each other off.
+'''
+
+import logging
+import threading
+import uuid
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+def unique_client_id(prefix, index=0):
+    """Client id unique to this process and connection, e.g. MCZ_PelletStove-3f2a9c1e-0"""
+    return f"{prefix}-{uuid.uuid4().hex[:8]}-{index}"
+
+class PublishTracker(object):
+    """Outgoing messages of one connection, counted from publish() and on_publish: QoS 0 messages
+    until paho wrote them on the socket, QoS 1/2 messages until the broker acknowledged them"""
+    # paho default of max_inflight_messages_set
+    MAX_INFLIGHT = 20
+
+    def __init__(self):
+        self.max_inflight = self.MAX_INFLIGHT
+        self.pending = {}
+        # on_publish may run on the network thread before publish() returned the mid
+        self.published_early = set()
+        self._lock = threading.Lock()
+
+    def published(self, info, qos):
+        # paho drops QoS 0 messages it cannot send and refuses messages beyond its queue size
+        held = info.rc == mqtt.MQTT_ERR_SUCCESS or (info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0)
+        with self._lock:
+            if info.mid in self.published_early:
+                self.published_early.discard(info.mid)
+            elif held:
+                self.pending[info.mid] = qos
+
+    def on_publish(self, mid):
+        with self._lock:
+            if self.pending.pop(mid, None) is None:
+                self.published_early.add(mid)
+
+    def reconnected(self):
+        # paho discards the QoS 0 packets not written before the disconnection, QoS 1/2 messages are sent again
+        with self._lock:
+            self.pending = {mid: qos for mid, qos in self.pending.items() if qos > 0}
+
+    def metrics(self):
+        """Return the QoS 1/2 messages sent and waiting for their acknowledgement and all the messages held"""
+        with self._lock:
+            waiting = sum(1 for qos in self.pending.values() if qos > 0)
+            return {
+                'inflight': min(waiting, self.max_inflight) if self.max_inflight > 0 else waiting,
+                'queued': len(self.pending),
+            }
+
+class SessionClient(object):
+    """MQTT client handed to one stove session: publishes go through the pooled connection
+    and are counted for the session, everything else is the paho client"""
+    def __init__(self, client, tracker=None):
+        self.client = client
+        self.tracker = tracker if tracker is not None else PublishTracker()
+        self.published_count = 0
+        self.published_bytes = 0
+        self.not_connected_count = 0
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        info = self.client.publish(topic, payload, qos, retain)
+        self.tracker.published(info, qos)
+        with self._lock:
+            self.published_count += 1
+            self.published_bytes += len(payload) if isinstance(payload, (bytes, bytearray, str)) else 0
+            if info.rc == mqtt.MQTT_ERR_NO_CONN:
+                # paho keeps QoS 1 messages and sends them after the reconnection
+                self.not_connected_count += 1
+        return info
+
+    def max_inflight_messages_set(self, inflight):
+        self.tracker.max_inflight = inflight
+        self.client.max_inflight_messages_set(inflight)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def metrics(self):
+        """Return counters: messages published by the session, their payload bytes and the ones published while disconnected"""
+        with self._lock:
+            return {
+                'published': self.published_count,
+                'bytes': self.published_bytes,
+                'not_connected': self.not_connected_count,
+            }
+
+class MqttConnectionPool(object):
+    """A few paho clients shared by the stove sessions, sessions are spread over them round robin"""
+    def __init__(self, host, port, size=1, username=None, password=None, client_id_prefix="MCZ_PelletStove",
+                 log=logger):
+        """
+        Args:
+            size: number of MQTT connections
+            username: MQTT credentials, None to connect without authentication
+            client_id_prefix: client ids are <prefix>-<random>-<connection index>
+        """
+        self.host = host
+        self.port = port
+        self.log = log
+        # Called with the sessions of a connection after it connected, before they resubscribe
+        self.on_connect = None
+        self.clients = []
+        self.client_ids = []
+        self.sessions = []
+        self.connected = []
+        self.trackers = []
+        for index in range(max(1, size)):
+            client_id = unique_client_id(client_id_prefix, index)
+            client = mqtt.Client(client_id=client_id)
+            if username is not None:
+                client.username_pw_set(username=username, password=password)
+            client.user_data_set(index)
+            client.on_connect = self._on_connect
+            client.on_disconnect = self._on_disconnect
+            client.on_message = self._on_message
+            client.on_publish = self._on_publish
+            self.clients.append(client)
+            self.trackers.append(PublishTracker())
+            self.client_ids.append(client_id)
+            self.sessions.append([])
+            self.connected.append(False)
+
+    def add_session(self, make_session):
+        """Create a session on the next connection: make_session(client) is called with its SessionClient"""
+        index = sum(len(sessions) for sessions in self.sessions) % len(self.clients)
+        session = make_session(SessionClient(self.clients[index], self.trackers[index]))
+        # The command topics of the session are routed to it by its connection
+        session.register()
+        self.sessions[index].append(session)
+        return session
+
+    def all_sessions(self):
+        return [session for sessions in self.sessions for session in sessions]
+
+    def connect(self):
+        """Connect every client and start their network threads"""
+        for client, client_id in zip(self.clients, self.client_ids):
+            self.log.info(f'MQTT: Connecting {client_id} to the broker (IP:{self.host} PORT:{self.port})')
+            client.connect(self.host, self.port)
+            client.loop_start()
+
+    def _on_connect(self, client, index, flags, rc):
+        self.log.info(f"MQTT: Connected to broker. {rc} (connection {index}, {len(self.sessions[index])} stoves)")
+        self.connected[index] = rc == 0
+        if rc != 0:
+            return
+        self.trackers[index].reconnected()
+        if self.on_connect is not None:
+            self.on_connect(self.sessions[index])
+        for session in self.sessions[index]:
+            session.on_mqtt_connect()
+
+    def _on_disconnect(self, client, index, rc):
+        self.connected[index] = False
+        if rc != 0:
+            self.log.info(f"MQTT: Unexpected disconnection of connection {index} -> try to reconnect...")
+
+    def _on_publish(self, client, index, mid):
+        self.trackers[index].on_publish(mid)
+
+    def _on_message(self, client, index, message):
+        # Messages of the stove command topics go to the session callbacks registered by add_session
+        self.log.debug(f"MQTT: Message on {message.topic} does not belong to any stove. Ignoring.")
+
+    def metrics(self):
+        """Return the state of each connection and the publish counters of each session"""
+        return {
+            'connections': [{
+                'client_id': client_id,
+                'connected': self.connected[index],
+                **self.trackers[index].metrics(),
+                'sessions': [session.name for session in self.sessions[index]],
+            } for index, client_id in enumerate(self.client_ids)],
+            'sessions': {session.name: session.client.metrics() for session in self.all_sessions()},
+        }
@@ -0,0 +1,178 @@
+#coding: utf-8
+'''
+MCZ Maestro poll scheduler
+Runs the stove info request on a monotonic clock from a single long-lived thread
+'''
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+# Stove_State values polled faster: checking, cleaning, loading, start, stabilising and extinguish/cooling/cleaning
+FAST_POLL_STATES = frozenset(list(range(1, 11)) + list(range(40, 44)))
+# Stove_State values polled slower: off and standby
+SLOW_POLL_STATES = frozenset([0, 46])
+# Shortest span in seconds of the fume temperature rate, so a 1 degree flicker between two polls does not count
+FUME_RATE_WINDOW = 60.0
+
+logger = logging.getLogger(__name__)
+
+class PollPolicy(object):
+    """Picks the GetInfo interval from the stove state, the recent command activity and the fume temperature trend"""
+    def __init__(self, interval, fast_interval=5.0, slow_interval=60.0, burst_interval=3.0,
+                 burst_duration=60.0, fume_rate_threshold=5.0, fume_rate_window=FUME_RATE_WINDOW,
+                 clock=time.monotonic):
+        """
+        Args:
+            interval: default interval in seconds (REFRESH_INTERVAL)
+            fast_interval: interval in ignition and transition states or while the fume temperature moves fast
+            slow_interval: interval when the stove is off or in standby
+            burst_interval: interval during burst_duration seconds after a command
+            fume_rate_threshold: fume temperature change in degrees per minute above which polling is fast
+            fume_rate_window: the rate is measured against the latest reading at least this many seconds old
+        """
+        self.interval = interval
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.burst_interval = burst_interval
+        self.burst_duration = burst_duration
+        self.fume_rate_threshold = fume_rate_threshold
+        self.fume_rate_window = fume_rate_window
+        self.clock = clock
+        self.stove_state = None
+        self.fume_rate = 0.0
+        self.effective_interval = interval
+        self.reason = 'default'
+        self._last_command = None
+        # (time, fume temperature) readings, the first one is the reference of the rate
+        self._fume_samples = deque()
+
+    def command_sent(self):
+        """A user command was received, poll in burst mode to report its effect"""
+        self._last_command = self.clock()
+
+    def frame_received(self, stove_state, fume_temperature):
+        """Track the stove state and the fume temperature rate of change (degrees per minute),
+        measured over fume_rate_window seconds at least"""
+        now = self.clock()
+        self.stove_state = stove_state
+        if fume_temperature is not None:
+            samples = self._fume_samples
+            samples.append((now, fume_temperature))
+            # Keep the latest reading that is old enough as the reference
+            while len(samples) > 1 and now - samples[1][0] >= self.fume_rate_window:
+                samples.popleft()
+            since, reference = samples[0]
+            if now - since >= self.fume_rate_window:
+                self.fume_rate = abs(fume_temperature - reference) * 60 / (now - since)
+
+    def next_interval(self):
+        """Return the interval until the next GetInfo, the reason is kept in self.reason"""
+        if self._last_command is not None and self.clock() - self._last_command < self.burst_duration:
+            interval, reason = self.burst_interval, 'command'
+        elif self.stove_state in FAST_POLL_STATES:
+            interval, reason = self.fast_interval, 'transition'
+        elif self.fume_rate >= self.fume_rate_threshold:
+            interval, reason = self.fast_interval, 'fume temperature'
+        elif self.stove_state in SLOW_POLL_STATES:
+            interval, reason = self.slow_interval, 'off'
+        else:
+            interval, reason = self.interval, 'default'
+        self.effective_interval = interval
+        self.reason = reason
+        return interval
+
+class PollScheduler(object):
+    """Calls function every interval seconds. Ticks are scheduled from the previous tick, not from
+    the end of the previous call, so the schedule does not drift"""
+    def __init__(self, function, interval, interval_for=None, jitter=0.0, is_connected=None,
+                 backoff_max=None, log=logger):
+        """
+        Args:
+            function: called on every tick
+            interval: base interval in seconds
+            interval_for: optional function returning the interval to use for the next tick
+            jitter: random delay in seconds added to each tick, not carried over to the next one
+            is_connected: optional function, the interval is doubled up to backoff_max while it returns False
+            backoff_max: longest interval while disconnected, 8 times the interval by default
+        """
+        self.function = function
+        self.interval = interval
+        self.interval_for = interval_for
+        self.jitter = jitter
+        self.is_connected = is_connected
+        self.backoff_max = backoff_max if backoff_max is not None else interval * 8
+        self.log = log
+        self.next_run = None
+        self.current_interval = interval
+        # Optional function called by wake(), e.g. to wake up an event loop
+        self.listener = None
+        self._backoff = 1
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def tick_interval(self):
+        """Return the interval until the next tick"""
+        interval = self.interval_for() if self.interval_for is not None else self.interval
+        if self.is_connected is not None and not self.is_connected():
+            interval = min(interval * self._backoff, max(self.backoff_max, interval))
+            self._backoff *= 2
+        else:
+            self._backoff = 1
+        self.current_interval = interval
+        return interval
+
+    def next_delay(self, now):
+        """Advance the schedule by one tick and return the delay to wait from now"""
+        if self.next_run is None:
+            self.next_run = now
+        self.next_run += self.tick_interval()
+        if self.next_run < now:
+            # Late (e.g. the host was suspended): restart from now instead of running missed ticks
+            self.next_run = now
+        delay = self.next_run - now
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        return delay
+
+    def restart(self, now):
+        """Run the next tick right away and schedule the following ones from now"""
+        self.next_run = now
+        self._backoff = 1
+
+    def wake(self):
+        """Run the next tick now, e.g. when the websocket just connected"""
+        self._wakeup.set()
+        if self.listener is not None:
+            self.listener()
+
+    def run_once(self):
+        try:
+            self.function()
+        except Exception as e:
+            self.log.error('Exception in poll: ' + str(e))
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="PollScheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped:
+            if self._wakeup.wait(self.next_delay(time.monotonic())):
+                self._wakeup.clear()
+                if self._stopped:
+                    return
+                self.restart(time.monotonic())
+            self.run_once()
@@ -0,0 +1,62 @@
+#coding: utf-8
+'''
+MCZ Maestro websocket sender
+Writes queued commands on the websocket as soon as they are queued
+'''
+
+import logging
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from maestro_protocol.commands import MaestroCommandValue, maestrocommandvalue_to_websocket_string
+from commandqueue import SESSION_END_COMMAND
+
+# Websocket sessions are closed and reopened after this many seconds
+SESSION_DURATION = 360
+
+logger = logging.getLogger(__name__)
+
+def end_session(command_queue, session_id):
+    """Wake up the sender of the session so it stops without waiting for the session timeout"""
+    command_queue.put(MaestroCommandValue(SESSION_END_COMMAND, session_id))
+
+def send_commands(ws, command_queue, session_id, session_duration=SESSION_DURATION, on_sent=None, log=logger):
+    """Block on the command queue and write commands on the websocket until the session expires or ends.
+    on_sent(command) is called after each write. Returns True when the session expired and was closed"""
+    deadline = time.monotonic() + session_duration
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            command = command_queue.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if command.command is SESSION_END_COMMAND:
+            if command.value == session_id:
+                return False
+            # Left over by a previous session
+            continue
+        try:
+            cmd = maestrocommandvalue_to_websocket_string(command)
+        except ValueError:
+            log.warning(f"Invalid value for {command.command.name}, command skipped: {command.value}")
+            continue
+        if cmd != "":
+            log.info("Websocket: Send " + str(cmd))
+            try:
+                ws.send(cmd)
+            except Exception as e:
+                log.error(f"Websocket: Send failed, ending session: {e}")
+                return False
+            if on_sent is not None:
+                on_sent(command)
+        else:
+            log.error(f"Invalid command: {command.command.name} Value: {command.value}")
+    log.info('Closing Websocket Connection')
+    ws.close()
+    return True
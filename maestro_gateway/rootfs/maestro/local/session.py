@@ -0,0 +1,354 @@
+#coding: utf-8
+'''
+MCZ Maestro stove session
+Everything one stove needs (websocket, command queue, info cache, poll scheduler, MQTT topics
+and discovery device), so one process can drive several stoves over a shared MQTT client.
+'''
+
+import json
+import logging
+import threading
+import time
+
+import websocket
+
+from maestro_protocol.messages import MaestroMessageType, MaestroInfoDelta
+from maestro_protocol.commands import MaestroCommandValue
+from maestro_protocol.registry import REGISTRY
+from maestro_protocol.publisher import PublishBatcher
+from commandqueue import CoalescingQueue
+from sender import send_commands, end_session
+from scheduler import PollScheduler, PollPolicy
+from metrics import Histogram, DECODE_SECONDS_BUCKETS, FIELDS_CHANGED_BUCKETS, COMMAND_SECONDS_BUCKETS
+from tracing import CommandTracer
+
+logger = logging.getLogger(__name__)
+
+# Options a stove of the STOVES list can set, the other ones are taken from the main configuration
+STOVE_OPTIONS = ('MCZip', 'MCZport', 'MQTT_TOPIC_PUB', 'MQTT_TOPIC_SUB', 'DEVICE_NAME', 'DEVICE_ID')
+
+def stove_configs(config, stoves):
+    """Return one configuration per stove: the main one, then one per STOVES entry on top of it
+
+    Args:
+        config: main configuration, _config_ names ('_MCZip', '_MQTT_TOPIC_PUB', ...)
+        stoves: list of dicts with some of the STOVE_OPTIONS, without the leading underscore
+    """
+    configs = [dict(config)]
+    for stove in stoves:
+        unknown = set(stove) - set(STOVE_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown stove options: {', '.join(sorted(unknown))}")
+        stove_config = dict(config)
+        stove_config.update(('_' + key, value) for key, value in stove.items())
+        configs.append(stove_config)
+    _check_unique(configs)
+    return configs
+
+def _check_unique(configs):
+    """Two stoves cannot share a discovery device id or topics, and no command topic may contain another one"""
+    for key in ('_DEVICE_ID', '_MQTT_TOPIC_PUB', '_MQTT_TOPIC_SUB'):
+        values = [config[key] for config in configs]
+        if len(set(values)) != len(values):
+            raise ValueError(f"Each stove needs its own {key.lstrip('_')}")
+    topics = [config['_MQTT_TOPIC_SUB'] for config in configs]
+    for topic in topics:
+        for other in topics:
+            if other != topic and other.startswith(topic):
+                raise ValueError(f"MQTT_TOPIC_SUB {other} is inside {topic}")
+
+class StoveSession(object):
+    """One stove driven through a MQTT client shared with the other stove sessions"""
+    def __init__(self, client, config, discovery_manager_class=None, recorder=None, log=logger):
+        """
+        Args:
+            client: paho client or mqttpool.SessionClient, the session only publishes and subscribes with it
+            config: _config_ names ('_MCZip', '_MQTT_TOPIC_PUB', '_REFRESH_INTERVAL', '_POLL_INTERVAL_FAST', ...)
+            discovery_manager_class: DiscoveryManager, None when the discovery module is not available
+            recorder: optional FrameRecorder keeping the frames received and the commands of the stove
+        """
+        self.client = client
+        self.config = config
+        self.recorder = recorder
+        self.log = log
+        self.name = config['_DEVICE_ID']
+        self.url = "ws://" + config['_MCZip'] + ":" + str(config['_MCZport'])
+        self.topic_pub = config['_MQTT_TOPIC_PUB']
+        self.topic_sub = config['_MQTT_TOPIC_SUB']
+        self.payload_type = config['_MQTT_PAYLOAD_TYPE']
+        self.reconnects_before_alert = config['_WS_RECONNECTS_BEFORE_ALERT']
+
+        self.command_queue = CoalescingQueue()
+        self.info_cache = {}
+        self.frame_delta = MaestroInfoDelta()
+        self.publisher = PublishBatcher(client, 1, max_inflight=config['_MQTT_MAX_INFLIGHT'], log=log)
+        self.websocket_connected = False
+        self.websocket_session = 0
+        self.socket_reconnect_count = 0
+        self.old_connection_status = None
+        self.published_poll_interval = None
+
+        # Counters of the metrics endpoint, each one written by a single thread without locking
+        self.frames_received = 0
+        self.frames_decoded = 0
+        self.decode_seconds = Histogram(DECODE_SECONDS_BUCKETS)
+        self.fields_changed = Histogram(FIELDS_CHANGED_BUCKETS)
+        self.command_seconds = Histogram(COMMAND_SECONDS_BUCKETS)
+        self.websocket_reconnects = 0
+        self.websocket_sessions = 0
+        self.websocket_rotations = 0
+        # Commands followed from their MQTT receipt to the frame showing the written value
+        self.tracer = CommandTracer(self.name, log=log)
+
+        interval = config['_REFRESH_INTERVAL']
+        # Burst polling after a command, fast in transitions or while the fume temperature moves, slow when off
+        self.policy = PollPolicy(interval,
+                                 fast_interval=config['_POLL_INTERVAL_FAST'],
+                                 slow_interval=config['_POLL_INTERVAL_SLOW'],
+                                 burst_interval=config['_POLL_BURST_INTERVAL'],
+                                 burst_duration=config['_POLL_BURST_DURATION'],
+                                 fume_rate_threshold=config['_POLL_FUME_RATE_THRESHOLD'])
+        # Single long-lived thread on a monotonic clock, backing off while the websocket is down
+        self.poller = PollScheduler(self.enqueue_stove_info, interval,
+                                    interval_for=self.stove_info_interval,
+                                    jitter=min(1.0, interval / 10),
+                                    is_connected=lambda: self.websocket_connected,
+                                    log=log)
+
+        self.discovery_manager = None
+        if discovery_manager_class is not None:
+            self.discovery_manager = discovery_manager_class(client, {
+                '_MQTT_DISCOVERY_ENABLED': config['_MQTT_DISCOVERY_ENABLED'],
+                '_MQTT_DISCOVERY_PREFIX': config['_MQTT_DISCOVERY_PREFIX'],
+                '_DEVICE_NAME': config['_DEVICE_NAME'],
+                '_DEVICE_ID': config['_DEVICE_ID'],
+                '_MQTT_TOPIC_PUB': self.topic_pub,
+                '_MQTT_TOPIC_SUB': self.topic_sub,
+                '_VERSION': config['_VERSION']
+            })
+
+    def subscription(self):
+        """MQTT subscription of the stove commands"""
+        if self.payload_type == 'TOPIC':
+            return self.topic_sub + '#'
+        return self.topic_sub
+
+    def register(self):
+        """Route the messages of the stove command topics to this session"""
+        self.client.message_callback_add(self.subscription(), self.on_mqtt_message)
+
+    def on_mqtt_connect(self):
+        """Subscribe to the stove commands and resynchronize discovery after each MQTT (re)connection"""
+        self.log.info('MQTT: Subscribed to topic "' + self.subscription() + '"')
+        self.client.subscribe(self.subscription(), qos=1)
+        if self.discovery_manager:
+            self.discovery_manager.new_session()
+            # Only the configs that differ from the ones retained on the broker are published
+            self.discovery_manager.start_discovery_sync()
+
+    def on_mqtt_message(self, client, userdata, message):
+        try:
+            maestrocommand = None
+            cmd_value = None
+            payload = str(message.payload.decode())
+            if self.payload_type == 'TOPIC':
+                topic = str(message.topic)
+                command = topic[str(topic).rindex('/')+1:]
+                self.log.debug(f"Command topic received: {topic}")
+                cmd_value = payload
+            else:
+                self.log.debug(f"MQTT: Message received: {payload}")
+                res = json.loads(payload)
+                command = res["Command"]
+                cmd_value = res["Value"]
+            if self.recorder is not None:
+                self.recorder.command(self.name, command, cmd_value)
+            maestrocommand = REGISTRY.command(command)
+            if maestrocommand.name == "Unknown":
+                self.log.debug(f"Unknown Maestro Command Received. Ignoring. {payload}")
+            elif maestrocommand.name == "Refresh":
+                self.log.debug('Clearing the message cache')
+                self.info_cache.clear()
+                self.frame_delta.reset()
+                self.publisher.forget()
+            else:
+                self.log.debug('Queueing Command ' + maestrocommand.name + ' ' + str(payload))
+                trace = self.tracer.received(maestrocommand, cmd_value)
+                self.command_queue.put(MaestroCommandValue(maestrocommand, cmd_value, received=trace.received, trace=trace))
+                # Report the effect of the command quickly
+                self.policy.command_sent()
+                self.poller.wake()
+        except Exception as e: # work on python 3.x
+                self.log.error('Exception in on_message_mqtt: '+ str(e))
+
+    def enqueue_stove_info(self):
+        """Get Stove information every x seconds as long as there is a websocket connection"""
+        if self.websocket_connected:
+            self.command_queue.put(MaestroCommandValue(REGISTRY.command('GetInfo'), 0))
+            self.client.publish(self.topic_pub + 'state', 'ON', 1)
+
+    def stove_info_interval(self):
+        """Interval until the next GetInfo, picked by the poll policy"""
+        interval = self.policy.next_interval()
+        self.publish_poll_interval(interval)
+        return interval
+
+    def publish_poll_interval(self, interval):
+        """Publish the effective poll interval (seconds) on its own topic when it changes.
+        The JSON mode keeps the state topic to the stove information"""
+        if interval == self.published_poll_interval:
+            return
+        self.log.info(f'Poll interval: {interval}s ({self.policy.reason})')
+        if self.payload_type == 'TOPIC':
+            self.publish({'Poll_Interval': interval})
+        self.published_poll_interval = interval
+
+    def publish(self, message):
+        """Publish a dict on one topic per key (TOPIC) or as one JSON message"""
+        if self.payload_type == 'TOPIC':
+            # One burst, topics already sent with the same value are skipped
+            self.publisher.publish(message, self.topic_pub)
+        else:
+            self.client.publish(self.topic_pub, json.dumps(message), 1)
+
+    def send_connection_status_message(self, message):
+        if self.old_connection_status != message:
+            if self.payload_type == 'TOPIC':
+                self.log.info('MQTT: publish to Topic "' + str(self.topic_pub) + '", Messages : ' + json.dumps(message))
+            self.publish(message)
+            self.old_connection_status = message
+
+    def process_info_message(self, message):
+        """Process websocket array string that has the stove Info message"""
+        # Only the fields whose raw token changed since the last frame are decoded
+        start = time.perf_counter()
+        res = self.frame_delta.process(message)
+        self.decode_seconds.observe(time.perf_counter() - start)
+        self.frames_decoded += 1
+        maestro_info_message_publish = {}
+
+        for item in res:
+            if item not in self.info_cache or self.info_cache[item] != res[item]:
+                self.info_cache[item] = res[item]
+                maestro_info_message_publish[item] = res[item]
+        self.policy.frame_received(self.info_cache.get('Stove_State'), self.info_cache.get('Fume_Temperature'))
+        self.fields_changed.observe(len(maestro_info_message_publish))
+
+        if len(maestro_info_message_publish) > 0:
+            if self.payload_type == 'TOPIC':
+                self.log.info(str(json.dumps(maestro_info_message_publish)))
+            self.publish(maestro_info_message_publish)
+        # Commands are confirmed once the frame showing their value is published
+        self.tracer.frame(self.info_cache)
+
+    def on_message(self, ws, message):
+        self.frames_received += 1
+        if self.recorder is not None:
+            self.recorder.frame(self.name, message)
+        message_array = message.split("|")
+        if message_array[0] == MaestroMessageType.Info.value:
+            self.process_info_message(message)
+        elif message_array[0] == MaestroMessageType.StringData.value:
+            self.log.info('Date Time Set ' + str(message_array[1]))
+        else:
+            self.log.info('Unsupported message type received !')
+
+    def on_error(self, ws, error):
+        self.log.info(error)
+
+    def on_close(self, ws, close_status_code, close_msg):
+        self.websocket_closed()
+        # Stop the sender of this session right away
+        end_session(self.command_queue, self.websocket_session)
+
+    def websocket_closed(self):
+        self.log.info('Websocket: Disconnected')
+        self.websocket_connected = False
+        # Publish availability offline for discovery
+        if self.discovery_manager:
+            self.discovery_manager.publish_availability_offline()
+
+    def on_open(self, ws):
+        self.websocket_opened()
+        # Commands are written as soon as they are queued, the session is rotated after SESSION_DURATION
+        self.websocket_session += 1
+        threading.Thread(target=self.send_commands, args=(ws, self.websocket_session), daemon=True).start()
+
+    def send_commands(self, ws, session_id):
+        if send_commands(ws, self.command_queue, session_id, on_sent=self.command_sent, log=self.log):
+            self.websocket_rotated()
+
+    def command_sent(self, command):
+        """A command was written on the websocket"""
+        if command.received is not None:
+            self.command_seconds.observe(time.monotonic() - command.received)
+        if command.trace is not None:
+            self.tracer.sent(command.trace)
+
+    def websocket_rotated(self):
+        """The gateway closed the websocket session after SESSION_DURATION"""
+        self.websocket_rotations += 1
+
+    def websocket_opened(self):
+        self.log.info('Websocket: Connected')
+        self.send_connection_status_message({"Status":"connected"})
+        self.websocket_connected = True
+        self.websocket_sessions += 1
+        self.socket_reconnect_count = 0
+        # Publish availability online for discovery
+        if self.discovery_manager:
+            self.discovery_manager.publish_availability_online()
+        # Get the stove information right away instead of waiting for the next tick
+        self.poller.wake()
+
+    def websocket_reconnect(self):
+        """Count websocket reconnections and publish an alert after _WS_RECONNECTS_BEFORE_ALERT"""
+        self.socket_reconnect_count = self.socket_reconnect_count + 1
+        self.websocket_reconnects += 1
+        self.log.info("Socket Reconnection Count: " + str(self.socket_reconnect_count))
+        if self.socket_reconnect_count > self.reconnects_before_alert:
+            self.send_connection_status_message({"Status":"disconnected"})
+            self.socket_reconnect_count = 0
+
+    def run_websocket(self):
+        """Connect and reconnect to the stove websocket forever, in the calling thread"""
+        while True:
+            self.log.info("Websocket: Establishing connection to server (" + self.url + ")")
+            ws = websocket.WebSocketApp(self.url,
+                                        on_message=self.on_message,
+                                        on_error=self.on_error,
+                                        on_close=self.on_close)
+            ws.on_open = self.on_open
+            ws.run_forever(ping_interval=5, ping_timeout=2, suppress_origin=True)
+            time.sleep(1)
+            self.websocket_reconnect()
+
+    def start_websocket(self):
+        """Run the websocket of the stove in its own thread"""
+        threading.Thread(target=self.run_websocket, name="Websocket-" + self.name, daemon=True).start()
+
+    def metrics(self):
+        """Return the session counters: frames, websocket, command queue, command traces, publish batcher, MQTT publishes and discovery"""
+        res = {
+            'websocket_connected': self.websocket_connected,
+            'poll_interval': self.policy.effective_interval,
+            'frames': {
+                'received': self.frames_received,
+                'decoded': self.frames_decoded,
+            },
+            'websocket': {
+                'reconnects': self.websocket_reconnects,
+                'sessions': self.websocket_sessions,
+                'rotations': self.websocket_rotations,
+            },
+            'queue': self.command_queue.metrics(),
+            'traces': self.tracer.metrics(),
+            'publisher': self.publisher.metrics(),
+        }
+        # Publish counters of the session on the pooled MQTT connection
+        client_metrics = getattr(self.client, 'metrics', None)
+        if client_metrics is not None:
+            res['mqtt'] = client_metrics()
+        if self.discovery_manager:
+            res['discovery'] = self.discovery_manager.metrics()
+        return res
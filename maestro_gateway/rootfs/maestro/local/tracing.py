@@ -0,0 +1,191 @@
+#coding: utf-8
+'''
+MCZ Maestro command tracing
+Follows each command received on MQTT until the stove reports the written value: a trace id and
+monotonic timestamps at the MQTT receipt, the websocket send and the first frame confirming the value.
+'''
+
+import itertools
+import logging
+import threading
+import time
+
+from maestro_protocol.commands import MaestroCommandValue, maestrocommandvalue_to_websocket_string
+from maestro_protocol.registry import REGISTRY
+from metrics import Histogram, COMMAND_SECONDS_BUCKETS, CONFIRM_SECONDS_BUCKETS
+
+# Seconds after the MQTT receipt before an unconfirmed command is counted as timed out
+TRACE_TIMEOUT = 120.0
+
+# Stove states reported once an ignition was accepted, before the stove is switched off again
+IGNITION_OR_RUNNING_STATES = frozenset(range(1, 16)) | {31}
+
+logger = logging.getLogger(__name__)
+
+def _written_value(maestrocommand, value):
+    """Integer written on the websocket for the command, None when the value cannot be encoded"""
+    try:
+        write = maestrocommandvalue_to_websocket_string(MaestroCommandValue(maestrocommand, value))
+        # int commands are written as floats, e.g. "C|WriteParametri|36|3.0"
+        return int(float(write.rsplit('|', 1)[1]))
+    except (ValueError, TypeError, IndexError):
+        return None
+
+def _power_confirmation(written):
+    # Derived Power stays ON during the extinguish and cooling states, the stove state tells sooner
+    running = written == 1
+    return 'Stove_State', lambda state: (state in IGNITION_OR_RUNNING_STATES) == running
+
+def _power_level_confirmation(written):
+    # Frames report the power level on top of 10
+    return 'Power_Level', lambda level: level == written + 10
+
+# Commands confirmed by another information or value than their own: name -> function(written value)
+CONFIRMATIONS = {
+    'Power': _power_confirmation,
+    'Power_Level': _power_level_confirmation,
+}
+
+def confirmation(maestrocommand, value):
+    """Return (information name, function(decoded value) -> bool) telling when a frame shows the
+    command applied, None when no frame field reports it (Reset_Alarm, Set_DateTime, ...)"""
+    if maestrocommand.commandcategory not in ('Basic', 'Diagnostics'):
+        return None
+    written = _written_value(maestrocommand, value)
+    if written is None:
+        return None
+    confirm = CONFIRMATIONS.get(maestrocommand.name)
+    if confirm is not None:
+        return confirm(written)
+    info = REGISTRY.info(maestrocommand.name)
+    if info.name == 'Unknown':
+        return None
+    expected = written / 2 if info.messagetype == 'temperature' else written
+    return info.name, lambda decoded: decoded == expected
+
+class CommandTrace(object):
+    """One command from its MQTT receipt to the frame confirming it"""
+    __slots__ = ('id', 'name', 'value', 'info', 'matches', 'received', 'sent', 'confirmed')
+
+    def __init__(self, id, name, value, received, confirmation=None):
+        self.id = id
+        self.name = name
+        self.value = value
+        self.info, self.matches = confirmation if confirmation is not None else (None, None)
+        self.received = received
+        self.sent = None
+        self.confirmed = None
+
+class CommandStats(object):
+    """Latency histograms and outcome counters of one command name"""
+    def __init__(self):
+        self.send_seconds = Histogram(COMMAND_SECONDS_BUCKETS)
+        self.confirm_seconds = Histogram(CONFIRM_SECONDS_BUCKETS)
+        self.round_trip_seconds = Histogram(CONFIRM_SECONDS_BUCKETS)
+        self.traces = 0
+        self.confirmed = 0
+        self.timeouts = 0
+        self.superseded = 0
+
+class CommandTracer(object):
+    """Command traces of a stove session. received() runs on the MQTT thread, sent() on the sender
+    and frame() on the websocket thread, so the open traces are kept under a lock"""
+    def __init__(self, name='', timeout=TRACE_TIMEOUT, clock=time.monotonic, log=logger):
+        self.name = name
+        self.timeout = timeout
+        self.clock = clock
+        self.log = log
+        self.ids = itertools.count(1)
+        # Open trace per command name, a newer command of the same name supersedes it
+        self.pending = {}
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = CommandStats()
+        return stats
+
+    def received(self, maestrocommand, value):
+        """Start the trace of a command received on MQTT and return it"""
+        now = self.clock()
+        trace = CommandTrace(next(self.ids), maestrocommand.name, value, now, confirmation(maestrocommand, value))
+        with self._lock:
+            stats = self._stats(trace.name)
+            stats.traces += 1
+            if self.pending.pop(trace.name, None) is not None:
+                stats.superseded += 1
+            if trace.info is not None:
+                self.pending[trace.name] = trace
+        self.log.debug(f'Trace {self.name}#{trace.id}: {trace.name} {value} received')
+        return trace
+
+    def sent(self, trace):
+        """The command of the trace was written on the websocket"""
+        now = self.clock()
+        with self._lock:
+            trace.sent = now
+            self._stats(trace.name).send_seconds.observe(now - trace.received)
+
+    def frame(self, values):
+        """Confirm the open traces whose information shows the written value
+
+        Args:
+            values: decoded stove information, e.g. the session info cache
+        """
+        if not self.pending:
+            return
+        now = self.clock()
+        confirmed = []
+        with self._lock:
+            for name, trace in list(self.pending.items()):
+                if trace.sent is None or trace.info not in values or not trace.matches(values[trace.info]):
+                    continue
+                trace.confirmed = now
+                del self.pending[name]
+                stats = self.stats[name]
+                stats.confirmed += 1
+                stats.confirm_seconds.observe(now - trace.sent)
+                stats.round_trip_seconds.observe(now - trace.received)
+                confirmed.append(trace)
+        for trace in confirmed:
+            self.log.info(f'Trace {self.name}#{trace.id}: {trace.name} {trace.value} confirmed '
+                          f'{trace.confirmed - trace.received:.2f}s after its receipt')
+        self.expire(now)
+
+    def expire(self, now=None):
+        """Count and drop the traces still unconfirmed TRACE_TIMEOUT after their receipt"""
+        if not self.pending:
+            return
+        now = self.clock() if now is None else now
+        expired = []
+        with self._lock:
+            for name, trace in list(self.pending.items()):
+                if now - trace.received >= self.timeout:
+                    del self.pending[name]
+                    self.stats[name].timeouts += 1
+                    expired.append(trace)
+        for trace in expired:
+            state = 'sent' if trace.sent is not None else 'not sent'
+            self.log.warning(f'Trace {self.name}#{trace.id}: {trace.name} {trace.value} ({state}) '
+                             f'not confirmed by {trace.info} after {self.timeout:g}s')
+
+    def command_stats(self):
+        """Return [(command name, CommandStats)] sorted by name"""
+        with self._lock:
+            return sorted(self.stats.items())
+
+    def metrics(self):
+        """Return per command counters: traces started, confirmed, timed out and superseded, plus the open traces"""
+        self.expire()
+        with self._lock:
+            return {
+                'pending': len(self.pending),
+                'commands': {name: {
+                    'traces': stats.traces,
+                    'confirmed': stats.confirmed,
+                    'timeouts': stats.timeouts,
+                    'superseded': stats.superseded,
+                } for name, stats in sorted(self.stats.items())},
+            }
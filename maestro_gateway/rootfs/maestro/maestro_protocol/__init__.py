@@ -0,0 +1,14 @@
+#coding: utf-8
+'''
+MCZ Maestro protocol core shared by the local (websocket) and cloud (socket.io) gateways:
+RecuperoInfo frame decoder, command encoder, lookup registry, MQTT publish batcher and frame recorder.
+The gateways only add their transport on top of it.
+
+Not named "maestro": the gateway scripts are maestro.py and would shadow it.
+'''
+
+from .messages import MaestroMessageType, MaestroInfoDelta, process_infostring, decode_info_token
+from .commands import MaestroCommand, MaestroCommandValue, maestrocommandvalue_to_websocket_string
+from .registry import REGISTRY, MaestroRegistry
+from .publisher import PublishBatcher
+from .recorder import FrameRecorder
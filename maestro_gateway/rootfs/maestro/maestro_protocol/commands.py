@@ -15,10 +15,13 @@ class MaestroCommand(object):
         self.commandcategory = commandcategory # Command type
 
 class MaestroCommandValue(object):
-    """Keyvaluepair: Maestrocammand and value"""
-    def __init__(self, maestrocommand, commandvalue):
+    """Keyvaluepair: Maestrocammand and value, received is the monotonic time of the MQTT receipt,
+    trace the optional command trace following it until the stove confirms it"""
+    def __init__(self, maestrocommand, commandvalue, received=None, trace=None):
         self.command = maestrocommand
         self.value = commandvalue
+        self.received = received
+        self.trace = trace
 
 MAESTRO_COMMANDS = []
 # Daemon Control Messages
@@ -70,14 +73,7 @@ MAESTRO_COMMANDS.append(MaestroCommand('3wayvalve', 9, 'onoff', 'Diagnostics'))
 # Datetime commands
 MAESTRO_COMMANDS.append(MaestroCommand('Set_DateTime', 0, 'datetime', 'SetDateTime')) # The value to the command has to be given as string in the format - > "ddmmYYYYHHmm", e.g. "171220201636" for the date 17/12/2020 04:36 pm.
 
-def get_maestro_command(commandname):
-    """Return Maestro command from the command list by name"""
-    i = 0
-    while i < len(MAESTRO_COMMANDS):
-        if commandname == MAESTRO_COMMANDS[i].name:
-            return MAESTRO_COMMANDS[i]
-        i += 1
-    return MaestroCommand('Unknown', -1, 'Unknown', 'Unknown')
+UNKNOWN_COMMAND = MaestroCommand('Unknown', -1, 'Unknown', 'Unknown')
 
 def maestrocommandvalue_to_websocket_string(maestrocommandval):
     """Return string to write on the websocket by Maestro command and Value"""
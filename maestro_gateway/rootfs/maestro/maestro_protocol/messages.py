@@ -1,5 +1,6 @@
 # coding: utf-8
 from enum import Enum 
+from types import MappingProxyType
 
 '''
 Maestro Response Messages
@@ -148,72 +149,118 @@ MAESTRO_INFORMATION.append(MaestroInformation(60, "AntiFreeze", 'onoff'))
 MAESTRO_INFORMATION.append(MaestroInformation(-1, "Power", 'onoff'))
 MAESTRO_INFORMATION.append(MaestroInformation(-2, "Diagnostics", 'onoff'))
 
-def get_maestro_info(frameid):
-    """Return Maestro info from the commandlist by name"""
-    if frameid >= 0 and frameid <= 60:
-        return MAESTRO_INFORMATION[frameid]
-    else:
-        return MaestroInformation(frameid, 'Unknown' + str(frameid), 'int')
-
-def get_maestro_infoname(infoname):
-    """Return Maestro command from the message list by name"""
-    i = 0
-    while i < len(MAESTRO_INFORMATION):
-        if infoname == MAESTRO_INFORMATION[i].name:
-            return MAESTRO_INFORMATION[i]
-        i += 1
-    return MaestroInformation(0, 'Unknown', 'int')
+# The decoder derives Power from the stove state, REGISTRY.stove_state() exposes the same index
+MAESTRO_STOVESTATE_BY_ID = MappingProxyType({state.stateid: state for state in MAESTRO_STOVESTATE})
+if len(MAESTRO_STOVESTATE_BY_ID) != len(MAESTRO_STOVESTATE):
+    raise ValueError("Duplicate Maestro stove state id")
+
+UNKNOWN_INFORMATION = MaestroInformation(0, 'Unknown', 'int')
 
 def process_infostring(message):
     """convert recuperoinfo message string to array"""
     res = {}
-    for i in range(1, len(message.split("|"))):
-        info = get_maestro_info(i)
-        if info.messagetype == "temperature":
-            res[info.name] = float(int(message.split("|")[i], 16))/2
-        elif info.messagetype == "timespan":
-            res[info.name] = seconds_to_hours_minutes(int(message.split("|")[i], 16))
-        elif info.messagetype == "3way":
-            if int(message.split("|")[i], 16) == 1:
-                res[info.name] = "Sani"
-            else:
-                res[info.name] = "Risc"
-        elif info.messagetype == "brazier":
-            if int(message.split("|")[i], 16) == 0:
-                res[info.name] = "OK"
-            else:
-                res[info.name] = "CLR"
-        else:
-            res[info.name] = int(message.split("|")[i], 16)
-        
-        if info.name == "Stove_State":
-            res["Power"] = get_maestro_stoveOnOrOff(res[info.name])
-            res["Diagnostics"] = get_maestro_indiagnosticsmode(res[info.name])
-        
+    tokens = message.split("|")
+    for (name, convert, derived), token in zip(_INFO_DECODERS, tokens[1:]):
+        value = convert(token)
+        res[name] = value
+        for derivedname, derive in derived:
+            res[derivedname] = derive(value)
+    # Fields beyond the known frame layout are kept as plain integers
+    for i in range(len(_INFO_DECODERS) + 1, len(tokens)):
+        res['Unknown' + str(i)] = int(tokens[i], 16)
     return res
 
+def decode_info_token(frameid, token, res):
+    """Decode a single recuperoinfo field (and the fields derived from it) into res"""
+    if 0 < frameid <= len(_INFO_DECODERS):
+        name, convert, derived = _INFO_DECODERS[frameid - 1]
+        value = convert(token)
+        res[name] = value
+        for derivedname, derive in derived:
+            res[derivedname] = derive(value)
+    elif frameid > 0:
+        res['Unknown' + str(frameid)] = int(token, 16)
+
+class MaestroInfoDelta(object):
+    """Remembers the raw tokens of the last recuperoinfo frame so only changed fields get decoded"""
+    def __init__(self):
+        self.last_message = None
+        self.last_tokens = []
+
+    def reset(self):
+        """Forget the last frame, the next one is decoded completely"""
+        self.last_message = None
+        self.last_tokens = []
+
+    def process(self, message):
+        """Return the decoded fields whose raw token differs from the previous frame"""
+        res = {}
+        if message == self.last_message:
+            return res
+        tokens = message.split("|")
+        previous = self.last_tokens
+        known = len(previous)
+        for i in range(1, len(tokens)):
+            token = tokens[i]
+            if i < known and previous[i] == token:
+                continue
+            decode_info_token(i, token, res)
+        self.last_message = message
+        self.last_tokens = tokens
+        return res
+
 def seconds_to_hours_minutes(seconds):
     m, s = divmod(seconds, 60)
     h, m = divmod(m, 60)
     return '{:d}:{:02d}:{:02d}'.format(h, m, s)
 
 def get_maestro_stoveOnOrOff(stateid):
-    i = 0
-    while i < len(MAESTRO_STOVESTATE):
-        if stateid == MAESTRO_STOVESTATE[i].stateid:
-            return MAESTRO_STOVESTATE[i].onoroff
-        i += 1
-    return 0
+    state = MAESTRO_STOVESTATE_BY_ID.get(stateid)
+    if state is None:
+        return 0
+    return state.onoroff
 
 def get_maestro_indiagnosticsmode(stateid):
     if stateid == 30 or stateid == 48:
         return 1
     return 0
 
-def get_maestro_stovestatedescription(stateid):
-    i = 0
-    while i < len(MAESTRO_STOVESTATE):
-        if stateid == MAESTRO_STOVESTATE[i].stateid:
-            return MAESTRO_INFORMATION[i].description
-        i += 1
-    return 'unknown'
\ No newline at end of file
+def _hex_to_int(token):
+    return int(token, 16)
+
+def _hex_to_temperature(token):
+    return int(token, 16) / 2
+
+def _hex_to_timespan(token):
+    return seconds_to_hours_minutes(int(token, 16))
+
+def _hex_to_3way(token):
+    return "Sani" if int(token, 16) == 1 else "Risc"
+
+def _hex_to_brazier(token):
+    return "OK" if int(token, 16) == 0 else "CLR"
+
+# Converter per MaestroInformation.messagetype, anything else is a plain integer
+INFO_CONVERTERS = {
+    'temperature': _hex_to_temperature,
+    'timespan': _hex_to_timespan,
+    '3way': _hex_to_3way,
+    'brazier': _hex_to_brazier,
+}
+
+# Informations computed from another frame field: frameid -> ((name, function), ...)
+DERIVED_INFORMATION = {
+    1: (("Power", get_maestro_stoveOnOrOff), ("Diagnostics", get_maestro_indiagnosticsmode)),
+}
+
+def _build_info_decoders():
+    """Build the (name, converter, derived) table indexed by frameid - 1, once at import"""
+    decoders = []
+    for info in MAESTRO_INFORMATION:
+        if info.frameid <= 0:
+            continue
+        convert = INFO_CONVERTERS.get(info.messagetype, _hex_to_int)
+        decoders.append((info.name, convert, DERIVED_INFORMATION.get(info.frameid, ())))
+    return tuple(decoders)
+
+_INFO_DECODERS = _build_info_decoders()
@@ -0,0 +1,98 @@
+#coding: utf-8
+'''
+MCZ Maestro MQTT publisher
+Collects the messages of one update cycle and publishes them in one burst,
+skipping the topics whose payload did not change since it was last sent
+'''
+
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def normalize_payload(payload):
+    """Payload as paho sends it, so values published as int, float or str compare equal"""
+    if payload is None:
+        return b''
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    return str(payload).encode('utf-8')
+
+class PublishBatcher(object):
+    """Publish batcher for one MQTT client. add() collects the updates of a cycle, the last
+    payload of a topic wins, and flush() publishes the ones that differ from what the broker
+    already got from us"""
+    def __init__(self, client, qos=1, retain=False, max_inflight=None, log=logger):
+        """
+        Args:
+            client: paho client
+            max_inflight: QoS 1/2 messages in flight before paho queues the next ones (paho default: 20)
+        """
+        self.client = client
+        self.qos = qos
+        self.retain = retain
+        self.log = log
+        self.pending = OrderedDict()
+        self.sent = {}
+        self.published_count = 0
+        self.suppressed_count = 0
+        self.flush_count = 0
+        self.topic_counts = {}
+        self._lock = threading.Lock()
+        if max_inflight is not None:
+            client.max_inflight_messages_set(max_inflight)
+
+    def add(self, topic, payload):
+        with self._lock:
+            self.pending[topic] = normalize_payload(payload)
+
+    def add_all(self, messages, prefix=''):
+        """Add a dict of {topic suffix: payload}"""
+        with self._lock:
+            for key, payload in messages.items():
+                self.pending[prefix + key] = normalize_payload(payload)
+
+    def flush(self):
+        """Publish the pending messages that changed, return the number of messages published"""
+        with self._lock:
+            pending, self.pending = self.pending, OrderedDict()
+            changed = [(topic, payload) for topic, payload in pending.items() if self.sent.get(topic) != payload]
+            self.suppressed_count += len(pending) - len(changed)
+            for topic, payload in changed:
+                self.client.publish(topic, payload, self.qos, self.retain)
+                self.sent[topic] = payload
+                self.topic_counts[topic] = self.topic_counts.get(topic, 0) + 1
+            self.published_count += len(changed)
+            if changed:
+                self.flush_count += 1
+        if changed:
+            self.log.debug(f'MQTT: published {len(changed)} of {len(pending)} messages')
+        return len(changed)
+
+    def publish(self, messages, prefix=''):
+        """Add a dict of messages and flush them"""
+        self.add_all(messages, prefix)
+        return self.flush()
+
+    def forget(self, topic=None):
+        """Forget what was sent (all topics by default) so the next flush publishes it again"""
+        with self._lock:
+            if topic is None:
+                self.sent.clear()
+            else:
+                self.sent.pop(topic, None)
+
+    def metrics(self):
+        """Return counters: messages published, messages skipped because unchanged and bursts sent"""
+        with self._lock:
+            return {
+                'published': self.published_count,
+                'suppressed': self.suppressed_count,
+                'flushes': self.flush_count,
+            }
+
+    def published_topics(self):
+        """Return the number of messages published on each topic"""
+        with self._lock:
+            return dict(self.topic_counts)
@@ -0,0 +1,111 @@
+#coding: utf-8
+'''
+MCZ Maestro frame recorder
+Appends the raw frames received from the stove and the inbound commands to a rotating log,
+one line per record: "<unix time> <kind> <stove> <data>", with backslashes and line breaks
+of the data escaped. The log can be replayed (tools/replay.py) to reproduce and measure
+the gateway on real traffic.
+'''
+
+import logging
+import os
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+# Record kinds
+FRAME = 'F'
+COMMAND = 'C'
+
+# Log rotation: frames.log, frames.log.1 ... frames.log.<RECORD_BACKUP_COUNT>
+RECORD_MAX_BYTES = 5000000
+RECORD_BACKUP_COUNT = 3
+
+# Escapes keeping one record per line whatever the MQTT payloads hold
+_ESCAPES = {'\\': '\\\\', '\n': '\\n', '\r': '\\r'}
+_UNESCAPES = {value[1]: key for key, value in _ESCAPES.items()}
+_ESCAPED = re.compile(r'[\\\n\r]')
+_UNESCAPED = re.compile(r'\\([\\nr])')
+
+def escape(data):
+    """Return data on a single line, see unescape()"""
+    return _ESCAPED.sub(lambda match: _ESCAPES[match.group()], data)
+
+def unescape(data):
+    """Return the data given to escape()"""
+    return _UNESCAPED.sub(lambda match: _UNESCAPES[match.group(1)], data)
+
+class FrameRecorder(object):
+    """Opt-in recorder of the stove traffic, safe to call from any thread"""
+    def __init__(self, path, max_bytes=RECORD_MAX_BYTES, backup_count=RECORD_BACKUP_COUNT, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.handler = RotatingFileHandler(path, 'a', max_bytes, backup_count, encoding='utf-8')
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        self.records = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, kind, stove, data):
+        """Append one record, line breaks in data are escaped"""
+        line = f"{self.clock():.3f} {kind} {stove} {escape(data)}"
+        # handle() takes the handler lock and rotates the file when it is full
+        self.handler.handle(logging.makeLogRecord({'msg': line}))
+        with self._lock:
+            self.records += 1
+            self.bytes += len(line) + 1
+
+    def frame(self, stove, message):
+        """Raw message received from the stove, e.g. "01|0|0|..." """
+        self.record(FRAME, stove, message)
+
+    def command(self, stove, name, value):
+        """Command received on MQTT for the stove, before it is queued"""
+        self.record(COMMAND, stove, f"{name}|{value}")
+
+    def close(self):
+        self.handler.close()
+
+    def metrics(self):
+        """Return counters: records appended and their size in bytes"""
+        with self._lock:
+            return {
+                'records': self.records,
+                'bytes': self.bytes,
+            }
+
+def log_files(path, backup_count=RECORD_BACKUP_COUNT):
+    """Return the existing files of a rotated log, oldest first"""
+    files = [f"{path}.{index}" for index in range(backup_count, 0, -1)] + [path]
+    return [name for name in files if os.path.exists(name)]
+
+def read_records(paths):
+    """Yield (timestamp, kind, stove, data) from recorder logs, oldest file first"""
+    for path in paths:
+        with open(path, encoding='utf-8') as log:
+            for line in log:
+                fields = line.rstrip('\n').split(' ', 3)
+                if len(fields) == 4:
+                    yield float(fields[0]), fields[1], fields[2], unescape(fields[3])
+
+def replay(records, handler, speed=1.0, clock=time.monotonic, sleep=time.sleep):
+    """Call handler(kind, stove, data) for each record, keeping the recorded pace divided by speed
+
+    Args:
+        records: (timestamp, kind, stove, data) iterable, e.g. read_records()
+        speed: 1 for real time, 10 for ten times faster, 0 for as fast as possible
+    Returns the number of records replayed
+    """
+    count = 0
+    start = None
+    for timestamp, kind, stove, data in records:
+        if speed > 0:
+            if start is None:
+                start = (timestamp, clock())
+            delay = (timestamp - start[0]) / speed - (clock() - start[1])
+            if delay > 0:
+                sleep(delay)
+        handler(kind, stove, data)
+        count += 1
+    return count
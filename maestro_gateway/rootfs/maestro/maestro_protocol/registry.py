@@ -0,0 +1,88 @@
+#coding: utf-8
+'''
+MCZ Maestro lookup registry
+Read-only name and id indexes over the command, information and stove state tables.
+The indexes are built once at import, lookups go through REGISTRY.
+'''
+
+from types import MappingProxyType
+
+from .commands import MAESTRO_COMMANDS, UNKNOWN_COMMAND
+from .messages import MAESTRO_INFORMATION, MAESTRO_STOVESTATE_BY_ID, UNKNOWN_INFORMATION
+
+# Command names defined in more than one category: category answering lookups by name
+MAESTRO_COMMAND_NAME_OWNERS = {
+    'DuctedFan1': 'Basic', # Diagnostics variant drives the fan in percentage
+    'DuctedFan2': 'Basic',
+}
+# Websocket ids shared by several commands of a category: command answering lookups by id
+MAESTRO_COMMAND_ID_OWNERS = {
+    ('Basic', 34): 'Power', # Feeding_Screw writes 49 to the power parameter
+    ('Basic', 149): 'Profile', # Adaptive_Mode writes the same parameter as on/off
+}
+
+def _index_commands():
+    """Build name, (category, name) and (category, id) indexes, duplicates must be listed in the owner tables"""
+    by_name = {}
+    by_category_name = {}
+    by_id = {}
+    for command in MAESTRO_COMMANDS:
+        key = (command.commandcategory, command.name)
+        if key in by_category_name:
+            raise ValueError(f"Maestro command {key} is defined twice")
+        by_category_name[key] = command
+
+        if command.name in by_name and command.name not in MAESTRO_COMMAND_NAME_OWNERS:
+            raise ValueError(f"Maestro command name {command.name} is ambiguous")
+        if MAESTRO_COMMAND_NAME_OWNERS.get(command.name, command.commandcategory) == command.commandcategory:
+            by_name[command.name] = command
+
+        if command.commandcategory in ('Basic', 'Diagnostics'):
+            idkey = (command.commandcategory, command.maestroid)
+            if idkey in by_id and idkey not in MAESTRO_COMMAND_ID_OWNERS:
+                raise ValueError(f"Maestro command id {idkey} is ambiguous")
+            if MAESTRO_COMMAND_ID_OWNERS.get(idkey, command.name) == command.name:
+                by_id[idkey] = command
+    return MappingProxyType(by_name), MappingProxyType(by_category_name), MappingProxyType(by_id)
+
+def _index_informations():
+    """Build the name index of the informations"""
+    by_name = {}
+    for info in MAESTRO_INFORMATION:
+        if info.name in by_name:
+            raise ValueError(f"Maestro information {info.name} is defined twice")
+        by_name[info.name] = info
+    return MappingProxyType(by_name)
+
+_COMMANDS_BY_NAME, _COMMANDS_BY_CATEGORY_NAME, _COMMANDS_BY_ID = _index_commands()
+_INFORMATIONS_BY_NAME = _index_informations()
+
+class MaestroRegistry(object):
+    """Single lookup API for Maestro commands, informations and stove states"""
+    __slots__ = ()
+
+    def command(self, name, category=None):
+        """Return the command by name. Names shared by several categories resolve to their owner category unless one is given"""
+        if category is None:
+            return _COMMANDS_BY_NAME.get(name, UNKNOWN_COMMAND)
+        return _COMMANDS_BY_CATEGORY_NAME.get((category, name), UNKNOWN_COMMAND)
+
+    def command_by_id(self, maestroid, category='Basic'):
+        """Return the command writing the websocket id. Shared ids resolve to their owner command"""
+        return _COMMANDS_BY_ID.get((category, maestroid), UNKNOWN_COMMAND)
+
+    def info(self, name):
+        """Return the information by name"""
+        return _INFORMATIONS_BY_NAME.get(name, UNKNOWN_INFORMATION)
+
+    def stove_state(self, stateid):
+        """Return the stove state by id or None"""
+        return MAESTRO_STOVESTATE_BY_ID.get(stateid)
+
+    def commands(self):
+        return _COMMANDS_BY_CATEGORY_NAME.values()
+
+    def informations(self):
+        return _INFORMATIONS_BY_NAME.values()
+
+REGISTRY = MaestroRegistry()
@@ -36,12 +36,24 @@ _MQTT_pass = '$(bashio::config 'MQTT_pass')'
 _MQTT_TOPIC_SUB = '$(bashio::config 'MQTT_TOPIC_SUB')'
 _MQTT_TOPIC_PUB = '$(bashio::config 'MQTT_TOPIC_PUB')'
 _MQTT_PAYLOAD_TYPE = '$(bashio::config 'MQTT_PAYLOAD_TYPE')'
+_MQTT_MAX_INFLIGHT = $(get_config_with_default 'MQTT_MAX_INFLIGHT' '100')
+_MQTT_CONNECTIONS = $(get_config_with_default 'MQTT_CONNECTIONS' '1')
 _MQTT_DISCOVERY_ENABLED = $(get_bool_config_with_default 'MQTT_DISCOVERY_ENABLED' 'False')
 _MQTT_DISCOVERY_PREFIX = '$(get_config_with_default 'MQTT_DISCOVERY_PREFIX' 'homeassistant')'
 _DEVICE_NAME = '$(get_config_with_default 'DEVICE_NAME' 'MCZ Maestro Stove')'
 _DEVICE_ID = '$(get_config_with_default 'DEVICE_ID' 'mcz_maestro_stove')'
 _WS_RECONNECTS_BEFORE_ALERT = $(bashio::config 'WS_RECONNECTS_BEFORE_ALERT')
 _REFRESH_INTERVAL = $(bashio::config 'REFRESH_INTERVAL')
+_POLL_INTERVAL_FAST = $(get_config_with_default 'POLL_INTERVAL_FAST' '5.0')
+_POLL_INTERVAL_SLOW = $(get_config_with_default 'POLL_INTERVAL_SLOW' '60.0')
+_POLL_BURST_INTERVAL = $(get_config_with_default 'POLL_BURST_INTERVAL' '3.0')
+_POLL_BURST_DURATION = $(get_config_with_default 'POLL_BURST_DURATION' '60.0')
+_POLL_FUME_RATE_THRESHOLD = $(get_config_with_default 'POLL_FUME_RATE_THRESHOLD' '5.0')
+_ASYNC_RUNTIME = $(get_bool_config_with_default 'ASYNC_RUNTIME' 'False')
+_RECORD_FRAMES = $(get_bool_config_with_default 'RECORD_FRAMES' 'False')
+_RECORD_FILE = '$(get_config_with_default 'RECORD_FILE' '/data/frames.log')'
+_METRICS_PORT = $(get_config_with_default 'METRICS_PORT' '0')
+_STOVES = $(jq -c '.STOVES // []' /data/options.json | python3 -c 'import sys; print(repr(sys.stdin.read().strip()))')
 _MCZip = '$(bashio::config 'MCZip')'
 _MCZport = '$(bashio::config 'MCZport')'
 _VERSION = '1.03'
@@ -57,11 +69,15 @@ _MQTT_pass = '$(bashio::config 'MQTT_pass')'
 _MQTT_TOPIC_SUB = '$(bashio::config 'MQTT_TOPIC_SUB')'
 _MQTT_TOPIC_PUB = '$(bashio::config 'MQTT_TOPIC_PUB')'
 _MQTT_PAYLOAD_TYPE = '$(bashio::config 'MQTT_PAYLOAD_TYPE')'
+_MQTT_MAX_INFLIGHT = $(get_config_with_default 'MQTT_MAX_INFLIGHT' '100')
 _MQTT_DISCOVERY_ENABLED = $(get_bool_config_with_default 'MQTT_DISCOVERY_ENABLED' 'False')
 _MQTT_DISCOVERY_PREFIX = '$(get_config_with_default 'MQTT_DISCOVERY_PREFIX' 'homeassistant')'
 _DEVICE_NAME = '$(get_config_with_default 'DEVICE_NAME' 'MCZ Maestro Stove')'
 _DEVICE_ID = '$(get_config_with_default 'DEVICE_ID' 'mcz_maestro_stove')'
 _WS_RECONNECTS_BEFORE_ALERT = $(bashio::config 'WS_RECONNECTS_BEFORE_ALERT')
+_MQTT_FULL_REFRESH_INTERVAL = $(get_config_with_default 'MQTT_FULL_REFRESH_INTERVAL' '300')
+_RECORD_FRAMES = $(get_bool_config_with_default 'RECORD_FRAMES' 'False')
+_RECORD_FILE = '$(get_config_with_default 'RECORD_FILE' '/data/frames.log')'
 _MCZip = '$(bashio::config 'MCZip')'
 _MCZport = '$(bashio::config 'MCZport')'
 _MCZ_device_serial = '$(bashio::config 'MCZ_device_serial')'
@@ -8,7 +8,8 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), 'maestro_gateway/rootfs/maestro'))
 
-from discovery import DiscoveryManager, ENTITY_DESCRIPTORS
+from discovery import DiscoveryManager, ENTITY_DESCRIPTORS, EXCLUDED_ENTITIES, EXPOSED_COMMAND_CATEGORIES, payload_fingerprint
+from maestro_protocol.registry import REGISTRY
 import json
 
 # Mock MQTT client for testing
@@ -64,10 +65,32 @@ def test_discovery():
     print(f"\n📤 Publishing Discovery Configs...")
     discovery_manager.publish_discovery_configs()
     
+    # Configs already retained on the broker with the same payload are not published again
+    retained = {msg['topic']: payload_fingerprint(msg['payload']) for msg in mock_client.published_messages[:10]}
+    published_before = len(mock_client.published_messages)
+    discovery_manager.publish_discovery_configs(retained)
+    assert len(mock_client.published_messages) - published_before == len(ENTITY_DESCRIPTORS) - 10
+    assert mock_client.published_messages[published_before]['payload'] == mock_client.published_messages[10]['payload']
+    
+    # Retained configs of entities that no longer exist are removed
+    stale_topic = 'homeassistant/sensor/test_mcz_stove/test_mcz_stove_removed_entity/config'
+    discovery_manager.remove_stale_configs(dict(retained, **{stale_topic: payload_fingerprint('{}')}))
+    assert mock_client.published_messages[-1] == {'topic': stale_topic, 'payload': '', 'retain': True}
+    assert discovery_manager.metrics()['discovery_removed'] == 1
+    print(f"Discovery counters: {discovery_manager.metrics()}")
+    
     # Test availability
     print(f"\n🟢 Testing Availability...")
     discovery_manager.publish_availability_online()
+    discovery_manager.publish_availability_online()
     discovery_manager.publish_availability_offline()
+    availability = [msg['payload'] for msg in mock_client.published_messages if msg['topic'] == discovery_manager.availability_topic]
+    assert availability == ['online', 'offline'], availability
+    assert discovery_manager.metrics()['availability_suppressed'] == 1
+    discovery_manager.new_session()
+    discovery_manager.publish_availability_offline()
+    assert discovery_manager.metrics()['availability_published'] == 3
+    print(f"Availability counters: {discovery_manager.metrics()}")
     
     print(f"\n✅ Test Complete!")
     print(f"Total MQTT messages published: {len(mock_client.published_messages)}")
@@ -77,5 +100,29 @@ def test_discovery():
     for msg in mock_client.published_messages[:3]:
         print(f"   {msg['topic']}")
 
+def test_coverage():
+    """Every information and command of the registries is exposed or deliberately excluded"""
+    keys = [entity.key for entity in ENTITY_DESCRIPTORS]
+    assert isinstance(ENTITY_DESCRIPTORS, tuple)
+    assert len(keys) == len(set(keys)), "Duplicate entity key"
+    for info in REGISTRY.informations():
+        assert info.name in keys or info.name in EXCLUDED_ENTITIES, f"Information {info.name} not exposed"
+    for command in REGISTRY.commands():
+        if command.commandcategory in EXPOSED_COMMAND_CATEGORIES:
+            assert command.name in keys or command.name in EXCLUDED_ENTITIES, f"Command {command.name} not exposed"
+    # An exposed command must own its websocket id, or it would write another parameter
+    for command in REGISTRY.commands():
+        if command.name in keys and command.commandcategory == "Basic":
+            owner = REGISTRY.command_by_id(command.maestroid)
+            assert owner is command, f"Command {command.name} writes the parameter of {owner.name}"
+    for entity in ENTITY_DESCRIPTORS:
+        if entity.component_type == "number":
+            assert entity.max_value < 255, f"Number {entity.key} has no real bounds"
+    components = {}
+    for entity in ENTITY_DESCRIPTORS:
+        components[entity.component_type] = components.get(entity.component_type, 0) + 1
+    print(f"\n🧭 Coverage: {len(keys)} entities {components}, {len(EXCLUDED_ENTITIES)} names excluded")
+
 if __name__ == "__main__":
-    test_discovery()
\ No newline at end of file
+    test_discovery()
+    test_coverage()
\ No newline at end of file
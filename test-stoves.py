@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Test script for the multi-stove local gateway
+20 simulated stoves (tools/simulator.py) driven by one process over a pool of MQTT
+connections to a local mosquitto stand-in. Run this before deployment
+"""
+
+import sys
+import os
+import threading
+import time
+import urllib.request
+sys.path.append(os.path.join(os.path.dirname(__file__), 'maestro_gateway/rootfs/maestro'))
+sys.path.append(os.path.join(os.path.dirname(__file__), 'maestro_gateway/rootfs/maestro/local'))
+sys.path.append(os.path.join(os.path.dirname(__file__), 'tools'))
+
+import paho.mqtt.client as mqtt
+
+from mqttbroker import MqttBroker
+from simulator import StoveSimulator
+from session import StoveSession, stove_configs
+from mqttpool import MqttConnectionPool
+from scheduler import PollPolicy
+from aioruntime import session_gateway, run_gateway
+from metrics import MetricsServer, render_metrics, CONTENT_TYPE
+
+STOVES = 20
+CONNECTIONS = 2
+
+CONFIG = {
+    '_MCZip': '127.0.0.1',
+    '_MCZport': 0,
+    '_MQTT_TOPIC_PUB': 'Maestro/0/',
+    '_MQTT_TOPIC_SUB': 'Maestro/Command/0/',
+    '_MQTT_PAYLOAD_TYPE': 'TOPIC',
+    '_MQTT_MAX_INFLIGHT': 100,
+    '_WS_RECONNECTS_BEFORE_ALERT': 5,
+    '_REFRESH_INTERVAL': 15.0,
+    '_POLL_INTERVAL_FAST': 5.0,
+    '_POLL_INTERVAL_SLOW': 60.0,
+    '_POLL_BURST_INTERVAL': 3.0,
+    '_POLL_BURST_DURATION': 60.0,
+    '_POLL_FUME_RATE_THRESHOLD': 5.0,
+    '_MQTT_DISCOVERY_ENABLED': False,
+    '_MQTT_DISCOVERY_PREFIX': 'homeassistant',
+    '_DEVICE_NAME': 'Stove 0',
+    '_DEVICE_ID': 'stove_0',
+    '_VERSION': 'test'
+}
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def test_stove_configs():
+    configs = stove_configs(CONFIG, [{'MCZport': '82', 'DEVICE_ID': 'stove_1',
+                                      'MQTT_TOPIC_PUB': 'Maestro/1/', 'MQTT_TOPIC_SUB': 'Maestro/Command/1/'}])
+    assert [config['_MCZport'] for config in configs] == [0, '82']
+    assert configs[1]['_REFRESH_INTERVAL'] == CONFIG['_REFRESH_INTERVAL']
+    for stoves in ([{'DEVICE_ID': 'stove_0', 'MQTT_TOPIC_PUB': 'A/', 'MQTT_TOPIC_SUB': 'B/'}],
+                   [{'DEVICE_ID': 'stove_1', 'MQTT_TOPIC_PUB': 'A/', 'MQTT_TOPIC_SUB': 'Maestro/Command/0/1/'}],
+                   [{'REFRESH_INTERVAL': 1}]):
+        try:
+            stove_configs(CONFIG, stoves)
+        except ValueError as e:
+            print(f"Rejected: {e}")
+        else:
+            assert False, f"Accepted {stoves}"
+
+def test_poll_policy():
+    now = [0.0]
+    policy = PollPolicy(15.0, fast_interval=5.0, fume_rate_threshold=5.0, clock=lambda: now[0])
+    # A steady stove whose fume probe flickers by one degree goes back to the default interval
+    for tick in range(60):
+        policy.frame_received(13, 150 + tick % 2)
+        assert policy.next_interval() == 15.0, (tick, policy.fume_rate, policy.reason)
+        now[0] += 5.0 if tick < 30 else 3.0
+    # while a fume temperature moving by 10 degrees per minute polls fast
+    for tick in range(30):
+        policy.frame_received(13, 150 + tick * 10 / 12)
+        now[0] += 5.0
+    assert policy.next_interval() == 5.0 and policy.reason == 'fume temperature', policy.fume_rate
+    print(f"Poll policy: {policy.fume_rate:.1f} degrees/min -> {policy.effective_interval}s")
+
+def simulated_sessions(pool, simulator):
+    """One stove session per simulated stove, the first one on the main configuration"""
+    stoves = [{'MCZport': port, 'DEVICE_ID': f'stove_{index}', 'DEVICE_NAME': f'Stove {index}',
+               'MQTT_TOPIC_PUB': f'Maestro/{index}/', 'MQTT_TOPIC_SUB': f'Maestro/Command/{index}/'}
+              for index, port in enumerate(simulator.ports)]
+    configs = stove_configs(dict(CONFIG, _MCZport=simulator.ports[0]), stoves[1:])
+    return [pool.add_session(lambda client, config=config: StoveSession(client, config)) for config in configs]
+
+def check_setpoints(broker, simulator, sessions):
+    """Every stove gets its own command, routed by topic prefix, and reports it in the following frames"""
+    tester = mqtt.Client('tester')
+    tester.connect(broker.host, broker.port)
+    tester.loop_start()
+    for index in range(STOVES):
+        # A value that cannot be encoded is skipped, the sender goes on with the next command
+        tester.publish(f'Maestro/Command/{index}/Power_Level', 'high', 1)
+        tester.publish(f'Maestro/Command/{index}/Temperature_Setpoint', str(15 + index / 2), 1)
+    setpoints = [30 + index for index in range(STOVES)]
+    assert wait_until(lambda: [stove.get('Temperature_Setpoint') for stove in simulator.stoves] == setpoints)
+    def published_setpoints():
+        values = {}
+        for _, _, topic, payload in broker.published:
+            values[topic] = payload
+        return [values.get(f'Maestro/{index}/Temperature_Setpoint') for index in range(STOVES)]
+    assert wait_until(lambda: published_setpoints() == [str(15 + index / 2).encode() for index in range(STOVES)]), \
+        published_setpoints()
+    # which confirms the command traces
+    def confirmed_setpoints():
+        return [session.tracer.metrics()['commands']['Temperature_Setpoint']['confirmed'] for session in sessions]
+    assert wait_until(lambda: confirmed_setpoints() == [1] * STOVES), confirmed_setpoints()
+    assert all(session.tracer.metrics()['pending'] == 0 for session in sessions)
+    tester.loop_stop()
+
+def test_stoves():
+    broker = MqttBroker().start()
+    simulator = StoveSimulator(STOVES, seed=0).start()
+
+    print(f"🔥 Testing {STOVES} stoves over {CONNECTIONS} MQTT connections")
+    pool = MqttConnectionPool(broker.host, broker.port, size=CONNECTIONS)
+    sessions = simulated_sessions(pool, simulator)
+    pool.connect()
+    assert wait_until(lambda: all(pool.connected))
+    for session in sessions:
+        session.poller.start()
+        session.start_websocket()
+    assert wait_until(lambda: all(session.websocket_connected for session in sessions))
+    assert wait_until(lambda: simulator.metrics()['answers'] >= STOVES)
+    check_setpoints(broker, simulator, sessions)
+
+    # Each stove publishes on its own topics, counted per session
+    for index, session in enumerate(sessions):
+        def received_by_broker():
+            return sum(1 for _, _, topic, _ in broker.published if topic.startswith(f'Maestro/{index}/'))
+        assert wait_until(lambda: received_by_broker() == session.client.metrics()['published'])
+        assert f'Maestro/{index}/Stove_State' in set(topic for _, _, topic, _ in broker.published)
+    metrics = pool.metrics()
+    client_ids = [connection['client_id'] for connection in metrics['connections']]
+    assert len(set(client_ids)) == CONNECTIONS
+    assert all(len(connection['sessions']) == STOVES // CONNECTIONS for connection in metrics['connections'])
+    # Every message was acknowledged by the broker
+    assert wait_until(lambda: all(connection['queued'] == connection['inflight'] == 0
+                                  for connection in pool.metrics()['connections']))
+    print(f"Connections: {metrics['connections'][0]['client_id']}, {metrics['connections'][1]['client_id']}")
+    print(f"Session counters: stove_0 {metrics['sessions']['stove_0']}, {sessions[0].metrics()['publisher']}")
+
+    # OpenMetrics endpoint
+    server = MetricsServer(lambda: render_metrics(sessions, pool), host='127.0.0.1', port=0).start()
+    with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+        assert response.headers['Content-Type'] == CONTENT_TYPE
+        text = response.read().decode()
+    server.stop()
+    assert text.endswith('# EOF\n')
+    samples = dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+    for index in range(STOVES):
+        assert int(samples[f'maestro_frames_decoded_total{{stove="stove_{index}"}}']) >= 1
+        assert int(samples[f'maestro_commands_queued_total{{stove="stove_{index}"}}']) >= 1
+        assert samples[f'maestro_command_seconds_count{{stove="stove_{index}"}}'] == '1'
+        command = f'stove="stove_{index}",command="Temperature_Setpoint"'
+        assert samples[f'maestro_command_round_trip_seconds_count{{{command}}}'] == '1'
+        assert samples[f'maestro_command_timeouts_total{{{command}}}'] == '0'
+        assert int(samples[f'maestro_mqtt_publishes_total{{stove="stove_{index}",topic="Maestro/{index}/Temperature_Setpoint"}}']) >= 1
+    print(f"Metrics: {len(samples)} samples, {samples['maestro_threads']} threads")
+
+    # A second gateway does not kick the first one off the broker
+    other = MqttConnectionPool(broker.host, broker.port, size=CONNECTIONS)
+    other.connect()
+    assert wait_until(lambda: all(other.connected))
+    time.sleep(0.5)
+    assert all(pool.connected), "The second gateway kicked the first one off"
+    assert set(client_ids) <= set(broker.clients)
+    print(f"\n✅ Test Complete! {len(broker.published)} messages published by {STOVES} stoves")
+
+def test_async_runtime():
+    """Same stoves on the asyncio runtime (ASYNC_RUNTIME): MQTT clients and websockets on one event loop"""
+    broker = MqttBroker().start()
+    simulator = StoveSimulator(STOVES, seed=1).start()
+
+    print(f"\n🔥 Testing {STOVES} stoves on the asyncio runtime")
+    pool = MqttConnectionPool(broker.host, broker.port, size=CONNECTIONS)
+    sessions = simulated_sessions(pool, simulator)
+    gateways = [session_gateway(session) for session in sessions]
+    threading.Thread(target=run_gateway, args=(pool.clients, broker.host, broker.port, gateways),
+                     name="Asyncio", daemon=True).start()
+    assert wait_until(lambda: all(pool.connected))
+    assert wait_until(lambda: all(session.websocket_connected for session in sessions))
+    assert wait_until(lambda: simulator.metrics()['answers'] >= STOVES)
+    check_setpoints(broker, simulator, sessions)
+    print(f"✅ Async runtime: {simulator.metrics()['answers']} frames answered by {STOVES} stoves")
+
+if __name__ == "__main__":
+    test_stove_configs()
+    test_poll_policy()
+    test_stoves()
+    test_async_runtime()
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+"""
+Micro benchmarks for the gateway hot paths
+Run this to compare the current implementation against the previous one
+on recorded stove frames before deployment
+"""
+
+import sys
+import os
+import queue
+import random
+import statistics
+import threading
+import time
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../maestro_gateway/rootfs/maestro'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../maestro_gateway/rootfs/maestro/local'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../maestro_gateway/rootfs/maestro/cloud'))
+
+from frames import RECORDED_FRAMES
+from commandqueue import CoalescingQueue
+from maestro_protocol.commands import MaestroCommandValue, maestrocommandvalue_to_websocket_string
+from maestro_protocol.registry import REGISTRY
+from maestro_protocol.publisher import PublishBatcher
+from sender import send_commands, end_session
+from wsserver import WebsocketServer
+from mqttbroker import MqttBroker
+from maestro_protocol.messages import process_infostring, get_maestro_stoveOnOrOff, MaestroInformation, MAESTRO_INFORMATION, \
+    get_maestro_indiagnosticsmode, seconds_to_hours_minutes, MaestroInfoDelta
+from decoding import build_translator, decode_frame, individual_topics, secTOdhms, FrameLabels
+from dispatcher import CommandDispatcher
+from translations.data_fr import RecuperoInfo
+
+ITERATIONS = 2000
+
+
+def legacy_get_maestro_info(frameid):
+    """get_maestro_info as it was before the registry (frame position lookup)"""
+    if frameid >= 0 and frameid <= 60:
+        return MAESTRO_INFORMATION[frameid]
+    else:
+        return MaestroInformation(frameid, 'Unknown' + str(frameid), 'int')
+
+
+def legacy_process_infostring(message):
+    """process_infostring as it was before the compiled decoder (one split per field)"""
+    res = {}
+    for i in range(1, len(message.split("|"))):
+        info = legacy_get_maestro_info(i)
+        if info.messagetype == "temperature":
+            res[info.name] = float(int(message.split("|")[i], 16))/2
+        elif info.messagetype == "timespan":
+            res[info.name] = seconds_to_hours_minutes(int(message.split("|")[i], 16))
+        elif info.messagetype == "3way":
+            if int(message.split("|")[i], 16) == 1:
+                res[info.name] = "Sani"
+            else:
+                res[info.name] = "Risc"
+        elif info.messagetype == "brazier":
+            if int(message.split("|")[i], 16) == 0:
+                res[info.name] = "OK"
+            else:
+                res[info.name] = "CLR"
+        else:
+            res[info.name] = int(message.split("|")[i], 16)
+
+        if info.name == "Stove_State":
+            res["Power"] = get_maestro_stoveOnOrOff(res[info.name])
+            res["Diagnostics"] = get_maestro_indiagnosticsmode(res[info.name])
+
+    return res
+
+
+def legacy_info_changes(message, cache):
+    """Changed fields as computed before the delta stage: full decode then compare"""
+    res = process_infostring(message)
+    changes = {}
+    for item in res:
+        if item not in cache or cache[item] != res[item]:
+            cache[item] = res[item]
+            changes[item] = res[item]
+    return changes
+
+
+def delta_info_changes(message, cache, delta):
+    """Changed fields as computed by process_info_message with the delta stage"""
+    res = delta.process(message)
+    changes = {}
+    for item in res:
+        if item not in cache or cache[item] != res[item]:
+            cache[item] = res[item]
+            changes[item] = res[item]
+    return changes
+
+
+def legacy_rispondo_decode(stringaRicevuta):
+    """Cloud rispondo decoding as it was before the indexed translator"""
+    res = {}
+    datas = stringaRicevuta.split("|")
+    for i in range(0, len(datas)):
+        for j in range(0, len(RecuperoInfo)):
+            if i == RecuperoInfo[j][0]:
+                if len(RecuperoInfo[j]) > 2:
+                    for k in range(0, len(RecuperoInfo[j][2])):
+                        if int(datas[i], 16) == RecuperoInfo[j][2][k][0]:
+                            res[RecuperoInfo[j][1]] = RecuperoInfo[j][2][k][1]
+                            break
+                        else:
+                            res[RecuperoInfo[j][1]] = ('Code inconnu :', str(int(datas[i], 16)))
+                else:
+                    if i == 6 or i == 26 or i == 28:
+                        res[RecuperoInfo[j][1]] = float(int(datas[i], 16)) / 2
+                    elif i >= 37 and i <= 42:
+                        res[RecuperoInfo[j][1]] = secTOdhms(int(datas[i], 16))
+                    else:
+                        res[RecuperoInfo[j][1]] = int(datas[i], 16)
+    return res
+
+
+RECUPERO_TRANSLATOR = build_translator(RecuperoInfo)
+
+
+def rispondo_decode(stringaRicevuta):
+    """Cloud rispondo decoding with the indexed translator"""
+    return decode_frame(stringaRicevuta.split("|"), RECUPERO_TRANSLATOR, {})
+
+
+class LegacySetQueue(queue.Queue):
+    """SetQueue as it was before the coalescing queue (linear scan on put)"""
+    def _init(self, maxsize):
+        queue.Queue._init(self, maxsize)
+        self.all_items = set()
+
+    def _put(self, item):
+        found = False
+        for val in self.all_items:
+            if val.command.name == item.command.name:
+                found = True
+                val.value = item.value
+        if not found:
+            queue.Queue._put(self, item)
+            self.all_items.add(item)
+
+    def _get(self):
+        item = queue.Queue._get(self)
+        self.all_items.remove(item)
+        return item
+
+
+def legacy_send_commands(ws, command_queue, stop):
+    """Websocket sender as it was before: wakes up every 250 ms to check the queue"""
+    for i in range(360*4):
+        time.sleep(0.25)
+        if stop.is_set():
+            return
+        while not command_queue.empty():
+            command = command_queue.get()
+            cmd = maestrocommandvalue_to_websocket_string(command)
+            if cmd != "":
+                ws.send(cmd)
+
+
+def legacy_publish_topics(client, prefix, messages):
+    """TOPIC mode publishing as it was before: one QoS 1 publish per key, every time"""
+    for key in messages:
+        client.publish(prefix + key, messages[key], 1)
+
+
+def per_frame_us(function, frames, iterations=ITERATIONS):
+    """Return the mean time in microseconds spent by function on one frame"""
+    def run():
+        for frame in frames:
+            function(frame)
+    total = min(timeit.repeat(run, number=iterations, repeat=3))
+    return total / (iterations * len(frames)) * 1e6
+
+
+def report(title, baseline_us, current_us, unit="frame"):
+    print(f"{title}")
+    print(f"   before: {baseline_us:8.2f} us/{unit}")
+    print(f"   after:  {current_us:8.2f} us/{unit}")
+    print(f"   speedup: x{baseline_us / current_us:.1f}")
+
+
+def bench_process_infostring():
+    for frame in RECORDED_FRAMES:
+        expected = legacy_process_infostring(frame)
+        decoded = process_infostring(frame)
+        assert decoded == expected, f"Decoder mismatch on {frame}"
+        assert list(decoded) == list(expected), f"Key order mismatch on {frame}"
+    report("process_infostring",
+           per_frame_us(legacy_process_infostring, RECORDED_FRAMES),
+           per_frame_us(process_infostring, RECORDED_FRAMES))
+
+
+def bench_info_delta():
+    # A stove polled every 15 s mostly sends the same frame again
+    polled = [frame for frame in RECORDED_FRAMES for _ in range(4)]
+    cache, delta_cache, delta = {}, {}, MaestroInfoDelta()
+    for frame in polled:
+        assert legacy_info_changes(frame, cache) == delta_info_changes(frame, delta_cache, delta), \
+            f"Delta mismatch on {frame}"
+
+    cache = {}
+    baseline = per_frame_us(lambda frame: legacy_info_changes(frame, cache), polled)
+    delta_cache, delta = {}, MaestroInfoDelta()
+    current = per_frame_us(lambda frame: delta_info_changes(frame, delta_cache, delta), polled)
+    report("process_info_message change detection", baseline, current)
+
+
+def bench_rispondo():
+    for frame in RECORDED_FRAMES:
+        expected = legacy_rispondo_decode(frame)
+        decoded = rispondo_decode(frame)
+        assert decoded == expected, f"Cloud decoder mismatch on {frame}"
+        assert list(decoded) == list(expected), f"Cloud key order mismatch on {frame}"
+        # The discovery topics keep the 1..5 power level of the "Puissance N" label
+        topics = individual_topics(process_infostring(frame))
+        assert topics["Power_Level"] == topics["Power_Level_Control"] == int(decoded["Puissance Active"].split()[-1]), \
+            f"Cloud power level mismatch on {frame}"
+    report("cloud rispondo decoding",
+           per_frame_us(legacy_rispondo_decode, RECORDED_FRAMES, ITERATIONS // 10),
+           per_frame_us(rispondo_decode, RECORDED_FRAMES))
+
+    # Labels of the JSON topic rendered only for the positions that changed
+    polled = [frame for frame in RECORDED_FRAMES for _ in range(4)]
+    labels, rendered = FrameLabels(RECUPERO_TRANSLATOR), {}
+    for frame in polled:
+        labels.render(frame.split("|"), rendered)
+        assert rendered == rispondo_decode(frame), f"Label rendering mismatch on {frame}"
+    labels, rendered = FrameLabels(RECUPERO_TRANSLATOR), {}
+    report("cloud JSON labels (changed positions only)",
+           per_frame_us(rispondo_decode, polled),
+           per_frame_us(lambda frame: labels.render(frame.split("|"), rendered), polled))
+
+
+def bench_cloud_dispatcher(count=1000):
+    """Stress the cloud command dispatcher: bounded threads and FIFO emit order"""
+    emitted = []
+    max_threads = [threading.active_count()]
+
+    def emit(command):
+        emitted.append(command)
+        max_threads[0] = max(max_threads[0], threading.active_count())
+
+    threads_before = threading.active_count()
+    dispatcher = CommandDispatcher(emit, interval=0)
+    dispatcher.start()
+    commands = [f"C|WriteParametri|42|{i}" for i in range(count)]
+    start = time.perf_counter()
+    for command in commands:
+        dispatcher.put(command)
+    assert dispatcher.join(timeout=30), "Dispatcher did not drain"
+    elapsed = time.perf_counter() - start
+    dispatcher.stop()
+
+    assert emitted == commands, "Commands were not emitted in order"
+    assert max_threads[0] <= threads_before + 1, f"Thread count grew to {max_threads[0]}"
+    print("cloud command dispatcher")
+    print(f"   {count} commands in {elapsed * 1000:.1f} ms, threads: {threads_before} -> max {max_threads[0]}")
+
+
+def command_burst(size):
+    """Slider moves on every writable command, as received from MQTT"""
+    names = [command.name for command in REGISTRY.commands() if command.commandcategory == 'Basic']
+    return [MaestroCommandValue(REGISTRY.command(names[i % len(names)]), i) for i in range(size)]
+
+
+def bench_command_queue(burst_size=200):
+    burst = command_burst(burst_size)
+
+    def put_get(queue_class):
+        def run(_):
+            command_queue = queue_class()
+            for item in burst:
+                command_queue.put(item)
+            while not command_queue.empty():
+                command_queue.get()
+        return run
+
+    legacy, current = LegacySetQueue(), CoalescingQueue()
+    for item in burst:
+        legacy.put(MaestroCommandValue(item.command, item.value))
+        current.put(item)
+    assert [(i.command.name, i.value) for i in legacy.queue] == \
+        [(i.command.name, i.value) for i in current.queue.values()], "Coalesced order mismatch"
+    print(f"   coalescing queue metrics: {current.metrics()}")
+    report(f"command queue put/get (burst of {burst_size})",
+           per_frame_us(put_get(LegacySetQueue), [None], 200),
+           per_frame_us(put_get(CoalescingQueue), [None], 200), "burst")
+
+
+def stress_command_queue(producers=8, puts=5000):
+    """Hammer the coalescing queue from several threads and check no update is lost or reordered"""
+    command_queue = CoalescingQueue()
+    names = [command.name for command in REGISTRY.commands() if command.commandcategory == 'Basic']
+    done = threading.Event()
+    received = {}
+
+    def produce(index):
+        # Each producer owns its own command names and sends increasing values
+        own = names[index::producers]
+        for value in range(puts):
+            command_queue.put(MaestroCommandValue(REGISTRY.command(own[value % len(own)]), value))
+
+    def consume():
+        while not (done.is_set() and command_queue.empty()):
+            try:
+                item = command_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            received.setdefault(item.command.name, []).append(item.value)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    threads = [threading.Thread(target=produce, args=(i,)) for i in range(producers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    consumer.join()
+
+    for index in range(producers):
+        own = names[index::producers]
+        for position, name in enumerate(own):
+            last = max(v for v in range(puts) if v % len(own) == position)
+            values = received.get(name, [])
+            assert values and values[-1] == last, f"Lost the last update of {name}"
+            assert values == sorted(values), f"Updates of {name} were reordered"
+    metrics = command_queue.metrics()
+    assert metrics['put'] == producers * puts and metrics['depth'] == 0
+    print("command queue concurrency")
+    print(f"   {producers} producers x {puts} puts, delivered {sum(len(v) for v in received.values())}, "
+          f"coalesced {metrics['coalesced']}")
+
+
+def measure_send_latency(start_sender, commands=30):
+    """Milliseconds between queueing a command (MQTT receipt) and its arrival on a local websocket server"""
+    import websocket
+    received = {}
+    arrived = threading.Condition()
+
+    def on_message(connection, text):
+        with arrived:
+            received[int(float(text.split("|")[-1]))] = time.perf_counter()
+            arrived.notify_all()
+
+    server = WebsocketServer(on_message).start()
+    ws = websocket.create_connection(server.url)
+    command_queue = CoalescingQueue()
+    stop_sender = start_sender(ws, command_queue)
+    queued = {}
+    rng = random.Random(1)
+    for value in range(commands):
+        time.sleep(rng.uniform(0.02, 0.3))
+        queued[value] = time.perf_counter()
+        command_queue.put(MaestroCommandValue(REGISTRY.command('Power_Level'), value))
+        with arrived:
+            arrived.wait_for(lambda: value in received, timeout=2)
+    stop_sender(command_queue)
+    ws.close()
+    server.stop()
+    return [(received[value] - queued[value]) * 1000 for value in queued if value in received]
+
+
+def bench_send_latency():
+    def legacy_sender(ws, command_queue):
+        stop = threading.Event()
+        threading.Thread(target=legacy_send_commands, args=(ws, command_queue, stop), daemon=True).start()
+        return lambda _: stop.set()
+
+    def event_sender(ws, command_queue):
+        threading.Thread(target=send_commands, args=(ws, command_queue, 1), daemon=True).start()
+        return lambda command_queue: end_session(command_queue, 1)
+
+    print("MQTT receipt -> websocket latency (local websocket server)")
+    for title, sender in (("before", legacy_sender), ("after ", event_sender)):
+        latencies = measure_send_latency(sender)
+        print(f"   {title}: mean {statistics.mean(latencies):7.2f} ms, "
+              f"max {max(latencies):7.2f} ms ({len(latencies)} commands)")
+
+
+def bench_async_runtime(commands=30):
+    """asyncio runtime (ASYNC_RUNTIME): commands written and frames received by AsyncGateway on one event loop"""
+    import asyncio
+    from aioruntime import AsyncGateway
+    from scheduler import PollScheduler
+    received = {}
+    frames = []
+    arrived = threading.Condition()
+
+    def on_message(connection, text):
+        if text == 'C|RecuperoInfo':
+            connection.send_text(RECORDED_FRAMES[0])
+            return
+        with arrived:
+            received[int(float(text.split("|")[-1]))] = time.perf_counter()
+            arrived.notify_all()
+
+    server = WebsocketServer(on_message).start()
+    command_queue = CoalescingQueue()
+    opened = threading.Event()
+    gateway = AsyncGateway(server.url, command_queue,
+                           on_frame=frames.append,
+                           on_open=opened.set,
+                           on_close=lambda: None,
+                           on_reconnect=lambda: None,
+                           scheduler=PollScheduler(
+                               lambda: command_queue.put(MaestroCommandValue(REGISTRY.command('GetInfo'), 0)), 0.1))
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        gateway.loop = loop
+        gateway.wakeup = asyncio.Event()
+        gateway.poll_wakeup = asyncio.Event()
+        command_queue.listener = gateway._queue_listener
+        gateway.scheduler.listener = gateway._poll_listener
+        loop.run_until_complete(asyncio.gather(gateway.poll(), gateway.websocket()))
+    threading.Thread(target=run, daemon=True).start()
+    assert opened.wait(5), "asyncio runtime did not connect"
+
+    queued = {}
+    for value in range(commands):
+        time.sleep(0.02)
+        queued[value] = time.perf_counter()
+        command_queue.put(MaestroCommandValue(REGISTRY.command('Power_Level'), value))
+        with arrived:
+            arrived.wait_for(lambda: value in received, timeout=2)
+    assert set(received) == set(queued), f"asyncio runtime lost {len(queued) - len(received)} commands"
+    assert frames and frames[0] == RECORDED_FRAMES[0], "asyncio runtime did not receive the frames"
+    latencies = [(received[value] - queued[value]) * 1000 for value in queued]
+    print("MQTT receipt -> websocket latency, asyncio runtime")
+    print(f"   mean {statistics.mean(latencies):7.2f} ms, max {max(latencies):7.2f} ms "
+          f"({len(latencies)} commands, {len(frames)} frames received)")
+    server.stop()
+
+
+def measure_publish(publish_cycle, cycles, ack_delay):
+    """Run publish_cycle(client, cycle) against a local broker whose PUBACKs take ack_delay seconds.
+    Return (milliseconds until the broker got everything and acked it, PUBLISH packets received)"""
+    import paho.mqtt.client as mqtt
+    broker = MqttBroker(ack_delay=ack_delay).start()
+    client = mqtt.Client(client_id="benchmark")
+    connected = threading.Event()
+    client.on_connect = lambda *args: connected.set()
+    client.connect(broker.host, broker.port)
+    client.loop_start()
+    connected.wait(5)
+    start = time.perf_counter()
+    for cycle in range(cycles):
+        publish_cycle(client, cycle)
+    # QoS 1 messages are acked in order: the last one is acked when everything is
+    client.publish("benchmark/done", 1, 1).wait_for_publish(10)
+    elapsed = (time.perf_counter() - start) * 1000
+    client.loop_stop()
+    client.disconnect()
+    broker.stop()
+    return elapsed, len(broker.published) - 1
+
+
+def bench_mqtt_publish(cycles=20, ack_delay=0.01):
+    """Whole decoded frames published every cycle (first connect, cloud path) to a broker 10 ms away"""
+    messages = [process_infostring(frame) for frame in RECORDED_FRAMES]
+    batchers = {}
+
+    def legacy_cycle(client, cycle):
+        legacy_publish_topics(client, "Maestro/", messages[cycle % len(messages)])
+
+    def batched_cycle(client, cycle):
+        if client not in batchers:
+            batchers[client] = PublishBatcher(client, 1, max_inflight=100)
+        batchers[client].publish(messages[cycle % len(messages)], "Maestro/")
+
+    print(f"MQTT publishing, {len(messages[0])} topics per cycle, broker round trip {ack_delay * 1000:.0f} ms")
+    for title, cycle_count in (("first connect", 1), (f"{cycles} cycles", cycles)):
+        before, before_packets = measure_publish(legacy_cycle, cycle_count, ack_delay)
+        after, after_packets = measure_publish(batched_cycle, cycle_count, ack_delay)
+        print(f"   {title}: before {before:7.1f} ms, {before_packets} publishes / "
+              f"after {after:7.1f} ms, {after_packets} publishes")
+
+
+if __name__ == "__main__":
+    print("⏱️  Maestro gateway benchmarks")
+    bench_process_infostring()
+    bench_info_delta()
+    bench_rispondo()
+    bench_cloud_dispatcher()
+    bench_command_queue()
+    stress_command_queue()
+    bench_send_latency()
+    bench_async_runtime()
+    bench_mqtt_publish()
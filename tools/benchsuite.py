@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite of the gateway hot paths, with stored baselines and a regression threshold.
+Times the current implementation on recorded frames and synthetic command bursts, and the
+end-to-end latencies of the local script against a local broker and websocket stand-in.
+
+    tools/benchsuite.py                  run and compare with benchsuite_baseline.json
+    tools/benchsuite.py --save           run and store the results as the new baseline
+    tools/benchsuite.py -k discovery     only the benchmarks whose name contains "discovery"
+    tools/benchsuite.py --threshold 0.2  fail above 20 % slower than the baseline
+
+Each benchmark keeps the median of --rounds runs of the whole suite. Exits with 1 when a
+benchmark is slower than its baseline by more than its tolerance.
+Baselines depend on the machine, store them on the machine that runs the comparison.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import timeit
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../maestro_gateway/rootfs/maestro'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../maestro_gateway/rootfs/maestro/local'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../maestro_gateway/rootfs/maestro/cloud'))
+
+import paho.mqtt.client as mqtt
+
+from benchmark import ITERATIONS, per_frame_us, command_burst
+from frames import RECORDED_FRAMES
+from mqttbroker import MqttBroker
+from wsserver import WebsocketServer
+from commandqueue import CoalescingQueue
+from mqttpool import MqttConnectionPool
+from session import StoveSession
+from maestro_protocol.commands import maestrocommandvalue_to_websocket_string
+from maestro_protocol.messages import process_infostring, MaestroInfoDelta
+from maestro_protocol.registry import REGISTRY
+from decoding import build_translator, FrameLabels
+from translations.data_fr import RecuperoInfo
+from discovery import DiscoveryManager, ENTITY_DESCRIPTORS
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'benchsuite_baseline.json')
+
+# Allowed slowdown before a benchmark counts as a regression. Shared and single core hosts vary
+# by about a third between runs, the replaced implementations were 5 to 30 times slower
+DEFAULT_TOLERANCE = 0.5
+# Loopback latencies depend on the scheduler much more than the micro benchmarks
+LATENCY_TOLERANCE = 1.0
+
+LATENCY_SAMPLES = 50
+# Best of REPEAT runs for the micro benchmarks, median of ROUNDS runs of the suite
+REPEAT = 7
+ROUNDS = 3
+
+CONFIG = {
+    '_MCZip': '127.0.0.1',
+    '_MCZport': 81,
+    '_MQTT_TOPIC_PUB': 'Maestro/',
+    '_MQTT_TOPIC_SUB': 'Maestro/Command/',
+    '_MQTT_PAYLOAD_TYPE': 'TOPIC',
+    '_MQTT_MAX_INFLIGHT': 100,
+    '_WS_RECONNECTS_BEFORE_ALERT': 5,
+    '_REFRESH_INTERVAL': 15.0,
+    '_POLL_INTERVAL_FAST': 5.0,
+    '_POLL_INTERVAL_SLOW': 60.0,
+    '_POLL_BURST_INTERVAL': 3.0,
+    '_POLL_BURST_DURATION': 60.0,
+    '_POLL_FUME_RATE_THRESHOLD': 5.0,
+    '_MQTT_DISCOVERY_ENABLED': True,
+    '_MQTT_DISCOVERY_PREFIX': 'homeassistant',
+    '_DEVICE_NAME': 'Benchmark',
+    '_DEVICE_ID': 'benchmark',
+    '_VERSION': 'benchmark'
+}
+
+# (name, unit, function, tolerance), in run order
+SUITE = []
+
+
+def benchmark(name, unit, tolerance=DEFAULT_TOLERANCE):
+    """Register a function returning a time (lower is better) in unit"""
+    def register(function):
+        SUITE.append((name, unit, function, tolerance))
+        return function
+    return register
+
+
+class NullClient(object):
+    """MQTT client dropping everything, to time the gateway code alone"""
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        return None
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+
+def polled_frames():
+    """A stove polled every 15 s mostly sends the same frame again"""
+    return [frame for frame in RECORDED_FRAMES for _ in range(4)]
+
+
+def per_item_us(function, items, iterations=200):
+    """Return the time in microseconds of function(items) divided by the number of items, best of REPEAT"""
+    total = min(timeit.repeat(lambda: function(items), number=iterations, repeat=REPEAT))
+    return total / (iterations * len(items)) * 1e6
+
+
+def per_frame_best_us(function, frames, iterations=ITERATIONS):
+    """per_frame_us, best of REPEAT // 3 runs of three"""
+    return min(per_frame_us(function, frames, iterations) for _ in range(REPEAT // 3))
+
+
+@benchmark('process_infostring', 'us/frame')
+def bench_process_infostring():
+    return per_frame_best_us(process_infostring, RECORDED_FRAMES)
+
+
+@benchmark('process_info_message', 'us/frame')
+def bench_process_info_message():
+    session = StoveSession(NullClient(), CONFIG)
+    return per_frame_best_us(session.process_info_message, polled_frames(), ITERATIONS // 4)
+
+
+@benchmark('cloud rispondo', 'us/frame')
+def bench_rispondo():
+    # Canonical state update and JSON labels of the changed positions, as in cloud/maestro.py
+    state, labels, rendered = {}, FrameLabels(build_translator(RecuperoInfo)), {}
+    delta = MaestroInfoDelta()
+
+    def rispondo(frame):
+        state.update(delta.process(frame))
+        labels.render(frame.split("|"), rendered)
+    return per_frame_best_us(rispondo, polled_frames(), ITERATIONS // 4)
+
+
+@benchmark('maestrocommandvalue_to_websocket_string', 'us/command')
+def bench_command_encoding():
+    def encode(burst):
+        for item in burst:
+            maestrocommandvalue_to_websocket_string(item)
+    return per_item_us(encode, command_burst(200))
+
+
+@benchmark('command queue put/get', 'us/command')
+def bench_command_queue():
+    def put_get(burst):
+        command_queue = CoalescingQueue()
+        for item in burst:
+            command_queue.put(item)
+        while not command_queue.empty():
+            command_queue.get()
+    return per_item_us(put_get, command_burst(200))
+
+
+@benchmark('build_entity_config', 'us/entity')
+def bench_build_entity_config():
+    manager = DiscoveryManager(NullClient(), CONFIG)
+
+    def build(entities):
+        for entity in entities:
+            manager.build_entity_config(entity)
+    return per_item_us(build, ENTITY_DESCRIPTORS)
+
+
+@benchmark('publish_discovery_configs (first)', 'ms/device')
+def bench_publish_discovery_first():
+    # New manager every time: payloads built, serialized and published
+    def publish():
+        DiscoveryManager(NullClient(), CONFIG).publish_discovery_configs()
+    return min(timeit.repeat(publish, number=20, repeat=REPEAT)) / 20 * 1000
+
+
+@benchmark('publish_discovery_configs (resync)', 'ms/device')
+def bench_publish_discovery_resync():
+    # MQTT reconnection: every retained config is identical, nothing is published
+    manager = DiscoveryManager(NullClient(), CONFIG)
+    retained = {}
+    for entity in ENTITY_DESCRIPTORS:
+        topic, _, fingerprint = manager.discovery_payload(entity)
+        retained[topic] = fingerprint
+    return min(timeit.repeat(lambda: manager.publish_discovery_configs(retained), number=200, repeat=REPEAT)) / 200 * 1000
+
+
+class LocalGateway(object):
+    """A stove session connected to a local broker and a websocket stand-in answering with
+    recorded frames whose Temperature_Setpoint changes on every request"""
+    SETPOINT = REGISTRY.info('Temperature_Setpoint').frameid
+
+    def __init__(self):
+        self.received = {}
+        self.sent = []
+        self.arrived = threading.Condition()
+        self.broker = MqttBroker().start()
+        self.server = WebsocketServer(self.on_websocket_message).start()
+        config = dict(CONFIG, _MCZport=self.server.port, _MQTT_DISCOVERY_ENABLED=False)
+        self.pool = MqttConnectionPool(self.broker.host, self.broker.port, client_id_prefix='MCZ_Benchmark')
+        self.session = self.pool.add_session(lambda client: StoveSession(client, config))
+        self.pool.connect()
+        self.session.start_websocket()
+        self.tester = mqtt.Client('benchmark-tester')
+        self.tester.connect(self.broker.host, self.broker.port)
+        self.tester.loop_start()
+        deadline = time.monotonic() + 10
+        while not (all(self.pool.connected) and self.session.websocket_connected and self.tester.is_connected()):
+            assert time.monotonic() < deadline, "Local gateway did not connect"
+            time.sleep(0.01)
+
+    def on_websocket_message(self, connection, text):
+        now = time.perf_counter()
+        if text == 'C|RecuperoInfo':
+            tokens = RECORDED_FRAMES[0].split("|")
+            tokens[self.SETPOINT] = format(30 + len(self.sent) % 20, 'x')
+            self.sent.append(time.perf_counter())
+            connection.send_text("|".join(tokens))
+        else:
+            with self.arrived:
+                self.received[int(float(text.split("|")[-1]))] = now
+                self.arrived.notify_all()
+
+    def published_setpoints(self):
+        topic = self.session.topic_pub + 'Temperature_Setpoint'
+        return [received for received, _, published, _ in list(self.broker.published) if published == topic]
+
+    def stop(self):
+        self.tester.loop_stop()
+        self.broker.stop()
+        self.server.stop()
+
+
+@benchmark('MQTT -> websocket', 'ms', LATENCY_TOLERANCE)
+def bench_mqtt_to_websocket():
+    """Median time from the MQTT command publish to its arrival on the stove websocket"""
+    gateway = LocalGateway()
+    latencies = []
+    for value in range(1, LATENCY_SAMPLES + 1):
+        start = time.perf_counter()
+        gateway.tester.publish(gateway.session.topic_sub + 'Power_Level', str(value), 1)
+        with gateway.arrived:
+            assert gateway.arrived.wait_for(lambda: value in gateway.received, timeout=5), "Command lost"
+        latencies.append((gateway.received[value] - start) * 1000)
+        time.sleep(0.01)
+    gateway.stop()
+    return statistics.median(latencies)
+
+
+@benchmark('websocket -> MQTT', 'ms', LATENCY_TOLERANCE)
+def bench_websocket_to_mqtt():
+    """Median time from the stove frame sent on the websocket to the changed topic received by the broker"""
+    gateway = LocalGateway()
+    latencies = []
+    for sample in range(LATENCY_SAMPLES):
+        gateway.session.enqueue_stove_info()
+        deadline = time.monotonic() + 5
+        while len(gateway.published_setpoints()) <= sample:
+            assert time.monotonic() < deadline, "Frame lost"
+            time.sleep(0.001)
+        latencies.append((gateway.published_setpoints()[sample] - gateway.sent[sample]) * 1000)
+    gateway.stop()
+    return statistics.median(latencies)
+
+
+def machine():
+    return f"{platform.machine()} {platform.processor() or platform.system()}, {os.cpu_count()} CPU, " \
+           f"Python {platform.python_version()}"
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as baseline:
+        return json.load(baseline)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--threshold', type=float, help='allowed slowdown for every benchmark, e.g. 0.2')
+    parser.add_argument('--rounds', type=int, default=ROUNDS, help='runs of the suite, the median is kept')
+    parser.add_argument('-k', dest='pattern', default='', help='only the benchmarks whose name contains this')
+    args = parser.parse_args()
+
+    baseline = None if args.save else load_baseline(args.baseline)
+    print(f"⏱️  Maestro gateway benchmark suite on {machine()}")
+    if baseline is not None and baseline.get('machine') != machine():
+        print(f"⚠️  Baseline recorded on {baseline.get('machine')}, comparisons are indicative")
+
+    selected = [entry for entry in SUITE if args.pattern in entry[0]]
+    # Whole rounds interleave the benchmarks so that a slow period of the host does not hit only one of them
+    values = {name: [] for name, _, _, _ in selected}
+    for round_index in range(args.rounds):
+        print(f"   round {round_index + 1}/{args.rounds}", end='\r', flush=True)
+        for name, _, function, _ in selected:
+            values[name].append(function())
+
+    results = {}
+    regressions = []
+    for name, unit, _, tolerance in selected:
+        value = statistics.median(values[name])
+        results[name] = {'value': round(value, 4), 'unit': unit}
+        line = f"   {name:42} {value:10.3f} {unit:10}"
+        reference = baseline['results'].get(name) if baseline is not None else None
+        if reference is not None:
+            ratio = value / reference['value'] if reference['value'] else 1.0
+            allowed = args.threshold if args.threshold is not None else tolerance
+            status = "✅"
+            if ratio > 1 + allowed:
+                status = "❌ regression"
+                regressions.append(name)
+            line += f" baseline {reference['value']:10.3f}  x{ratio:5.2f}  {status}"
+        print(line)
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as stored:
+            json.dump({'machine': machine(), 'results': results}, stored, indent=2)
+            stored.write('\n')
+        print(f"\n💾 Baseline saved to {args.baseline}")
+    elif baseline is None:
+        print("\nNo baseline, run with --save to store one")
+    elif regressions:
+        print(f"\n❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+    else:
+        print("\n✅ No regression")
+
+
+if __name__ == "__main__":
+    main()
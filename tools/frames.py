@@ -0,0 +1,23 @@
+# coding: utf-8
+"""
+RecuperoInfo frames recorded on a running stove, used by the benchmark scripts.
+Each frame is the raw "01|..." string received on the websocket.
+"""
+
+RECORDED_FRAMES = [
+    # Off, room at 19.5 °C
+    "01|0|0|0|0|14|27|ff|ff|ff|0|0|0|0|0|0|0|0|0|1|0|0|1|0|0|0|28|3c|52|b|53|5|10|1e|12|1|7e5|"
+    "3c9a1f|4b2c0|8f1e0|b5a10|6e2d0|1c4a0|70|0|1f4|0|0|1|1|0|0|0|0|0|0|ff|ff|ff|ff|0",
+    # Ignition, loading pellets
+    "01|7|3|0|0|2d|27|ff|ff|ff|0|0|6a4|3e8|3de|0|0|0|0|1|0|0|1|0|0|0|28|3c|54|b|53|5|10|1f|12|1|7e5|"
+    "3c9a2e|4b2c0|8f1e0|b5a10|6e2d0|1c4a0|70|0|1f5|0|0|1|1|0|0|0|0|0|0|ff|ff|ff|ff|0",
+    # Power 3, fans running
+    "01|d|3|2|0|a5|28|ff|ff|ff|0|14|8fc|5dc|5d6|0|0|0|0|1|0|f|1|0|0|0|2a|3c|5a|d|53|5|10|2a|12|1|7e5|"
+    "3c9b80|4b2c0|8f1e0|b5bb5|6e2d0|1c4a0|70|0|1f5|0|0|1|1|0|0|0|0|0|0|ff|ff|ff|ff|0",
+    # Power 3, one minute later: only temperatures and counters moved
+    "01|d|3|2|0|a7|29|ff|ff|ff|0|14|8fc|5dc|5d9|0|0|0|0|1|0|f|1|0|0|0|2a|3c|5b|d|53|5|10|2b|12|1|7e5|"
+    "3c9bbc|4b2c0|8f1e0|b5bf1|6e2d0|1c4a0|70|0|1f5|0|0|1|1|0|0|0|0|0|0|ff|ff|ff|ff|0",
+    # Cooling down after extinguish
+    "01|29|0|0|0|78|2b|ff|ff|ff|0|0|5dc|0|0|0|0|0|0|1|0|0|1|0|0|0|2a|3c|58|d|53|5|11|5|12|1|7e5|"
+    "3c9e10|4b2c0|8f1e0|b5f00|6e2d0|1c4a0|6f|0|1f5|0|0|1|1|0|0|0|0|0|0|ff|ff|ff|ff|0",
+]
@@ -0,0 +1,245 @@
+# coding: utf-8
+"""
+Minimal MQTT 3.1.1 broker used as a local mosquitto stand-in in benchmarks.
+Supports CONNECT, PUBLISH (QoS 0/1, retained), SUBSCRIBE/UNSUBSCRIBE with + and #
+wildcards, PINGREQ and DISCONNECT. Messages are delivered to subscribers at QoS 0.
+Standard library only.
+"""
+
+import socket
+import struct
+import threading
+import time
+
+
+def topic_matches(subscription, topic):
+    sub_levels = subscription.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(sub_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[index]:
+            return False
+    return len(sub_levels) == len(topic_levels)
+
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _encode_string(value):
+    data = value.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+class BrokerClient:
+    """One connected MQTT client"""
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.client_id = None
+        self.subscriptions = {}
+        self.received = 0
+        self.closed = False
+
+    def send(self, packet_type, body=b""):
+        with self.lock:
+            if not self.closed:
+                try:
+                    self.sock.sendall(bytes([packet_type]) + _encode_length(len(body)) + body)
+                except OSError:
+                    self.closed = True
+
+    def deliver(self, topic, payload, retain=False):
+        self.send(0x30 | (0x01 if retain else 0), _encode_string(topic) + payload)
+
+    def _recv_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("closed")
+            data += chunk
+        return data
+
+    def read_packet(self):
+        header = self._recv_exact(1)[0]
+        multiplier, length = 1, 0
+        while True:
+            byte = self._recv_exact(1)[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header, self._recv_exact(length) if length else b""
+
+    def serve(self):
+        try:
+            while not self.closed:
+                header, body = self.read_packet()
+                packet_type = header >> 4
+                if packet_type == 1:
+                    self._connect(body)
+                elif packet_type == 3:
+                    self._publish(header, body)
+                elif packet_type == 8:
+                    self._subscribe(body)
+                elif packet_type == 10:
+                    self._unsubscribe(body)
+                elif packet_type == 12:
+                    self.send(0xD0)
+                elif packet_type == 14:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.closed = True
+        self.broker.remove(self)
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    def _connect(self, body):
+        offset = 2 + struct.unpack("!H", body[:2])[0]  # protocol name
+        offset += 4  # level, flags, keepalive
+        length = struct.unpack("!H", body[offset:offset + 2])[0]
+        self.client_id = body[offset + 2:offset + 2 + length].decode()
+        self.broker.register(self)
+        self.send(0x20, b"\x00\x00")
+
+    def _publish(self, header, body):
+        qos = (header >> 1) & 0x03
+        retain = bool(header & 0x01)
+        length = struct.unpack("!H", body[:2])[0]
+        topic = body[2:2 + length].decode()
+        offset = 2 + length
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            if self.broker.ack_delay:
+                # Simulated network round trip: the PUBACK comes back later, reading goes on
+                threading.Timer(self.broker.ack_delay, self.send, (0x40, packet_id)).start()
+            else:
+                self.send(0x40, packet_id)
+        self.received += 1
+        self.broker.route(self, topic, body[offset:], retain)
+
+    def _subscribe(self, body):
+        packet_id = body[:2]
+        offset, granted, added = 2, b"", []
+        while offset < len(body):
+            length = struct.unpack("!H", body[offset:offset + 2])[0]
+            subscription = body[offset + 2:offset + 2 + length].decode()
+            offset += 3 + length
+            self.subscriptions[subscription] = True
+            added.append(subscription)
+            granted += b"\x00"
+        self.send(0x90, packet_id + granted)
+        for subscription in added:
+            self.broker.send_retained(self, subscription)
+
+    def _unsubscribe(self, body):
+        packet_id = body[:2]
+        offset = 2
+        while offset < len(body):
+            length = struct.unpack("!H", body[offset:offset + 2])[0]
+            self.subscriptions.pop(body[offset + 2:offset + 2 + length].decode(), None)
+            offset += 2 + length
+        self.send(0xB0, packet_id)
+
+
+class MqttBroker:
+    """Accepts MQTT clients, routes publishes to subscribers and keeps retained messages.
+    ack_delay (seconds) delays the PUBACKs to simulate a broker across the network"""
+    def __init__(self, host="127.0.0.1", port=0, ack_delay=0.0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(512)
+        self.host, self.port = self.sock.getsockname()
+        self.ack_delay = ack_delay
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.retained = {}
+        self.published = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        for client in list(self.clients.values()):
+            client.close()
+
+    def _accept(self):
+        while self.running:
+            try:
+                sock, _ = self.sock.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=BrokerClient(self, sock).serve, daemon=True).start()
+
+    def register(self, client):
+        with self.lock:
+            previous = self.clients.get(client.client_id)
+            self.clients[client.client_id] = client
+        # Same client id: the broker drops the older connection, like mosquitto does
+        if previous is not None and previous is not client:
+            previous.close()
+
+    def remove(self, client):
+        with self.lock:
+            if self.clients.get(client.client_id) is client:
+                del self.clients[client.client_id]
+
+    def route(self, sender, topic, payload, retain):
+        with self.lock:
+            self.published.append((time.perf_counter(), sender.client_id, topic, payload))
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            clients = list(self.clients.values())
+        for client in clients:
+            if any(topic_matches(subscription, topic) for subscription in list(client.subscriptions)):
+                client.deliver(topic, payload)
+
+    def send_retained(self, client, subscription):
+        with self.lock:
+            retained = [(topic, payload) for topic, payload in self.retained.items()
+                        if topic_matches(subscription, topic)]
+        for topic, payload in retained:
+            client.deliver(topic, payload, retain=True)
+
+    def wait_for(self, count, timeout=10):
+        """Wait until count publishes have been received, returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while len(self.published) < count:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
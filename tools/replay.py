@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Replays a frame recorder log (RECORD_FRAMES) through the local gateway pipeline:
+frame decoding, change detection and MQTT publishing of a StoveSession per recorded stove,
+against a MQTT broker (the local stand-in by default). Recorded commands are fed to the
+session as MQTT messages.
+
+    tools/replay.py frames.log                  real time
+    tools/replay.py frames.log --speed 60       one recorded minute per second
+    tools/replay.py frames.log --speed 0        as fast as possible
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../maestro_gateway/rootfs/maestro'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../maestro_gateway/rootfs/maestro/local'))
+
+import paho.mqtt.client as mqtt
+
+from maestro_protocol.recorder import FRAME, COMMAND, read_records, replay, log_files
+from mqttbroker import MqttBroker
+from mqttpool import MqttConnectionPool
+from session import StoveSession
+
+CONFIG = {
+    '_MCZip': '127.0.0.1',
+    '_MCZport': 81,
+    '_MQTT_PAYLOAD_TYPE': 'TOPIC',
+    '_MQTT_MAX_INFLIGHT': 1000,
+    '_WS_RECONNECTS_BEFORE_ALERT': 5,
+    '_REFRESH_INTERVAL': 15.0,
+    '_POLL_INTERVAL_FAST': 5.0,
+    '_POLL_INTERVAL_SLOW': 60.0,
+    '_POLL_BURST_INTERVAL': 3.0,
+    '_POLL_BURST_DURATION': 60.0,
+    '_POLL_FUME_RATE_THRESHOLD': 5.0,
+    '_MQTT_DISCOVERY_ENABLED': False,
+    '_MQTT_DISCOVERY_PREFIX': 'homeassistant',
+    '_VERSION': 'replay'
+}
+
+
+class ReplayGateway:
+    """Stove sessions created on the fly for the stoves found in the log"""
+    def __init__(self, pool, prefix):
+        self.pool = pool
+        self.prefix = prefix
+        self.sessions = {}
+        self.frames = 0
+        self.commands = 0
+        self.frame_time = 0.0
+
+    def session(self, stove):
+        session = self.sessions.get(stove)
+        if session is None:
+            config = dict(CONFIG, _DEVICE_ID=stove, _DEVICE_NAME=stove,
+                          _MQTT_TOPIC_PUB=f'{self.prefix}/{stove}/', _MQTT_TOPIC_SUB=f'{self.prefix}/{stove}/Command/')
+            session = self.pool.add_session(lambda client: StoveSession(client, config))
+            self.sessions[stove] = session
+        return session
+
+    def handle(self, kind, stove, data):
+        session = self.session(stove)
+        if kind == FRAME:
+            start = time.perf_counter()
+            session.on_message(None, data)
+            self.frame_time += time.perf_counter() - start
+            self.frames += 1
+        elif kind == COMMAND:
+            name, _, value = data.partition('|')
+            message = mqtt.MQTTMessage(topic=(session.topic_sub + name).encode())
+            message.payload = value.encode()
+            session.on_mqtt_message(None, None, message)
+            self.commands += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help='recorder log, its rotated files (log.1, log.2...) are replayed first')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 real time, N times faster, 0 as fast as possible')
+    parser.add_argument('--broker', help='host:port of the MQTT broker, a local stand-in by default')
+    parser.add_argument('--prefix', default='Replay', help='topic prefix of the replayed stoves')
+    args = parser.parse_args()
+
+    if args.broker:
+        host, port = args.broker.rsplit(':', 1)
+        broker = None
+    else:
+        broker = MqttBroker().start()
+        host, port = broker.host, broker.port
+    pool = MqttConnectionPool(host, int(port), client_id_prefix='MCZ_Replay')
+    gateway = ReplayGateway(pool, args.prefix)
+    pool.connect()
+    while not all(pool.connected):
+        time.sleep(0.01)
+
+    files = log_files(args.log)
+    print(f"▶️  Replaying {', '.join(files)} at {'max' if args.speed <= 0 else str(args.speed) + 'x'} speed")
+    start = time.perf_counter()
+    count = replay(read_records(files), gateway.handle, speed=args.speed)
+    elapsed = time.perf_counter() - start
+    if broker is not None:
+        published = sum(session.client.metrics()['published'] for session in gateway.sessions.values())
+        broker.wait_for(published, timeout=10)
+
+    print(f"{count} records ({gateway.frames} frames, {gateway.commands} commands) in {elapsed:.2f} s")
+    if gateway.frames:
+        print(f"   decode + delta + publish: {gateway.frame_time / gateway.frames * 1e6:.1f} us/frame")
+    for stove, session in gateway.sessions.items():
+        metrics = session.metrics()
+        print(f"   {stove}: {metrics['mqtt']['published']} MQTT messages, "
+              f"{metrics['publisher']['suppressed']} unchanged topics skipped, "
+              f"{metrics['queue']['put']} commands queued")
+
+
+if __name__ == "__main__":
+    main()
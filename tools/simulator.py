@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+MCZ Maestro stove simulator: fake embedded websocket servers (port 81 on a real stove)
+for load and latency testing of the gateway. Standard library only.
+
+Each simulated stove answers C|RecuperoInfo with a 01| frame, applies C|WriteParametri,
+C|Diagnostica and C|SalvaDataOra to the following frames, and evolves through the
+MAESTRO_STOVESTATE codes (ignition, power levels, standby, extinguish, alarms) on a clock
+that can run faster than real time. Latency, dropped answers and disconnections can be injected.
+
+    tools/simulator.py --stoves 200 --speed 3600      a 24 hour cycle in 24 seconds
+"""
+
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../maestro_gateway/rootfs/maestro'))
+
+from maestro_protocol.messages import MaestroMessageType
+from maestro_protocol.registry import REGISTRY
+from frames import RECORDED_FRAMES
+from wsserver import WebsocketServer
+
+# Ignition sequences: (Stove_State, simulated seconds)
+IGNITION_COLD = ((1, 30), (2, 60), (3, 120), (4, 180), (5, 180), (10, 300))
+IGNITION_HOT = ((1, 30), (6, 60), (7, 120), (8, 180), (9, 180), (10, 300))
+# Extinguish, then cooling until the fumes are below COOLED_FUME_TEMPERATURE, then cleaning
+EXTINGUISH = ((40, 60), (41, 1800), (42, 60))
+COOLED_FUME_TEMPERATURE = 60
+# Feeding screw (Power 49): loading auger for a while
+LOADING_AUGER = ((49, 120),)
+STANDBY = 46
+DIAGNOSTICS = 30
+IGNITION_FAILED = 50
+FIRST_ALARM, LAST_ALARM = 50, 69
+
+# Chronostat program used when Chronostat is on: heating periods in seconds of the day,
+# shifted by up to PROGRAM_SPREAD seconds per stove so that they do not all switch together
+DEFAULT_PROGRAM = ((6 * 3600, 9 * 3600), (17 * 3600, 23 * 3600))
+PROGRAM_SPREAD = 1800
+
+# C|WriteParametri id -> frame field written as is
+WRITABLE_FIELDS = {
+    42: 'Temperature_Setpoint',
+    51: 'Boiler_Setpoint',
+    45: 'Silent_Mode',
+    35: 'Active_Mode',
+    41: 'Eco_Mode',
+    50: 'Sound_Effects',
+    37: 'Fan_State',
+    38: 'DuctedFan1',
+    39: 'DuctedFan2',
+    40: 'Control_Mode',
+    1111: 'Chronostat',
+    149: 'Profile',
+    49: 'Celcius_Or_Fahrenheit',
+    57: 'Sleep',
+    148: 'Pellet_Sensor',
+    154: 'AntiFreeze',
+}
+
+# C|Diagnostica id -> frame field
+DIAGNOSTIC_FIELDS = {
+    1: 'RPM_Fam_Fume',
+    2: 'RPM_WormWheel_Set',
+    8: 'Pump_PWM',
+}
+
+# Simulation step in simulated seconds, and the most steps per real second on an accelerated clock
+STEP = 10.0
+STEPS_PER_SECOND = 20
+
+# Thermal model, per simulated second
+HEAT_GAIN = 0.0008          # degrees per power level
+HEAT_LOSS = 0.00005         # per degree above the outside temperature
+FUME_TIME_CONSTANT = 300.0  # seconds
+
+
+# Position of each information in the frame fields (frameid - 1)
+FIELD_INDEX = {information.name: information.frameid - 1 for information in REGISTRY.informations()}
+
+
+class SimulatedClock:
+    """Wall clock running speed times faster than real time from now"""
+    def __init__(self, speed=1.0, start=None):
+        self.speed = speed
+        self.origin = time.time() if start is None else start
+        self.started = time.monotonic()
+
+    def now(self):
+        return self.origin + (time.monotonic() - self.started) * self.speed
+
+
+class SimulatedStove:
+    """State of one stove, advanced in steps of simulated seconds when it receives a request"""
+    def __init__(self, clock, seed=None, alarm_rate=0.0, outside_temperature=8.0, program=DEFAULT_PROGRAM, step=None):
+        """
+        Args:
+            alarm_rate: probability that an ignition fails (A01)
+            program: chronostat heating periods (start, end) in seconds of the day
+            step: simulated seconds per step, STEP at normal speed and longer on an accelerated clock
+              so that a stove costs at most STEPS_PER_SECOND steps per real second
+        """
+        self.clock = clock
+        self.step = step or max(STEP, clock.speed / STEPS_PER_SECOND)
+        self.random = random.Random(seed)
+        self.alarm_rate = alarm_rate
+        self.outside_temperature = outside_temperature
+        self.program = program
+        self.program_shift = self.random.uniform(-PROGRAM_SPREAD, PROGRAM_SPREAD)
+        # Start from a stove recorded while off
+        self.fields = [int(token, 16) for token in RECORDED_FRAMES[0].split("|")[1:]]
+        self.ambient = self.get('Ambient_Temperature') / 2
+        self.fume = float(self.get('Fume_Temperature'))
+        self.sequence = []
+        self.remaining = 0.0
+        self.date_offset = 0.0
+        self.service_seconds = 0.0
+        self.in_program = None
+        self.ignition_fails = False
+        self.lock = threading.Lock()
+        self.last_update = clock.now()
+        self._update_date()
+
+    def get(self, name):
+        return self.fields[FIELD_INDEX[name]]
+
+    def set(self, name, value):
+        self.fields[FIELD_INDEX[name]] = int(value)
+
+    @property
+    def state(self):
+        return self.get('Stove_State')
+
+    def running(self):
+        return 11 <= self.state <= 15
+
+    def power(self):
+        return min(5, max(1, self.get('Power_Level') - 10))
+
+    def frame(self):
+        """The 01| RecuperoInfo frame of the current state"""
+        return MaestroMessageType.Info.value + "|" + "|".join(format(value, 'x') for value in self.fields)
+
+    def handle(self, text):
+        """Answer a websocket request, None when the stove sends nothing back"""
+        parts = text.split("|")
+        with self.lock:
+            self.advance(self.clock.now())
+            if len(parts) < 2:
+                return None
+            if parts[1] == "RecuperoInfo":
+                return self.frame()
+            if parts[1] == "WriteParametri" and len(parts) == 4:
+                self.write(int(parts[2]), int(float(parts[3])))
+            elif parts[1] == "Diagnostica" and len(parts) == 4:
+                self.diagnostic(int(parts[2]), int(float(parts[3])))
+            elif parts[1] == "SalvaDataOra" and len(parts) == 3:
+                date = time.mktime(time.strptime(parts[2], "%d%m%Y%H%M"))
+                self.date_offset = date - self.clock.now()
+                self._update_date()
+                return MaestroMessageType.StringData.value + "|" + parts[2]
+        return None
+
+    def write(self, parameter, value):
+        if parameter == 34:
+            if value == 1:
+                self.ignite()
+            elif value == 40:
+                self.extinguish()
+            elif value == 49 and self.state == 0:
+                self.start(LOADING_AUGER)
+        elif parameter == 36:
+            # Power levels 1 to 5 are reported as 11 to 15, like the power states
+            self.set('Power_Level', 10 + min(5, max(1, value)))
+        elif parameter == 1 and value == 255:
+            # Reset_Alarm
+            if FIRST_ALARM <= self.state <= LAST_ALARM:
+                self.start(())
+        elif parameter in WRITABLE_FIELDS:
+            self.set(WRITABLE_FIELDS[parameter], value)
+
+    def diagnostic(self, parameter, value):
+        if parameter == 100:
+            if value == 1 and self.state == 0:
+                self.set('Stove_State', DIAGNOSTICS)
+            elif value == 0 and self.state == DIAGNOSTICS:
+                self.set('Stove_State', 0)
+        elif parameter in DIAGNOSTIC_FIELDS and self.state == DIAGNOSTICS:
+            self.set(DIAGNOSTIC_FIELDS[parameter], value)
+
+    def start(self, sequence):
+        """Run a sequence of (state, seconds), the stove is off or running at its end"""
+        self.sequence = list(sequence)
+        self._next_state()
+
+    def ignite(self):
+        if self.state in (0, STANDBY):
+            self.set('Number_Of_Ignitions', self.get('Number_Of_Ignitions') + 1)
+            self.ignition_fails = self.random.random() < self.alarm_rate
+            self.start(IGNITION_HOT if self.fume > COOLED_FUME_TEMPERATURE else IGNITION_COLD)
+
+    def extinguish(self):
+        if self.running() or 1 <= self.state <= 10 or self.state == STANDBY:
+            self.start(EXTINGUISH)
+
+    def _next_state(self):
+        if self.sequence:
+            state, self.remaining = self.sequence.pop(0)
+            self.set('Stove_State', state)
+        elif self.state == 10:
+            self.set('Stove_State', IGNITION_FAILED if self.ignition_fails else 10 + self.power())
+        elif not self.running() and self.state != STANDBY:
+            self.set('Stove_State', 0)
+
+    def advance(self, now):
+        """Move the simulation forward to now"""
+        while self.last_update + self.step <= now:
+            self.last_update += self.step
+            self._step(self.step)
+        self._update_date()
+
+    def _step(self, dt):
+        state = self.state
+        setpoint = self.get('Temperature_Setpoint') / 2
+        if self.sequence or self.remaining > 0:
+            self.remaining -= dt
+            if state == 41 and self.fume < COOLED_FUME_TEMPERATURE:
+                self.remaining = 0
+            if self.remaining <= 0:
+                self.remaining = 0
+                self._next_state()
+        elif self.running():
+            if self.ambient >= setpoint + 0.5 and self.get('Eco_Mode'):
+                self.set('Stove_State', STANDBY)
+            else:
+                # Modulate down to power 1 once the room is warm, back up half a degree below
+                if self.ambient >= setpoint:
+                    self.set('Stove_State', 11)
+                elif self.ambient < setpoint - 0.5:
+                    self.set('Stove_State', 10 + self.power())
+        elif state == STANDBY and self.ambient < setpoint - 0.5:
+            self.ignite()
+        self._program()
+        self._physics(dt)
+
+    def _program(self):
+        """Chronostat: switch on and off at the edges of the heating periods"""
+        seconds = (self.last_update + self.date_offset + self.program_shift) % 86400
+        in_program = any(start <= seconds < end for start, end in self.program)
+        if self.get('Chronostat') and in_program != self.in_program and self.in_program is not None:
+            if in_program:
+                self.ignite()
+            else:
+                self.extinguish()
+        self.in_program = in_program
+
+    def _physics(self, dt):
+        state = self.state
+        if self.running():
+            power = state - 10
+            fume_target = 80 + 25 * power
+            self.set('RPM_Fam_Fume', 1200 + 200 * power)
+            self.set('RPM_WormWheel_Set', 600 + 150 * power)
+            self.set('RPM_WormWheel_Live', 600 + 150 * power + self.random.randint(-10, 10))
+            self.set('Total_Operating_Hours', self.get('Total_Operating_Hours') + dt)
+            hours = 'Hours_Of_Operation_In_Power' + str(power)
+            self.set(hours, self.get(hours) + dt)
+            self.service_seconds += dt
+            if self.service_seconds >= 3600:
+                self.service_seconds -= 3600
+                self.set('Hours_To_Service', max(0, self.get('Hours_To_Service') - 1))
+        elif 1 <= state <= 10:
+            power = 1 if state >= 4 else 0
+            fume_target = 40 + 10 * min(state, 10)
+            self.set('RPM_Fam_Fume', 1500)
+            self.set('RPM_WormWheel_Set', 400 if state in (3, 7) else 0)
+            self.set('RPM_WormWheel_Live', self.get('RPM_WormWheel_Set'))
+        else:
+            power = 0
+            fume_target = self.ambient
+            if state not in (DIAGNOSTICS,):
+                self.set('RPM_Fam_Fume', 1000 if state in (40, 41, 42) else 0)
+                self.set('RPM_WormWheel_Set', 0)
+                self.set('RPM_WormWheel_Live', 0)
+        self.ambient += dt * (HEAT_GAIN * power - HEAT_LOSS * (self.ambient - self.outside_temperature))
+        self.fume += (fume_target - self.fume) * min(1.0, dt / FUME_TIME_CONSTANT)
+        self.set('Ambient_Temperature', round(self.ambient * 2))
+        self.set('Fume_Temperature', round(self.fume))
+        self.set('Temperature_Motherboard', round((30 + self.fume / 10) * 2))
+
+    def _update_date(self):
+        date = time.localtime(self.clock.now() + self.date_offset)
+        self.set('Date_Time_Hours', date.tm_hour)
+        self.set('Date_Time_Minutes', date.tm_min)
+        self.set('Date_Day_Of_Month', date.tm_mday)
+        self.set('Date_Month', date.tm_mon)
+        self.set('Date_Year', date.tm_year)
+
+
+class DelayedSender:
+    """One thread sending the delayed answers of every stove in due order"""
+    def __init__(self):
+        self.queue = []
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, name="DelayedSender", daemon=True).start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def send_later(self, delay, connection, text):
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(self.queue, (time.monotonic() + delay, self.sequence, connection, text))
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                if not self.running:
+                    return
+                _, _, connection, text = heapq.heappop(self.queue)
+            try:
+                connection.send_text(text)
+            except OSError:
+                pass
+
+
+class StoveSimulator:
+    """Hundreds of simulated stoves, each on its own websocket port"""
+    def __init__(self, count, speed=1.0, latency=0.0, jitter=0.0, drop_rate=0.0, disconnect_rate=0.0,
+                 alarm_rate=0.0, host="127.0.0.1", base_port=0, seed=None):
+        """
+        Args:
+            speed: simulated seconds per real second
+            latency, jitter: answers are sent latency + uniform(0, jitter) seconds after the request
+            drop_rate: probability that an answer is never sent
+            disconnect_rate: probability that the stove closes the websocket instead of answering
+            base_port: stove i listens on base_port + i, 0 for free ports
+        """
+        self.clock = SimulatedClock(speed)
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.disconnect_rate = disconnect_rate
+        self.sender = DelayedSender()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.answers = 0
+        self.dropped = 0
+        self.disconnects = 0
+        self.stoves = [SimulatedStove(self.clock, seed=self.random.random(), alarm_rate=alarm_rate)
+                       for _ in range(count)]
+        self.servers = [WebsocketServer(lambda connection, text, stove=stove: self.on_message(stove, connection, text),
+                                        host=host, port=base_port + index if base_port else 0)
+                        for index, stove in enumerate(self.stoves)]
+
+    def start(self):
+        self.sender.start()
+        for server in self.servers:
+            server.start()
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+        self.sender.stop()
+
+    @property
+    def ports(self):
+        return [server.port for server in self.servers]
+
+    def on_message(self, stove, connection, text):
+        with self.lock:
+            self.requests += 1
+            disconnect = self.random.random() < self.disconnect_rate
+            drop = not disconnect and self.random.random() < self.drop_rate
+            delay = self.latency + self.random.uniform(0, self.jitter) if self.jitter else self.latency
+        if disconnect:
+            with self.lock:
+                self.disconnects += 1
+            connection.close()
+            return
+        answer = stove.handle(text)
+        if answer is None:
+            return
+        with self.lock:
+            if drop:
+                self.dropped += 1
+                return
+            self.answers += 1
+        if delay > 0:
+            self.sender.send_later(delay, connection, answer)
+        else:
+            connection.send_text(answer)
+
+    def stove_options(self, prefix="Maestro"):
+        """STOVES option of the local gateway for these stoves, the first one excluded (main configuration)"""
+        return [{'MCZip': server.host, 'MCZport': str(server.port), 'DEVICE_ID': f'sim_{index}',
+                 'DEVICE_NAME': f'Simulated stove {index}', 'MQTT_TOPIC_PUB': f'{prefix}/{index}/',
+                 'MQTT_TOPIC_SUB': f'{prefix}/{index}/Command/'}
+                for index, server in enumerate(self.servers)][1:]
+
+    def metrics(self):
+        """Return counters: requests received, answers sent, answers dropped, disconnections and stoves per state"""
+        states = {}
+        now = self.clock.now()
+        for stove in self.stoves:
+            with stove.lock:
+                stove.advance(now)
+            states[stove.state] = states.get(stove.state, 0) + 1
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'answers': self.answers,
+                'dropped': self.dropped,
+                'disconnects': self.disconnects,
+                'states': dict(sorted(states.items())),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stoves', type=int, default=1)
+    parser.add_argument('--speed', type=float, default=1.0, help='simulated seconds per second')
+    parser.add_argument('--latency', type=float, default=0.0, help='answer delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra delay in seconds')
+    parser.add_argument('--drop', type=float, default=0.0, help='probability of a dropped answer')
+    parser.add_argument('--disconnect', type=float, default=0.0, help='probability of a disconnection per request')
+    parser.add_argument('--alarm-rate', type=float, default=0.0, help='probability of a failed ignition')
+    parser.add_argument('--chronostat', action='store_true', help='follow the daily heating program without commands')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--base-port', type=int, default=0, help='first port, free ports by default')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    simulator = StoveSimulator(args.stoves, speed=args.speed, latency=args.latency, jitter=args.jitter,
+                               drop_rate=args.drop, disconnect_rate=args.disconnect, alarm_rate=args.alarm_rate,
+                               host=args.host, base_port=args.base_port, seed=args.seed)
+    if args.chronostat:
+        for stove in simulator.stoves:
+            stove.set('Chronostat', 1)
+    simulator.start()
+    print(f"🔥 {args.stoves} simulated stoves, first one on {args.host}:{simulator.ports[0]} (MCZip / MCZport)", flush=True)
+    if args.stoves > 1:
+        print("STOVES=" + json.dumps(simulator.stove_options()), flush=True)
+    try:
+        while True:
+            time.sleep(10)
+            print(time.strftime('%Y-%m-%d %H:%M', time.localtime(simulator.clock.now())), simulator.metrics(), flush=True)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# coding: utf-8
+"""
+Minimal websocket server (RFC 6455, text frames only) used as a local stand-in
+for the stove's embedded server in benchmarks. Standard library only.
+"""
+
+import base64
+import hashlib
+import socket
+import struct
+import threading
+
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class WebsocketConnection:
+    """One accepted client connection"""
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def handshake(self):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                return False
+            request += chunk
+        key = None
+        for line in request.decode("latin-1").split("\r\n"):
+            if line.lower().startswith("sec-websocket-key:"):
+                key = line.split(":", 1)[1].strip()
+        if key is None:
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + _GUID).encode()).digest()).decode()
+        self.sock.sendall(("HTTP/1.1 101 Switching Protocols\r\n"
+                           "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                           f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        return True
+
+    def _recv_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("closed")
+            data += chunk
+        return data
+
+    def read_frame(self):
+        """Return (opcode, payload bytes)"""
+        first, second = self._recv_exact(2)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._recv_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._recv_exact(8))[0]
+        mask = self._recv_exact(4) if second & 0x80 else None
+        payload = self._recv_exact(length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return opcode, payload
+
+    def send_frame(self, opcode, payload):
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([length])
+        elif length < 65536:
+            header += bytes([126]) + struct.pack("!H", length)
+        else:
+            header += bytes([127]) + struct.pack("!Q", length)
+        with self.lock:
+            if not self.closed:
+                self.sock.sendall(header + payload)
+
+    def send_text(self, text):
+        self.send_frame(0x1, text.encode())
+
+    def close(self):
+        try:
+            self.send_frame(0x8, b"")
+        except OSError:
+            pass
+        self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class WebsocketServer:
+    """Accepts websocket clients and calls on_message(connection, text) for every text frame"""
+    def __init__(self, on_message, host="127.0.0.1", port=0, on_connect=None):
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.listen(512)
+        self.host, self.port = self.sock.getsockname()
+        self.connections = []
+        self.running = False
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}"
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        for connection in list(self.connections):
+            connection.close()
+
+    def _accept(self):
+        while self.running:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(WebsocketConnection(client),), daemon=True).start()
+
+    def _serve(self, connection):
+        try:
+            if not connection.handshake():
+                connection.close()
+                return
+            self.connections.append(connection)
+            if self.on_connect:
+                self.on_connect(connection)
+            while self.running and not connection.closed:
+                opcode, payload = connection.read_frame()
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    connection.send_frame(0xA, payload)
+                elif opcode == 0x1:
+                    self.on_message(connection, payload.decode())
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            connection.close()
+            if connection in self.connections:
+                self.connections.remove(connection)